@@ -0,0 +1,323 @@
+import argparse
+import functools
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+import bcoding
+
+from benchmarks.torrents import SyntheticTorrent
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+REPEAT = 5
+# A change smaller than this is noise
+THRESHOLD = 0.10
+
+STORAGE_SIZE = 32 << 20
+MANY_FILES = 50_000
+VALIDATE_SIZE = 64 << 20
+HUGE_TORRENT_SIZE = 16 << 30
+BITFIELD_PIECES = 1 << 20
+COMPACT_PEERS = 10_000
+
+# name -> setup(workdir) returning the function to time
+CASES = {}
+
+
+def case(name: str):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+
+    return register
+
+
+class _PieceStatus:
+    """Just what the bitfield code reads from a StorageManager"""
+
+    def __init__(self, total_pieces: int):
+        rng = random.Random(0)
+        self.total_pieces = total_pieces
+        self.piece_length = 16384
+        self.pieces_status = [rng.random() < 0.5 for _ in range(total_pieces)]
+
+
+@functools.lru_cache(maxsize=None)
+def _storage(workdir: str, files: int):
+    from src.storage.file_manager import StorageManager
+
+    directory = os.path.join(workdir, f"storage-{files}")
+    torrent = SyntheticTorrent(directory, STORAGE_SIZE, files=files)
+    storage = StorageManager(torrent.info, directory)
+    middle = storage.total_pieces // 2
+    return storage, middle, storage.read_piece(middle, 0, storage.piece_size(middle))
+
+
+@case("storage.write_piece[1 file]")
+def _write_one_file(workdir):
+    storage, index, data = _storage(workdir, 1)
+    return lambda: storage.write_piece(index, data)
+
+
+@case(f"storage.write_piece[{MANY_FILES} files]")
+def _write_many_files(workdir):
+    storage, index, data = _storage(workdir, MANY_FILES)
+    return lambda: storage.write_piece(index, data)
+
+
+@case("storage.read_piece[1 file]")
+def _read_one_file(workdir):
+    storage, index, data = _storage(workdir, 1)
+    return lambda: storage.read_piece(index, 0, len(data))
+
+
+@case(f"storage.read_piece[{MANY_FILES} files]")
+def _read_many_files(workdir):
+    storage, index, data = _storage(workdir, MANY_FILES)
+    return lambda: storage.read_piece(index, 0, len(data))
+
+
+@case(f"storage.validate[{VALIDATE_SIZE >> 20} MiB]")
+def _validate(workdir):
+    from src.storage.file_manager import StorageManager
+
+    directory = os.path.join(workdir, "validate")
+    torrent = SyntheticTorrent(directory, VALIDATE_SIZE)
+    # Opening the torrent hashes every piece (_validate_existing_pieces)
+    return lambda: StorageManager(torrent.info, directory)
+
+
+def _info(size: int, files: int, piece_length: int = 256 * 1024) -> dict:
+    """Metadata of a multi-file torrent without any content"""
+    length = size // files
+    return {
+        "name": "huge",
+        "files": [
+            {"length": length, "path": ["dir", f"file{i:06d}.bin"]}
+            for i in range(files)
+        ],
+        "piece length": piece_length,
+        # Nothing is verified, so any bytes will do
+        "pieces": random.Random(0).randbytes(
+            -(-length * files // piece_length) * 20
+        ),
+    }
+
+
+@case(f"storage.open[{MANY_FILES} files, fresh download]")
+def _open_fresh(workdir):
+    from src.storage.file_manager import StorageManager
+
+    info = _info(STORAGE_SIZE, MANY_FILES)
+    directories = itertools.count()
+    return lambda: StorageManager(
+        info, os.path.join(workdir, "open", str(next(directories)))
+    )
+
+
+@case(f"parser.parse[{MANY_FILES} files, {HUGE_TORRENT_SIZE >> 30} GiB]")
+def _parse_huge(workdir):
+    from src.torrent.parser import TorrentFileParser
+
+    info = _info(HUGE_TORRENT_SIZE, MANY_FILES)
+    path = os.path.join(workdir, "huge.torrent")
+    with open(path, "wb") as f:
+        f.write(bcoding.bencode({"announce": "http://127.0.0.1:1/a", "info": info}))
+    return TorrentFileParser(path, workdir).parse
+
+
+@case(f"bitfield.get_bitfield[{BITFIELD_PIECES} pieces]")
+def _get_bitfield(workdir):
+    from src.storage.file_manager import StorageManager
+
+    status = _PieceStatus(BITFIELD_PIECES)
+    return lambda: StorageManager.get_bitfield(status)
+
+
+@case(f"bitfield.process_bitfield[{BITFIELD_PIECES} pieces]")
+def _process_bitfield(workdir):
+    from src.peer.connection import PeerConnection
+    from src.storage.file_manager import StorageManager
+
+    status = _PieceStatus(BITFIELD_PIECES)
+    payload = StorageManager.get_bitfield(status)
+    conn = PeerConnection(None, b"\x00" * 20, b"-PC0001-000000000000", status)
+    return lambda: conn.process_bitfield(payload)
+
+
+@case(f"tracker.decode_compact_peers[{COMPACT_PEERS} peers]")
+def _decode_peers(workdir):
+    from src.tracker.get_peers import decode_compact_peers
+
+    data = random.Random(0).randbytes(6 * COMPACT_PEERS)
+    return lambda: decode_compact_peers(data)
+
+
+@case(f"tracker.decode_compact_peers6[{COMPACT_PEERS} peers]")
+def _decode_peers6(workdir):
+    from src.tracker.get_peers import decode_compact_peers6
+
+    data = random.Random(0).randbytes(18 * COMPACT_PEERS)
+    return lambda: decode_compact_peers6(data)
+
+
+def measure(func, repeat: int = REPEAT) -> dict:
+    """Seconds per call: best and median of ``repeat`` timeit rounds"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return {"min": min(times), "median": statistics.median(times), "number": number}
+
+
+def run(names: list[str] | None = None, repeat: int = REPEAT, report=None) -> dict:
+    """Time the selected cases in a scratch directory; returns name -> timings"""
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="bt-micro-")
+    try:
+        for name in names if names is not None else list(CASES):
+            func = CASES[name](workdir)
+            results[name] = measure(func, repeat)
+            if report is not None:
+                report(name, results[name])
+    finally:
+        _storage.cache_clear()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def select(patterns: list[str]) -> list[str]:
+    """Cases whose name contains any of the patterns; all of them without any"""
+    if not patterns:
+        return list(CASES)
+    return [name for name in CASES if any(p in name for p in patterns)]
+
+
+def save_baseline(name: str, results: dict, directory: str = BASELINE_DIR) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.json")
+    baseline = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    return path
+
+
+def load_baseline(name: str, directory: str = BASELINE_DIR) -> dict:
+    with open(os.path.join(directory, f"{name}.json")) as f:
+        return json.load(f)
+
+
+def compare(results: dict, baseline: dict, threshold: float = THRESHOLD) -> list:
+    """(name, best, baseline best or None, relative change or None, verdict).
+
+    Best times are compared: they are the least disturbed by other load.
+    """
+    rows = []
+    for name, timing in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            rows.append((name, timing["min"], None, None, "new"))
+            continue
+        change = timing["min"] / before["min"] - 1
+        if change > threshold:
+            verdict = "slower"
+        elif change < -threshold:
+            verdict = "faster"
+        else:
+            verdict = ""
+        rows.append((name, timing["min"], before["min"], change, verdict))
+    return rows
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def format_comparison(rows: list) -> str:
+    width = max(len(row[0]) for row in rows)
+    lines = [f"{'case':<{width}}  {'best':>10}  {'baseline':>10}  {'change':>7}"]
+    for name, best, before, change, verdict in rows:
+        before = "-" if before is None else format_time(before)
+        change = "-" if change is None else f"{change * 100:+.1f}%"
+        lines.append(
+            f"{name:<{width}}  {format_time(best):>10}  {before:>10}  "
+            f"{change:>7}  {verdict}".rstrip()
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.micro",
+        description="Time the storage, parsing, bitfield and tracker hot paths",
+    )
+    parser.add_argument(
+        "cases", nargs="*", help="run only cases whose name contains one of these"
+    )
+    parser.add_argument("--list", action="store_true", help="list the cases")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--save", metavar="NAME", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare with a baseline")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="relative change that counts as a regression (default 0.10)",
+    )
+    args = parser.parse_args()
+
+    names = select(args.cases)
+    if args.list:
+        print("\n".join(names))
+        return
+    if not names:
+        parser.error("no case matches")
+    baseline = load_baseline(args.compare) if args.compare else None
+    if baseline is not None and baseline["python"] != platform.python_version():
+        print(
+            f"warning: baseline was taken with Python {baseline['python']}",
+            file=sys.stderr,
+        )
+
+    # Hash mismatches of the empty files created for a fresh download are
+    # expected here
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    def report(name, timing):
+        print(
+            f"{name}: best {format_time(timing['min'])}, "
+            f"median {format_time(timing['median'])} ({timing['number']} loops)",
+            file=sys.stderr,
+        )
+
+    results = run(names, args.repeat, report)
+    if args.save:
+        print(f"saved {save_baseline(args.save, results)}", file=sys.stderr)
+    if baseline is None:
+        rows = [(name, t["min"], None, None, "") for name, t in results.items()]
+        print(format_comparison(rows))
+        return
+    rows = compare(results, baseline, args.threshold)
+    print(format_comparison(rows))
+    if any(row[4] == "slower" for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import micro
+
+BASELINE_DIR = os.path.join(micro.BASELINE_DIR, "startup")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE = "src.cli.main"
+RUNS = 7
+# Imports only some runs need; startup should leave them out
+HEAVY = ("requests", "urllib3", "http.server", "ctypes")
+
+
+def import_times(module: str = MODULE) -> dict[str, tuple[int, int]]:
+    """A fresh interpreter's ``-X importtime`` report.
+
+    Maps each module imported to its (self, cumulative) time in µs.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def process_time(module: str = MODULE) -> float:
+    """Wall time of an interpreter that imports ``module`` and exits"""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=ROOT, check=True)
+    return time.perf_counter() - started
+
+
+def _timing(values: list[float]) -> dict:
+    return {"min": min(values), "median": statistics.median(values), "number": 1}
+
+
+def run(module: str = MODULE, runs: int = RUNS) -> tuple[dict, dict]:
+    """(results in the form micro.run returns, the fastest import report)"""
+    reports = [import_times(module) for _ in range(runs)]
+    best = min(reports, key=lambda report: report[module][1])
+    results = {
+        f"startup.import[{module}]": _timing(
+            [report[module][1] / 1e6 for report in reports]
+        ),
+        f"startup.process[{module}]": _timing(
+            [process_time(module) for _ in range(runs)]
+        ),
+    }
+    return results, best
+
+
+def format_report(report: dict, top: int = 10) -> str:
+    lines = [f"{'self':>9}  {'cumulative':>10}  heaviest imports"]
+    for name, (own, cumulative) in sorted(
+        report.items(), key=lambda item: item[1][0], reverse=True
+    )[:top]:
+        lines.append(f"{own / 1000:>7.1f}ms  {cumulative / 1000:>8.1f}ms  {name}")
+    loaded = [name for name in HEAVY if name in report]
+    lines.append(f"optional imports at startup: {', '.join(loaded) or 'none'}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.startup",
+        description="Measure the client's import time with -X importtime",
+    )
+    parser.add_argument("--module", default=MODULE, help="module to import")
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--top", type=int, default=10, help="imports to list")
+    parser.add_argument("--save", metavar="NAME", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare with a baseline")
+    parser.add_argument("--threshold", type=float, default=micro.THRESHOLD)
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        baseline = micro.load_baseline(args.compare, BASELINE_DIR)
+    results, report = run(args.module, args.runs)
+    if args.save:
+        path = micro.save_baseline(args.save, results, BASELINE_DIR)
+        print(f"saved {path}", file=sys.stderr)
+    print(format_report(report, args.top))
+    print()
+    if baseline is None:
+        rows = [(name, t["min"], None, None, "") for name, t in results.items()]
+    else:
+        rows = micro.compare(results, baseline, args.threshold)
+    print(micro.format_comparison(rows))
+    if any(row[4] == "slower" for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
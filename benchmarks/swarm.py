@@ -0,0 +1,240 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from benchmarks.torrents import SyntheticTorrent, parse_size
+from benchmarks.wanproxy import WanProxy
+
+POLL_INTERVAL = 0.005
+
+
+class _Tracker:
+    """Stands in for GetPeers: every downloader gets the seeders' addresses"""
+
+    addresses: list = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def peers(self):
+        return list(_Tracker.addresses), None, None
+
+
+class Downloader:
+    def __init__(self, loader, directory: str):
+        self.loader = loader
+        self.directory = directory
+        self.thread = threading.Thread(target=loader.handshake, daemon=True)
+        self.started = None
+        self.first_byte = None
+        self.finished = None
+
+    def poll(self, now: float):
+        if self.first_byte is None and self._downloaded() > 0:
+            self.first_byte = now - self.started
+        if self.finished is None and not self.thread.is_alive():
+            self.finished = now - self.started
+
+    def _downloaded(self) -> int:
+        choker = self.loader.choker
+        if choker is None:
+            return 0
+        return sum(getattr(peer, "downloaded", 0) for peer in choker.registered())
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def _peak_rss_mib() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+
+
+def run(
+    size: int,
+    piece_length: int = 256 * 1024,
+    files: int = 1,
+    seeders: int = 2,
+    downloaders: int = 1,
+    latency: float = 0.0,
+    bandwidth: float = 0,
+    timeout: float = 300,
+    workdir: str | None = None,
+) -> dict:
+    """Download one synthetic torrent from local seeders; returns the measurements.
+
+    Everything runs in this process over loopback. With ``latency`` or
+    ``bandwidth`` every seeder is reached through a WanProxy.
+    """
+    # Imported here so BITTORRENT_HOME can point at the scratch directory
+    from src.peer import handshake
+    from src.peer.seeder import SeederServer
+    from src.storage.file_manager import StorageManager
+
+    root = workdir or tempfile.mkdtemp(prefix="bt-bench-")
+    os.environ["BITTORRENT_HOME"] = os.path.join(root, "home")
+    seed_dir = os.path.join(root, "seed")
+    os.makedirs(seed_dir, exist_ok=True)
+    torrent = SyntheticTorrent(seed_dir, size, piece_length, files)
+
+    servers, proxies, swarm, downloads = [], [], [], []
+    try:
+        for i in range(seeders):
+            storage = StorageManager(torrent.info, seed_dir)
+            server = SeederServer(
+                torrent.info_hash,
+                f"-BS0001-{i:012d}".encode(),
+                storage,
+                port=0,
+                max_per_ip=downloaders + 1,
+            )
+            threading.Thread(target=server.start, daemon=True).start()
+            server.listening.wait(5)
+            servers.append(server)
+            address = ("127.0.0.1", server.port)
+            if latency or bandwidth:
+                proxy = WanProxy(address, latency, bandwidth).start()
+                proxies.append(proxy)
+                address = proxy.address
+            swarm.append(address)
+        _Tracker.addresses = swarm
+
+        cpu_before = sum(resource.getrusage(resource.RUSAGE_SELF)[:2])
+        started = time.monotonic()
+        with patch.object(handshake, "GetPeers", _Tracker):
+            for i in range(downloaders):
+                directory = os.path.join(root, f"leech{i}")
+                loader = handshake.HandShakeTCP(torrent.path, directory, seed=False)
+                downloads.append(Downloader(loader, directory))
+            for download in downloads:
+                download.started = time.monotonic()
+                download.thread.start()
+            deadline = started + timeout
+            while time.monotonic() < deadline:
+                now = time.monotonic()
+                for download in downloads:
+                    download.poll(now)
+                if all(d.finished is not None for d in downloads):
+                    break
+                time.sleep(POLL_INTERVAL)
+        elapsed = time.monotonic() - started
+        cpu = sum(resource.getrusage(resource.RUSAGE_SELF)[:2]) - cpu_before
+
+        for download in downloads:
+            download.loader.stop()
+            download.thread.join(5)
+        completed = [
+            d
+            for d in downloads
+            if d.finished is not None and torrent.matches(d.directory)
+        ]
+        finish_times = [d.finished for d in completed]
+        first_bytes = [d.first_byte for d in downloads if d.first_byte is not None]
+        transferred = size * len(completed)
+        return {
+            "size": size,
+            "piece_length": piece_length,
+            "files": files,
+            "seeders": seeders,
+            "downloaders": downloaders,
+            "latency": latency,
+            "bandwidth": bandwidth,
+            "completed": len(completed),
+            "elapsed": elapsed,
+            "mb_per_s": transferred / elapsed / 1e6 if elapsed else 0.0,
+            "cpu_s_per_gb": cpu / (transferred / 1e9) if transferred else None,
+            "peak_rss_mib": _peak_rss_mib(),
+            "ttfb_median": statistics.median(first_bytes) if first_bytes else None,
+            "completion_p50": _percentile(finish_times, 0.5) if finish_times else None,
+            "completion_p90": _percentile(finish_times, 0.9) if finish_times else None,
+            "completion_max": max(finish_times) if finish_times else None,
+        }
+    finally:
+        for proxy in proxies:
+            proxy.stop()
+        for server in servers:
+            server.stop()
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def format_report(result: dict) -> str:
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    cpu = result["cpu_s_per_gb"]
+    lines = [
+        f"{result['downloaders']} downloader(s) <- {result['seeders']} seeder(s), "
+        f"{result['size'] / 1e6:.1f} MB in {result['files']} file(s), "
+        f"{result['piece_length'] // 1024} KiB pieces",
+        f"  completed        {result['completed']}/{result['downloaders']}",
+        f"  throughput       {result['mb_per_s']:.1f} MB/s",
+        f"  CPU per GB       {'-' if cpu is None else f'{cpu:.2f}s'}",
+        f"  peak RSS         {result['peak_rss_mib']:.0f} MiB",
+        f"  first byte       {seconds(result['ttfb_median'])} (median)",
+        f"  completion       p50 {seconds(result['completion_p50'])}, "
+        f"p90 {seconds(result['completion_p90'])}, "
+        f"max {seconds(result['completion_max'])}",
+    ]
+    if result["latency"] or result["bandwidth"]:
+        lines.insert(
+            1,
+            f"  WAN emulation    {result['latency'] * 1000:.0f} ms one way, "
+            f"{result['bandwidth'] / 1e6:.1f} MB/s per connection",
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.swarm",
+        description="Download a synthetic torrent from local seeders over loopback",
+    )
+    parser.add_argument("--size", default="64M", help="torrent size (e.g. 64M, 1G)")
+    parser.add_argument("--piece-length", default="256K", help="piece length")
+    parser.add_argument("--files", type=int, default=1, help="number of files")
+    parser.add_argument("--seeders", type=int, default=2)
+    parser.add_argument("--downloaders", type=int, default=1)
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="one-way delay added by a proxy"
+    )
+    parser.add_argument(
+        "--bandwidth",
+        default="0",
+        help="per-connection bandwidth of the proxy per direction, e.g. 2M (bytes/s)",
+    )
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", action="store_true", help="print the raw results")
+    args = parser.parse_args()
+
+    # Keep warnings of the client itself off the report
+    logging.getLogger().addHandler(logging.NullHandler())
+    result = run(
+        parse_size(args.size),
+        parse_size(args.piece_length),
+        args.files,
+        args.seeders,
+        args.downloaders,
+        args.latency_ms / 1000,
+        parse_size(args.bandwidth),
+        args.timeout,
+    )
+    print(json.dumps(result, indent=2) if args.json else format_report(result))
+    if result["completed"] < args.downloaders:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import hashlib
+import os
+
+import bcoding
+
+CHUNK = 1 << 20
+
+
+def parse_size(text: str) -> int:
+    """'64M', '256K', '1G' or a plain byte count"""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper().removesuffix("B").removesuffix("I")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+class SyntheticTorrent:
+    """Random content of a given size split into files, with its .torrent.
+
+    Data is written and hashed in chunks, so even multi-gigabyte
+    torrents are generated in constant memory.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        size: int,
+        piece_length: int = 256 * 1024,
+        files: int = 1,
+        name: str = "synthetic",
+        announce: str = "http://127.0.0.1:1/announce",
+    ):
+        self.directory = directory
+        self.size = size
+        self.piece_length = piece_length
+        self.name = name
+        lengths = [size // files] * files
+        lengths[-1] += size - sum(lengths)
+        self.lengths = lengths
+        pieces = self._write_content()
+        if files == 1:
+            self.info = {"name": name, "length": size}
+        else:
+            self.info = {
+                "name": name,
+                "files": [
+                    {"length": length, "path": [f"file{i:06d}.bin"]}
+                    for i, length in enumerate(lengths)
+                ],
+            }
+        self.info["piece length"] = piece_length
+        self.info["pieces"] = pieces
+        self.info_hash = hashlib.sha1(bcoding.bencode(self.info)).digest()
+        self.path = os.path.join(directory, f"{name}.torrent")
+        with open(self.path, "wb") as f:
+            f.write(bcoding.bencode({"announce": announce, "info": self.info}))
+
+    def file_paths(self, root: str | None = None) -> list[str]:
+        root = root or self.directory
+        if len(self.lengths) == 1:
+            return [os.path.join(root, self.name)]
+        return [
+            os.path.join(root, self.name, f"file{i:06d}.bin")
+            for i in range(len(self.lengths))
+        ]
+
+    def _write_content(self) -> bytes:
+        paths = self.file_paths()
+        os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+        hashes = []
+        piece = hashlib.sha1()
+        in_piece = 0
+        for path, length in zip(paths, self.lengths):
+            with open(path, "wb") as f:
+                left = length
+                while left:
+                    # Never let a write cross a piece boundary
+                    n = min(CHUNK, left, self.piece_length - in_piece)
+                    data = os.urandom(n)
+                    f.write(data)
+                    piece.update(data)
+                    in_piece += n
+                    left -= n
+                    if in_piece == self.piece_length:
+                        hashes.append(piece.digest())
+                        piece = hashlib.sha1()
+                        in_piece = 0
+        if in_piece:
+            hashes.append(piece.digest())
+        return b"".join(hashes)
+
+    def matches(self, root: str) -> bool:
+        """Whether ``root`` holds a byte-identical copy of the content"""
+        for original, copy in zip(self.file_paths(), self.file_paths(root)):
+            if not os.path.exists(copy):
+                return False
+            with open(original, "rb") as a, open(copy, "rb") as b:
+                while True:
+                    chunk = a.read(CHUNK)
+                    if chunk != b.read(CHUNK):
+                        return False
+                    if not chunk:
+                        break
+        return True
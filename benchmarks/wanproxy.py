@@ -0,0 +1,110 @@
+import collections
+import socket
+import threading
+import time
+
+CHUNK = 16 * 1024
+
+
+class _Pipe:
+    """One direction of a proxied connection: delays and paces the bytes"""
+
+    def __init__(self, source, sink, latency: float, bandwidth: float):
+        self.source = source
+        self.sink = sink
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._queue = collections.deque()
+        self._ready = threading.Condition()
+        self._closed = False
+
+    def start(self):
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def _read(self):
+        try:
+            while True:
+                data = self.source.recv(CHUNK)
+                if not data:
+                    break
+                with self._ready:
+                    self._queue.append((time.monotonic() + self.latency, data))
+                    self._ready.notify()
+        except OSError:
+            pass
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+
+    def _write(self):
+        # The link is free again at this time, given the bandwidth
+        free_at = time.monotonic()
+        try:
+            while True:
+                with self._ready:
+                    while not self._queue and not self._closed:
+                        self._ready.wait()
+                    if not self._queue:
+                        break
+                    deliver_at, data = self._queue.popleft()
+                now = time.monotonic()
+                if self.bandwidth:
+                    free_at = max(free_at, now) + len(data) / self.bandwidth
+                    deliver_at = max(deliver_at, free_at)
+                if deliver_at > now:
+                    time.sleep(deliver_at - now)
+                self.sink.sendall(data)
+        except OSError:
+            pass
+        finally:
+            try:
+                self.sink.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+
+class WanProxy:
+    """Loopback TCP proxy that makes a local peer look like a distant one.
+
+    Every byte is held back by ``latency`` seconds (one way) and each
+    direction of each connection is paced to ``bandwidth`` bytes/s
+    (0 = unlimited).
+    """
+
+    def __init__(self, target: tuple, latency: float = 0.0, bandwidth: float = 0):
+        self.target = target
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.running = False
+
+    @property
+    def address(self) -> tuple:
+        return "127.0.0.1", self.port
+
+    def start(self):
+        """Accept connections in a background thread"""
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.server.close()
+
+    def _accept(self):
+        while self.running:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            try:
+                upstream = socket.create_connection(self.target, timeout=5)
+                upstream.settimeout(None)
+            except OSError:
+                client.close()
+                continue
+            _Pipe(client, upstream, self.latency, self.bandwidth).start()
+            _Pipe(upstream, client, self.latency, self.bandwidth).start()
@@ -1,70 +1,301 @@
 import argparse
 import logging
+import os
+import queue
+import signal
 import threading
+from logging.handlers import QueueHandler, QueueListener
 
-from src.peer.handshake import HandShakeTCP
-from src import state
+from src.dht.node import DHTNode
+from src.metrics import MetricsServer
+from src.peer.ratelimit import RateLimits
+from src.peer.seeder import PeerListener
+from src.progress.display import ProgressDisplay
+from src.rpc import RPCServer
+from src.session import (
+    MAX_ACTIVE_DOWNLOADS,
+    MAX_ACTIVE_SEEDS,
+    MAX_HALF_OPEN,
+    MAX_PEERS,
+    Session,
+)
+from src.storage.file_manager import CHECK_BACKGROUND, CHECK_FULL, CHECK_SKIP
+from src.storage.paths import data_dir
+from src import profiling, state
 
 
-def setup_logging():
-    logging.basicConfig(
-        filename="bittorrent.log",
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        datefmt="%H:%M:%S",
-    )
-
+def setup_logging(level: int = logging.INFO) -> QueueListener:
+    """Log to bittorrent.log from a background thread.
 
-def download_torrent(source, destination, seed=True):
-    loader = HandShakeTCP(source, destination, seed=seed)
-    loader.handshake()
+    Records are handed over through a queue, so threads moving data never
+    wait on the log file. Stop the returned listener to flush it on exit.
+    """
+    handler = logging.FileHandler("bittorrent.log")
+    handler.setFormatter(
+        logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt="%H:%M:%S"
+        )
+    )
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return listener
 
 
-def keyboard_listener():
-    """Listen for keyboard commands: p=pause, r=resume, q=quit"""
-    print("\nControls: [p]ause  [r]esume  [q]uit")
+def keyboard_listener(limits=None, display=None):
+    """Listen for keyboard commands: p=pause, r=resume, q=quit,
+    u N / d N = set the upload / download limit to N KiB/s (0 = unlimited)"""
+    # Printing straight to the terminal would tear the progress display
+    notify = display.message if display is not None else print
+    notify("Controls: [p]ause  [r]esume  [q]uit  [u|d] <KiB/s>")
     while not state.is_stopped():
         try:
             cmd = input().strip().lower()
             if cmd == "p":
                 state.pause()
+                notify("⏸ Paused")
             elif cmd == "r":
                 state.resume()
+                notify("⏵ Resumed")
             elif cmd == "q":
                 state.stop()
+                notify("⏹ Stopped")
+            elif cmd[:1] in ("u", "d") and limits is not None:
+                try:
+                    rate = float(cmd[1:]) * 1024
+                except ValueError:
+                    notify("Usage: u <KiB/s> or d <KiB/s>")
+                    continue
+                if cmd[0] == "u":
+                    limits.set_limits(upload=rate)
+                else:
+                    limits.set_limits(download=rate)
         except EOFError:
             break
 
 
 def main():
-    setup_logging()
-    logger = logging.getLogger(__name__)
-    logger.info("Application started")
-
     parser = argparse.ArgumentParser(prog="BitTorrent")
-    parser.add_argument("sources", nargs="+", help="paths to .torrent files")
+    parser.add_argument("sources", nargs="*", help="paths to .torrent files")
     parser.add_argument("-d", "--destination", help="destination folder to save files")
     parser.add_argument(
         "--no-seed", action="store_true", help="don't seed after download"
     )
+    parser.add_argument(
+        "--super-seed",
+        action="store_true",
+        help="reveal pieces one at a time when seeding new content (BEP 16)",
+    )
+    parser.add_argument(
+        "--no-dht", action="store_true", help="don't use the DHT to find peers"
+    )
+    for scope, help_scope in (
+        ("", "in total"),
+        ("torrent-", "per torrent"),
+        ("peer-", "per peer"),
+    ):
+        for direction in ("upload", "download"):
+            parser.add_argument(
+                f"--{scope}{direction}-limit",
+                type=float,
+                default=0,
+                metavar="KIB/S",
+                help=f"maximum {direction} rate {help_scope} (0 = unlimited)",
+            )
+
+    parser.add_argument(
+        "--max-active-downloads",
+        type=int,
+        default=MAX_ACTIVE_DOWNLOADS,
+        metavar="N",
+        help="torrents downloading at once; the rest are queued",
+    )
+    parser.add_argument(
+        "--max-active-seeds",
+        type=int,
+        default=MAX_ACTIVE_SEEDS,
+        metavar="N",
+        help="torrents seeding at once; the rest wait for a slot",
+    )
+    parser.add_argument(
+        "--max-peers",
+        type=int,
+        default=MAX_PEERS,
+        metavar="N",
+        help="peer connections in total across all torrents",
+    )
+    parser.add_argument(
+        "--max-half-open",
+        type=int,
+        default=MAX_HALF_OPEN,
+        metavar="N",
+        help="outgoing connection attempts in progress at once",
+    )
+
+    check = parser.add_mutually_exclusive_group()
+    check.add_argument(
+        "--skip-check",
+        dest="check",
+        action="store_const",
+        const=CHECK_SKIP,
+        default=CHECK_FULL,
+        help="don't hash data already on disk; trust the pieces its resume data "
+        "lists as verified (without resume data everything is checked)",
+    )
+    check.add_argument(
+        "--background-check",
+        dest="check",
+        action="store_const",
+        const=CHECK_BACKGROUND,
+        help="hash data already on disk while already connecting to peers",
+    )
+
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running without a terminal, controlled over --rpc-socket",
+    )
+    parser.add_argument(
+        "--rpc-socket",
+        metavar="PATH",
+        help="Unix socket for JSON-RPC control (default in daemon mode: "
+        "rpc.sock in the data directory)",
+    )
+    parser.add_argument(
+        "--watch-dir",
+        metavar="PATH",
+        help="add .torrent files dropped into this directory (implies --daemon)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="serve Prometheus metrics on localhost:PORT/metrics "
+        "(JSON at /metrics.json)",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="log level of bittorrent.log; DEBUG adds a line per block",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time receiving, hashing, disk access and sending, and log "
+        "the latency histograms on exit",
+    )
 
     args = parser.parse_args()
 
+    log_listener = setup_logging(getattr(logging, args.log_level))
+    logger = logging.getLogger(__name__)
+    logger.info("Application started")
+    if args.profile:
+        profiling.enable()
+    if args.watch_dir:
+        args.daemon = True
+    if not args.sources and not args.daemon:
+        parser.error("at least one .torrent file is required without --daemon")
+
     state.reset()
 
-    kb_thread = threading.Thread(target=keyboard_listener, daemon=True)
-    kb_thread.start()
+    limits = RateLimits(args.upload_limit * 1024, args.download_limit * 1024)
+    limits.set_peer_limits(
+        args.peer_upload_limit * 1024, args.peer_download_limit * 1024
+    )
+
+    if args.daemon:
+        signal.signal(signal.SIGTERM, lambda signum, frame: state.stop())
+
+    dht = None
+    if not args.no_dht:
+        dht = DHTNode(state_path=os.path.join(data_dir(), "dht.json"))
+        try:
+            dht.start()
+        except OSError as e:
+            logger.error(f"Failed to start DHT node: {e}")
+            dht = None
+
+    # One listening port serves every torrent, dispatched by info_hash
+    listener = None
+    if not args.no_seed:
+        listener = PeerListener(max_connections=args.max_peers)
+        threading.Thread(target=listener.start, daemon=True).start()
+
+    session = Session(
+        seed=not args.no_seed,
+        dht=dht,
+        listener=listener,
+        super_seed=args.super_seed,
+        limits=limits,
+        torrent_upload=args.torrent_upload_limit * 1024,
+        torrent_download=args.torrent_download_limit * 1024,
+        max_active_downloads=args.max_active_downloads,
+        max_active_seeds=args.max_active_seeds,
+        max_peers=args.max_peers,
+        max_half_open=args.max_half_open,
+        check=args.check,
+    )
+    # A daemon waits for torrents added over RPC once its own are done
+    session.persistent = args.daemon
+    for source in args.sources:
+        session.add(source, args.destination)
+
+    rpc = None
+    rpc_path = args.rpc_socket
+    if rpc_path is None and args.daemon:
+        rpc_path = os.path.join(data_dir(), "rpc.sock")
+    if rpc_path is not None:
+        rpc = RPCServer(session, rpc_path, listener)
+        threading.Thread(target=rpc.start, daemon=True).start()
+
+    metrics = None
+    if args.metrics_port is not None:
+        metrics = MetricsServer(session, listener, args.metrics_port)
+        threading.Thread(target=metrics.start, daemon=True).start()
+
+    watcher = None
+    if args.watch_dir:
+        # inotify goes through ctypes, which only a watch directory needs
+        from src.watch import DirectoryWatcher
+
+        watcher = DirectoryWatcher(session, args.watch_dir, args.destination)
+        threading.Thread(target=watcher.start, daemon=True).start()
+
+    # A daemon has no one watching; piped output gets periodic log lines
+    display = None
+    if not args.daemon:
+        display = ProgressDisplay(session)
+        display_thread = threading.Thread(target=display.start, daemon=True)
+        display_thread.start()
+        threading.Thread(
+            target=keyboard_listener, args=(limits, display), daemon=True
+        ).start()
+
+    session.run()
+
+    if display is not None:
+        display.stop()
+        display_thread.join(1)
+    if watcher is not None:
+        watcher.stop()
+    if metrics is not None:
+        metrics.stop()
+    if rpc is not None:
+        rpc.stop()
 
-    threads = []
-    for i, source in enumerate(args.sources):
-        dest = args.destination
-        seed = not args.no_seed
-        thread = threading.Thread(target=download_torrent, args=(source, dest, seed))
-        thread.start()
-        threads.append(thread)
+    if listener is not None:
+        listener.stop()
+    if dht is not None:
+        dht.stop()
 
-    for thread in threads:
-        thread.join()
+    if profiling.snapshot():
+        logger.info(f"Stage latencies:\n{profiling.dump()}")
+    log_listener.stop()
 
     if state.is_stopped():
         print("\nDownload stopped. Progress saved - run again to resume")
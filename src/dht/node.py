@@ -0,0 +1,416 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcoding
+
+from src.dht.routing_table import K, RoutingTable, distance
+
+logger = logging.getLogger(__name__)
+
+BOOTSTRAP_NODES = [
+    ("router.bittorrent.com", 6881),
+    ("dht.transmissionbt.com", 6881),
+    ("router.utorrent.com", 6881),
+]
+
+ALPHA = 3
+QUERY_TIMEOUT = 2.0
+TOKEN_ROTATE_INTERVAL = 5 * 60
+PEER_TTL = 30 * 60
+BUCKET_REFRESH_INTERVAL = 15 * 60
+SAVE_INTERVAL = 10 * 60
+REBOOTSTRAP_INTERVAL = 60
+MAX_VALUES = 50
+
+
+def _raw(value) -> bytes:
+    """bcoding decodes valid UTF-8 strings to str; binary fields need bytes"""
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return value
+
+
+def encode_nodes(nodes) -> bytes:
+    """Compact node info: 20-byte id + 4-byte IPv4 + 2-byte port"""
+    data = bytearray()
+    for node in nodes:
+        try:
+            ip = socket.inet_aton(node.address[0])
+        except OSError:
+            continue
+        data += node.node_id + ip + struct.pack("!H", node.address[1])
+    return bytes(data)
+
+
+def decode_nodes(data: bytes) -> list[tuple[bytes, tuple[str, int]]]:
+    nodes = []
+    for i in range(0, len(data) - 25, 26):
+        node_id = data[i: i + 20]
+        ip = socket.inet_ntoa(data[i + 20: i + 24])
+        port = struct.unpack("!H", data[i + 24: i + 26])[0]
+        if port:
+            nodes.append((node_id, (ip, port)))
+    return nodes
+
+
+def encode_peer(address: tuple) -> bytes:
+    return socket.inet_aton(address[0]) + struct.pack("!H", address[1])
+
+
+def decode_peer(data: bytes) -> tuple[str, int] | None:
+    if len(data) != 6:
+        return None
+    return socket.inet_ntoa(data[:4]), struct.unpack("!H", data[4:])[0]
+
+
+class DHTNode:
+    """Mainline DHT (BEP 5) node used as a trackerless peer source"""
+
+    def __init__(
+        self,
+        port: int = 6889,
+        host: str = "0.0.0.0",
+        state_path: str | None = None,
+        bootstrap_nodes: list[tuple[str, int]] | None = None,
+    ):
+        self.host = host
+        self.port = port
+        self.state_path = state_path
+        self.bootstrap_nodes = list(
+            BOOTSTRAP_NODES if bootstrap_nodes is None else bootstrap_nodes
+        )
+        self.node_id = os.urandom(20)
+        self.routing_table = RoutingTable(self.node_id)
+        self.sock = None
+        self.running = False
+
+        self._pending = {}
+        self._transaction_id = random.randint(0, 0xFFFF)
+        self._saved_nodes = []
+        self._peer_store: dict[bytes, dict[tuple, float]] = {}
+        self._secret = os.urandom(16)
+        self._previous_secret = self._secret
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Bind the UDP socket and start the receive and maintenance threads"""
+        self._load_state()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.host, self.port))
+        self.sock.settimeout(0.5)
+        self.port = self.sock.getsockname()[1]
+        self.running = True
+        self._stopped.clear()
+        for target in (self._receive_loop, self._maintenance_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"DHT node {self.node_id.hex()[:8]} listening on UDP port {self.port}")
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self._stopped.set()
+        self.save_state()
+        try:
+            # shutdown() wakes the receive thread blocked in recvfrom()
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        logger.info("DHT node stopped")
+
+    # Public API
+
+    def bootstrap(self):
+        """Populate the routing table from saved and well-known nodes"""
+        addresses = []
+        for host, port in self._saved_nodes + self.bootstrap_nodes:
+            try:
+                addresses.append((socket.gethostbyname(host), port))
+            except OSError:
+                continue
+
+        with ThreadPoolExecutor(ALPHA) as pool:
+            list(
+                pool.map(
+                    lambda address: self._query(
+                        address, "find_node", {"target": self.node_id}
+                    ),
+                    addresses,
+                )
+            )
+        self._lookup(self.node_id, "find_node")
+        logger.info(f"DHT bootstrap finished with {len(self.routing_table)} nodes")
+
+    def get_peers(self, info_hash: bytes) -> list[tuple[str, int]]:
+        _, _, peers = self._lookup(info_hash, "get_peers")
+        logger.info(f"DHT found {len(peers)} peers for {info_hash.hex()}")
+        return peers
+
+    def announce_peer(self, info_hash: bytes, port: int) -> int:
+        """Announce that we serve ``info_hash`` on ``port``; returns node count"""
+        nodes, tokens, _ = self._lookup(info_hash, "get_peers")
+        announced = 0
+        for node_id, address in nodes:
+            token = tokens.get(node_id)
+            if token is None:
+                continue
+            args = {"info_hash": info_hash, "port": port, "token": token, "implied_port": 0}
+            if self._query(address, "announce_peer", args) is not None:
+                announced += 1
+        logger.info(f"DHT announced {info_hash.hex()} to {announced} nodes")
+        return announced
+
+    # Persistence
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        nodes = [
+            [node.node_id.hex(), node.address[0], node.address[1]]
+            for node in self.routing_table.nodes()
+            if not node.bad
+        ]
+        try:
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w") as fh:
+                json.dump({"id": self.node_id.hex(), "nodes": nodes}, fh)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.error(f"Failed to save DHT state: {e}")
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as fh:
+                saved = json.load(fh)
+            self.node_id = bytes.fromhex(saved["id"])
+            self.routing_table = RoutingTable(self.node_id)
+            # Saved nodes are only contacted; they enter the table once they reply
+            self._saved_nodes = [(ip, port) for _, ip, port in saved.get("nodes", [])]
+            logger.info(f"Loaded DHT state with {len(self._saved_nodes)} nodes")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Failed to load DHT state: {e}")
+
+    # KRPC
+
+    def _send(self, message: dict, address: tuple):
+        try:
+            self.sock.sendto(bcoding.bencode(message), address)
+        except OSError as e:
+            logger.debug(f"DHT send to {address} failed: {e}")
+
+    def _next_transaction_id(self) -> bytes:
+        with self._lock:
+            self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+            return struct.pack("!H", self._transaction_id)
+
+    def _query(self, address: tuple, query: str, args: dict, timeout: float = QUERY_TIMEOUT):
+        transaction_id = self._next_transaction_id()
+        entry = {"address": address, "event": threading.Event(), "response": None}
+        with self._lock:
+            self._pending[transaction_id] = entry
+
+        args = dict(args, id=self.node_id)
+        self._send({"t": transaction_id, "y": "q", "q": query, "a": args}, address)
+        entry["event"].wait(timeout)
+
+        with self._lock:
+            self._pending.pop(transaction_id, None)
+        return entry["response"]
+
+    def _receive_loop(self):
+        while self.running:
+            try:
+                data, address = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not data:
+                continue
+            try:
+                message = bcoding.bdecode(data)
+                kind = message.get("y")
+                if kind == "q":
+                    self._handle_query(message, address)
+                elif kind in ("r", "e"):
+                    self._handle_response(message, address)
+            except Exception as e:
+                logger.debug(f"Malformed DHT message from {address}: {e}")
+
+    def _handle_response(self, message: dict, address: tuple):
+        transaction_id = _raw(message.get("t", b""))
+        with self._lock:
+            entry = self._pending.get(transaction_id)
+        if entry is None or entry["address"] != address:
+            return
+
+        if message["y"] == "r":
+            response = message.get("r", {})
+            node_id = _raw(response.get("id", b""))
+            self.routing_table.insert(node_id, address)
+            entry["response"] = response
+        entry["event"].set()
+
+    def _handle_query(self, message: dict, address: tuple):
+        transaction_id = _raw(message.get("t", b""))
+        query = message.get("q")
+        args = message.get("a", {})
+        sender_id = _raw(args.get("id", b""))
+        if len(sender_id) != 20:
+            self._send_error(transaction_id, 203, "Invalid node id", address)
+            return
+        self.routing_table.insert(sender_id, address)
+
+        response = {"id": self.node_id}
+        if query == "ping":
+            pass
+        elif query == "find_node":
+            target = _raw(args["target"])
+            response["nodes"] = encode_nodes(self.routing_table.closest(target))
+        elif query == "get_peers":
+            info_hash = _raw(args["info_hash"])
+            response["token"] = self._token(address[0], self._secret)
+            response["nodes"] = encode_nodes(self.routing_table.closest(info_hash))
+            values = self._stored_peers(info_hash)
+            if values:
+                response["values"] = [encode_peer(peer) for peer in values]
+        elif query == "announce_peer":
+            info_hash = _raw(args["info_hash"])
+            token = _raw(args.get("token", b""))
+            if token not in (
+                self._token(address[0], self._secret),
+                self._token(address[0], self._previous_secret),
+            ):
+                self._send_error(transaction_id, 203, "Bad token", address)
+                return
+            port = address[1] if args.get("implied_port") else args["port"]
+            with self._lock:
+                self._peer_store.setdefault(info_hash, {})[(address[0], port)] = time.time()
+        else:
+            self._send_error(transaction_id, 204, "Method Unknown", address)
+            return
+
+        self._send({"t": transaction_id, "y": "r", "r": response}, address)
+
+    def _send_error(self, transaction_id: bytes, code: int, text: str, address: tuple):
+        self._send({"t": transaction_id, "y": "e", "e": [code, text]}, address)
+
+    def _token(self, ip: str, secret: bytes) -> bytes:
+        return hashlib.sha1(secret + ip.encode()).digest()[:8]
+
+    def _stored_peers(self, info_hash: bytes) -> list[tuple[str, int]]:
+        with self._lock:
+            peers = list(self._peer_store.get(info_hash, {}))
+        random.shuffle(peers)
+        return peers[:MAX_VALUES]
+
+    # Iterative lookup
+
+    def _lookup(self, target: bytes, query: str):
+        """Iteratively query the nodes closest to ``target``.
+
+        Returns the K closest responding nodes as (node_id, address), the
+        announce tokens they handed out and, for get_peers, any peers found.
+        """
+        arg_name = "info_hash" if query == "get_peers" else "target"
+        shortlist = {
+            node.node_id: node.address for node in self.routing_table.closest(target)
+        }
+        queried = set()
+        responded = {}
+        tokens = {}
+        peers = []
+
+        def by_distance(node_id):
+            return distance(node_id, target)
+
+        with ThreadPoolExecutor(ALPHA) as pool:
+            while True:
+                closest = sorted(shortlist, key=by_distance)[:K]
+                batch = [node_id for node_id in closest if node_id not in queried][:ALPHA]
+                if not batch:
+                    break
+
+                futures = {
+                    node_id: pool.submit(
+                        self._query, shortlist[node_id], query, {arg_name: target}
+                    )
+                    for node_id in batch
+                }
+                for node_id, future in futures.items():
+                    queried.add(node_id)
+                    response = future.result()
+                    if response is None:
+                        self.routing_table.mark_failed(node_id)
+                        shortlist.pop(node_id, None)
+                        continue
+
+                    responded[node_id] = shortlist[node_id]
+                    if "token" in response:
+                        tokens[node_id] = _raw(response["token"])
+                    for value in response.get("values", []):
+                        peer = decode_peer(_raw(value))
+                        if peer and peer not in peers:
+                            peers.append(peer)
+                    for found_id, address in decode_nodes(_raw(response.get("nodes", b""))):
+                        if found_id != self.node_id and found_id not in queried:
+                            shortlist.setdefault(found_id, address)
+
+        nodes = [(node_id, responded[node_id]) for node_id in sorted(responded, key=by_distance)[:K]]
+        return nodes, tokens, peers
+
+    # Maintenance
+
+    def _maintenance_loop(self):
+        last_rotate = last_save = time.time()
+        last_bootstrap = 0.0
+        while self.running:
+            now = time.time()
+            try:
+                if len(self.routing_table) == 0 and now - last_bootstrap > REBOOTSTRAP_INTERVAL:
+                    last_bootstrap = now
+                    self.bootstrap()
+
+                if now - last_rotate > TOKEN_ROTATE_INTERVAL:
+                    last_rotate = now
+                    self._previous_secret, self._secret = self._secret, os.urandom(16)
+                    self._expire_peers(now)
+
+                for bucket in self.routing_table.stale_buckets(BUCKET_REFRESH_INTERVAL):
+                    bucket.last_changed = now
+                    target = random.randrange(bucket.low, bucket.high).to_bytes(20, "big")
+                    self._lookup(target, "find_node")
+
+                if now - last_save > SAVE_INTERVAL:
+                    last_save = now
+                    self.save_state()
+            except Exception as e:
+                logger.error(f"DHT maintenance error: {e}")
+            self._stopped.wait(1)
+
+    def _expire_peers(self, now: float):
+        with self._lock:
+            for info_hash in list(self._peer_store):
+                peers = self._peer_store[info_hash]
+                for peer, seen in list(peers.items()):
+                    if now - seen > PEER_TTL:
+                        del peers[peer]
+                if not peers:
+                    del self._peer_store[info_hash]
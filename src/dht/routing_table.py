@@ -0,0 +1,142 @@
+import threading
+import time
+
+K = 8
+ID_BITS = 160
+# A node is "good" if it responded within the last 15 minutes (BEP 5)
+GOOD_NODE_AGE = 15 * 60
+MAX_FAILURES = 2
+
+
+def distance(a: bytes, b: bytes) -> int:
+    return int.from_bytes(a, "big") ^ int.from_bytes(b, "big")
+
+
+class NodeInfo:
+    __slots__ = ("node_id", "address", "last_seen", "failures")
+
+    def __init__(self, node_id: bytes, address: tuple, last_seen: float | None = None):
+        self.node_id = node_id
+        self.address = address
+        self.last_seen = time.time() if last_seen is None else last_seen
+        self.failures = 0
+
+    @property
+    def good(self) -> bool:
+        return self.failures == 0 and time.time() - self.last_seen < GOOD_NODE_AGE
+
+    @property
+    def bad(self) -> bool:
+        return self.failures >= MAX_FAILURES
+
+    def __repr__(self):
+        return f"NodeInfo({self.node_id.hex()[:8]}, {self.address[0]}:{self.address[1]})"
+
+
+class KBucket:
+    def __init__(self, low: int, high: int):
+        self.low = low
+        self.high = high
+        self.nodes: list[NodeInfo] = []
+        self.last_changed = time.time()
+
+    def covers(self, node_id: bytes) -> bool:
+        return self.low <= int.from_bytes(node_id, "big") < self.high
+
+    def find(self, node_id: bytes) -> NodeInfo | None:
+        for node in self.nodes:
+            if node.node_id == node_id:
+                return node
+        return None
+
+
+class RoutingTable:
+    """Kademlia routing table of k-buckets covering the 160-bit ID space"""
+
+    def __init__(self, own_id: bytes, k: int = K):
+        self.own_id = own_id
+        self.k = k
+        self.buckets = [KBucket(0, 2**ID_BITS)]
+        self._lock = threading.Lock()
+
+    def _bucket_for(self, node_id: bytes) -> KBucket:
+        for bucket in self.buckets:
+            if bucket.covers(node_id):
+                return bucket
+        raise ValueError("node id outside of ID space")
+
+    def _split(self, bucket: KBucket):
+        middle = (bucket.low + bucket.high) // 2
+        upper = KBucket(middle, bucket.high)
+        lower = KBucket(bucket.low, middle)
+        for node in bucket.nodes:
+            (upper if upper.covers(node.node_id) else lower).nodes.append(node)
+        index = self.buckets.index(bucket)
+        self.buckets[index: index + 1] = [lower, upper]
+
+    def insert(self, node_id: bytes, address: tuple) -> bool:
+        """Add or refresh a node; returns False if its bucket had no room"""
+        if node_id == self.own_id or len(node_id) != 20:
+            return False
+        with self._lock:
+            while True:
+                bucket = self._bucket_for(node_id)
+                existing = bucket.find(node_id)
+                if existing is not None:
+                    existing.address = address
+                    existing.last_seen = time.time()
+                    existing.failures = 0
+                    bucket.nodes.remove(existing)
+                    bucket.nodes.append(existing)
+                    bucket.last_changed = time.time()
+                    return True
+
+                if len(bucket.nodes) < self.k:
+                    bucket.nodes.append(NodeInfo(node_id, address))
+                    bucket.last_changed = time.time()
+                    return True
+
+                if bucket.covers(self.own_id) and bucket.high - bucket.low > self.k:
+                    self._split(bucket)
+                    continue
+
+                for index, node in enumerate(bucket.nodes):
+                    if node.bad:
+                        bucket.nodes[index] = NodeInfo(node_id, address)
+                        bucket.last_changed = time.time()
+                        return True
+                return False
+
+    def mark_failed(self, node_id: bytes):
+        with self._lock:
+            bucket = self._bucket_for(node_id)
+            node = bucket.find(node_id)
+            if node is not None:
+                node.failures += 1
+
+    def remove(self, node_id: bytes):
+        with self._lock:
+            bucket = self._bucket_for(node_id)
+            node = bucket.find(node_id)
+            if node is not None:
+                bucket.nodes.remove(node)
+
+    def closest(self, target: bytes, count: int | None = None) -> list[NodeInfo]:
+        count = self.k if count is None else count
+        with self._lock:
+            nodes = [node for bucket in self.buckets for node in bucket.nodes if not node.bad]
+        nodes.sort(key=lambda node: distance(node.node_id, target))
+        return nodes[:count]
+
+    def nodes(self) -> list[NodeInfo]:
+        with self._lock:
+            return [node for bucket in self.buckets for node in bucket.nodes]
+
+    def stale_buckets(self, max_age: float = GOOD_NODE_AGE) -> list[KBucket]:
+        now = time.time()
+        with self._lock:
+            return [b for b in self.buckets if now - b.last_changed > max_age]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(bucket.nodes) for bucket in self.buckets)
@@ -0,0 +1,294 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from src import profiling
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+
+# (snapshot key, metric name, help) of the plain per-torrent and per-peer gauges
+TORRENT_GAUGES = (
+    ("download_rate", "bittorrent_download_rate_bytes", "Download rate in bytes/s"),
+    ("upload_rate", "bittorrent_upload_rate_bytes", "Upload rate in bytes/s"),
+    ("bytes_left", "bittorrent_bytes_left", "Bytes still to download"),
+    ("peers", "bittorrent_peers", "Connected peers"),
+    (
+        "requests_in_flight",
+        "bittorrent_requests_in_flight",
+        "Block requests awaiting a reply",
+    ),
+)
+TORRENT_TIMINGS = (
+    ("verify", "bittorrent_piece_verify_seconds", "Time to hash-check a piece"),
+    ("disk_read", "bittorrent_disk_read_seconds", "Time to read from disk"),
+    ("disk_write", "bittorrent_disk_write_seconds", "Time to write a piece"),
+    ("tracker", "bittorrent_tracker_response_seconds", "Time for a tracker to answer"),
+)
+TORRENT_FAILURES = (
+    ("verify", "bittorrent_hash_failures_total", "Pieces that failed the hash check"),
+    ("tracker", "bittorrent_tracker_failures_total", "Failed tracker requests"),
+)
+PEER_GAUGES = (
+    (
+        "download_rate",
+        "bittorrent_peer_download_rate_bytes",
+        "Download rate from a peer",
+    ),
+    ("upload_rate", "bittorrent_peer_upload_rate_bytes", "Upload rate to a peer"),
+    ("in_flight", "bittorrent_peer_requests_in_flight", "Requests to a peer in flight"),
+    ("queued_bytes", "bittorrent_peer_queued_bytes", "Bytes queued for a peer"),
+)
+
+
+class LatencyStat:
+    """Count, total and worst duration of a repeated operation, thread-safe.
+
+    ``failures`` counts the observations marked as failed (bad hash,
+    tracker error), which still count towards the timings.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, failed: bool = False):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            if failed:
+                self.failures += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "failures": self.failures,
+                "total": self.total,
+                "max": self.max,
+                "mean": self.total / self.count if self.count else 0.0,
+            }
+
+
+def snapshot(session, listener=None) -> dict:
+    """Every metric of the process as one JSON-serialisable dict"""
+    process = {
+        "threads": threading.active_count(),
+        "half_open": session.connector.half_open,
+        "incoming_connections": 0,
+        "piece_cache": None,
+    }
+    if listener is not None:
+        process["incoming_connections"] = len(listener.connections)
+        process["piece_cache"] = listener.piece_cache.stats()
+    torrents = []
+    for entry in list(session.torrents):
+        torrent = entry.stats()
+        torrent["peer_list"] = (
+            entry.loader.peer_stats() if entry.loader is not None else []
+        )
+        torrents.append(torrent)
+    return {
+        "process": process,
+        "session": session.stats(),
+        "torrents": torrents,
+        "profile": profiling.snapshot(),
+    }
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value) -> str:
+    # Counters stay exact however large they grow
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class _Exposition:
+    """Collects samples and renders them in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def add(self, name: str, kind: str, help_text: str, value, suffix="", **labels):
+        if value is None:
+            return
+        _, _, samples = self._metrics.setdefault(name, (kind, help_text, []))
+        samples.append((suffix, labels, value))
+
+    def summary(self, name: str, help_text: str, stat: dict | None, **labels):
+        """A LatencyStat snapshot as a summary, plus the worst case as ``_max``"""
+        if not stat:
+            return
+        self.add(name, "summary", help_text, stat["count"], "_count", **labels)
+        self.add(name, "summary", help_text, stat["total"], "_sum", **labels)
+        self.add(
+            f"{name}_max", "gauge", f"{help_text} (worst case)", stat["max"], **labels
+        )
+
+    def histogram(self, name: str, help_text: str, stats: dict, **labels):
+        """A profiling histogram with cumulative ``le`` buckets"""
+        cumulative = 0
+        bounds = [f"{bound:g}" for bound in profiling.BUCKETS] + ["+Inf"]
+        for bound, count in zip(bounds, stats["buckets"]):
+            cumulative += count
+            self.add(
+                name, "histogram", help_text, cumulative, "_bucket", **labels, le=bound
+            )
+        self.add(name, "histogram", help_text, stats["count"], "_count", **labels)
+        self.add(name, "histogram", help_text, stats["total"], "_sum", **labels)
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text, samples) in self._metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                if label_text:
+                    label_text = "{" + label_text + "}"
+                lines.append(f"{name}{suffix}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def prometheus(metrics: dict) -> str:
+    """Render a ``snapshot()`` in the Prometheus text exposition format"""
+    out = _Exposition()
+    process = metrics["process"]
+    out.add("bittorrent_threads", "gauge", "Live threads", process["threads"])
+    out.add(
+        "bittorrent_half_open_connections",
+        "gauge",
+        "Outgoing connection attempts in progress",
+        process["half_open"],
+    )
+    out.add(
+        "bittorrent_incoming_connections",
+        "gauge",
+        "Connections accepted by the listener",
+        process["incoming_connections"],
+    )
+    cache = process["piece_cache"]
+    if cache is not None:
+        for key, name, kind, help_text in (
+            ("hits", "bittorrent_piece_cache_hits_total", "counter", "Hits"),
+            ("misses", "bittorrent_piece_cache_misses_total", "counter", "Misses"),
+            ("hit_rate", "bittorrent_piece_cache_hit_ratio", "gauge", "Cache hit rate"),
+            ("bytes", "bittorrent_piece_cache_bytes", "gauge", "Bytes cached"),
+        ):
+            out.add(name, kind, help_text, cache[key])
+
+    for torrent in metrics["torrents"]:
+        labels = {"torrent": torrent["id"]}
+        out.add(
+            "bittorrent_torrent_info",
+            "gauge",
+            "Torrent source and state",
+            1,
+            source=torrent["source"],
+            status=torrent["status"],
+            **labels,
+        )
+        for key, name, help_text in TORRENT_GAUGES:
+            out.add(name, "gauge", help_text, torrent.get(key), **labels)
+        for key, name, help_text in TORRENT_TIMINGS:
+            out.summary(name, help_text, torrent.get(key), **labels)
+        for key, name, help_text in TORRENT_FAILURES:
+            if torrent.get(key):
+                out.add(name, "counter", help_text, torrent[key]["failures"], **labels)
+        for peer in torrent["peer_list"]:
+            peer_labels = dict(
+                labels, peer=peer["address"], direction=peer["direction"]
+            )
+            for key, name, help_text in PEER_GAUGES:
+                out.add(name, "gauge", help_text, peer.get(key), **peer_labels)
+
+    for stage, stats in sorted(metrics.get("profile", {}).items()):
+        out.histogram(
+            "bittorrent_stage_seconds",
+            "Time spent per transfer stage (with profiling on)",
+            stats,
+            stage=stage,
+        )
+    return out.render()
+
+
+class MetricsServer:
+    """Serves ``/metrics`` (Prometheus) and ``/metrics.json`` over HTTP.
+
+    Binds to localhost by default; every request takes a fresh snapshot,
+    so scraping costs nothing while nobody is looking.
+    """
+
+    def __init__(self, session, listener=None, port: int = 0, host: str = DEFAULT_HOST):
+        self.session = session
+        self.listener = listener
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        """Serve until stopped (blocks; call from its own thread)"""
+        # Only needed with --metrics-port, so kept off the startup path
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics":
+                    body = prometheus(metrics.snapshot()).encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Metrics request: {format % args}")
+
+        try:
+            server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            logger.error(f"Failed to start metrics server on port {self.port}: {e}")
+            return
+        server.daemon_threads = True
+        self.port = server.server_address[1]
+        self.server = server
+        logger.info(f"Metrics on http://{self.host}:{self.port}/metrics")
+        server.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def snapshot(self) -> dict:
+        return snapshot(self.session, self.listener)
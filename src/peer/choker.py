@@ -0,0 +1,121 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SLOTS = 4
+RECHOKE_INTERVAL = 10
+OPTIMISTIC_UNCHOKE_INTERVAL = 30
+# Peers connected for less than this get a better chance at the optimistic slot
+NEW_PEER_AGE = 60
+
+
+class Choker:
+    """Tit-for-tat choking shared by all upload connections of a torrent.
+
+    Every ``RECHOKE_INTERVAL`` seconds the interested peers are ranked by
+    the rate they give us (or the rate we give them once we are seeding)
+    and the best ``upload_slots - 1`` are unchoked. The last slot is an
+    optimistic unchoke rotated every ``OPTIMISTIC_UNCHOKE_INTERVAL``.
+
+    Registered peers need ``peer_interested``, ``am_choking``,
+    ``download_rate``, ``upload_rate``, ``connected_at`` and
+    ``choke()`` / ``unchoke()``.
+    """
+
+    def __init__(self, upload_slots: int = UPLOAD_SLOTS, is_seeding=None):
+        self.upload_slots = upload_slots
+        self.is_seeding = is_seeding or (lambda: False)
+        self.peers = []
+        self.optimistic = None
+        self._last_optimistic = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(RECHOKE_INTERVAL):
+            try:
+                self.rechoke()
+            except Exception as e:
+                logger.error(f"Rechoke failed: {e}")
+
+    def register(self, peer):
+        with self._lock:
+            self.peers.append(peer)
+
+    def registered(self) -> list:
+        with self._lock:
+            return list(self.peers)
+
+    def unregister(self, peer):
+        with self._lock:
+            if peer in self.peers:
+                self.peers.remove(peer)
+            if self.optimistic is peer:
+                self.optimistic = None
+
+    def peer_interested(self, peer):
+        """Unchoke a newly interested peer right away if a slot is free"""
+        with self._lock:
+            unchoked = sum(1 for p in self.peers if not p.am_choking)
+        if peer.am_choking and unchoked < self.upload_slots:
+            self._set_choked(peer, False)
+
+    def rechoke(self):
+        now = time.monotonic()
+        with self._lock:
+            peers = list(self.peers)
+        interested = [p for p in peers if p.peer_interested]
+
+        if self.is_seeding():
+            interested.sort(key=lambda p: p.upload_rate, reverse=True)
+        else:
+            interested.sort(key=lambda p: p.download_rate, reverse=True)
+        unchoke = interested[: max(self.upload_slots - 1, 0)]
+
+        candidates = [p for p in interested if p not in unchoke]
+        if (
+            self.optimistic not in candidates
+            or now - self._last_optimistic >= OPTIMISTIC_UNCHOKE_INTERVAL
+        ):
+            self.optimistic = self._pick_optimistic(candidates, now)
+            self._last_optimistic = now
+        if self.optimistic is not None:
+            unchoke.append(self.optimistic)
+
+        for peer in peers:
+            self._set_choked(peer, peer not in unchoke)
+
+    def _pick_optimistic(self, candidates, now):
+        if not candidates:
+            return None
+        # New peers have nothing to reciprocate with yet, give them 3x the odds
+        weights = [
+            3 if now - p.connected_at < NEW_PEER_AGE else 1 for p in candidates
+        ]
+        return random.choices(candidates, weights=weights)[0]
+
+    def _set_choked(self, peer, choked: bool):
+        if peer.am_choking == choked:
+            return
+        try:
+            if choked:
+                peer.choke()
+            else:
+                peer.unchoke()
+        except Exception as e:
+            logger.debug(f"Failed to change choke state: {e}")
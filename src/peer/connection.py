@@ -1,53 +1,140 @@
+import math
+import socket
 import struct
 import threading
 import logging
 import time
-from src import state
+from collections import deque
+
+from src import profiling, state
+from src.peer import extensions
+from src.peer.piece_picker import BLOCK_SIZE, BlockPool
+from src.peer.rate import RateMeter
+from src.peer.scoreboard import LATENCY_SMOOTHING
 
 logger = logging.getLogger(__name__)
 
+# Keep enough requests in flight to cover this many seconds of transfer
+PIPELINE_SECONDS = 2.0
+INITIAL_PIPELINE_DEPTH = 4
+MAX_PIPELINE_DEPTH = 64
+# No block for this long while requests are out means the peer is snubbing us
+SNUB_TIMEOUT = 60
+# A block request may take this many times the peer's expected response
+# time before it is handed to another peer, within these bounds (seconds)
+BLOCK_TIMEOUT_FACTOR = 3
+INITIAL_BLOCK_TIMEOUT = 20
+MIN_BLOCK_TIMEOUT = 5
+MAX_BLOCK_TIMEOUT = 60
+
 
 class PeerConnection(threading.Thread):
 
-    def __init__(self, peer_socket, info_hash, peer_id, storage_manager):
+    def __init__(
+        self,
+        peer_socket,
+        info_hash,
+        peer_id,
+        storage_manager,
+        swarm=None,
+        address=None,
+        listen_port=None,
+        choker=None,
+        limits=None,
+        scoreboard=None,
+        pool=None,
+        control=None,
+    ):
         super().__init__()
         self.peer_socket = peer_socket
         self.info_hash = info_hash
         self.peer_id = peer_id
         self.storage_manager = storage_manager
+        self.swarm = swarm
+        self.address = address
+        self.listen_port = listen_port
+        self.choker = choker
+        # Per-peer RateLimits, chained to the torrent's and the process'
+        self.limits = limits
+        self.scoreboard = scoreboard
+        # Blocks shared with the torrent's other connections
+        self.pool = pool if pool is not None else BlockPool(storage_manager)
+        # The torrent's pause/stop switch
+        self.control = control if control is not None else state.root()
         self.running = True
+        self.handshake_ok = False
+        self.downloaded = 0
+
+        self.peer_supports_extensions = False
+        self.peer_supports_fast = False
+        self.allowed_fast = set()
+        self.suggested_pieces = []
+        # Requests in flight, oldest first, with when they were sent and
+        # when they may be handed to another peer
+        self.pending_requests = deque()
+        self._request_times = {}
+        self._deadlines = {}
+        # Pieces this peer refused to serve while unchoking us
+        self._refused = set()
+        # Since when we have been waiting for a block, None when idle
+        self._waiting_since = None
+        self.latency = None
+        self.snubbed = False
+        self.peer_extensions = {}
+        self._pex_sent = set()
+        self._last_pex = 0.0
 
         self.am_interested = False
         self.peer_choking = True
+        self.am_choking = True
+        self.peer_interested = False
+        self.granted_fast = set()
+        self.connected_at = time.monotonic()
+        self.download_meter = RateMeter()
+        self.upload_meter = RateMeter()
+        self._send_lock = threading.Lock()
         self.peer_pieces = [False] * self.storage_manager.total_pieces
-        self.current_piece_index = -1
-        self.current_piece_buffer = bytearray()
-        self.current_piece_downloaded = 0
-        self.block_size = 16384
+        self.block_size = BLOCK_SIZE
         self._lock = threading.Lock()
 
     def run(self):
-        if self.perform_handshake():
-            self.send_bitfield()
-            self.send_interested()
-            self.handle_peer_session()
-        self.peer_socket.close()
+        # A stop shuts the socket down, so a blocked recv returns at once
+        unregister = self.control.on_stop(self._interrupt)
+        try:
+            if self.perform_handshake():
+                self.handshake_ok = True
+                self.send_bitfield()
+                if self.peer_supports_fast:
+                    self.send_allowed_fast()
+                if self.peer_supports_extensions:
+                    self.send_extended_handshake()
+                self.send_interested()
+                if self.choker is not None:
+                    self.choker.register(self)
+                try:
+                    self.handle_peer_session()
+                finally:
+                    self._release_requests()
+                    if self.choker is not None:
+                        self.choker.unregister(self)
+        finally:
+            unregister()
+            self.peer_socket.close()
+
+    def _interrupt(self):
+        self.running = False
+        try:
+            self.peer_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     def perform_handshake(self):
         try:
-            protocol = b"BitTorrent protocol"
+            protocol = extensions.PROTOCOL
             protocol_len = len(protocol)
-            reserved = b"\x00" * 8
-
-            packet = struct.pack(
-                f">B{protocol_len}s8s20s20s",
-                protocol_len,
-                protocol,
-                reserved,
-                self.info_hash,
-                self.peer_id,
-            )
-            self.peer_socket.sendall(packet)
+
+            packet = extensions.build_handshake(self.info_hash, self.peer_id)
+            self._send(packet)
 
             response = self._recvall(49 + protocol_len)
             if not response or len(response) < 49 + protocol_len:
@@ -56,6 +143,7 @@ class PeerConnection(threading.Thread):
 
             recv_protocol_len = response[0]
             recv_protocol = response[1: 1 + recv_protocol_len]
+            recv_reserved = response[1 + recv_protocol_len: 1 + recv_protocol_len + 8]
             recv_info_hash = response[
                 1 + recv_protocol_len + 8: 1 + recv_protocol_len + 8 + 20
             ]
@@ -67,6 +155,10 @@ class PeerConnection(threading.Thread):
                 logger.error("Handshake failed: info_hash mismatch")
                 return False
 
+            self.peer_supports_extensions = extensions.supports_extensions(
+                recv_reserved
+            )
+            self.peer_supports_fast = extensions.supports_fast(recv_reserved)
             logger.info("Handshake with peer succeeded")
             return True
         except Exception as e:
@@ -77,17 +169,24 @@ class PeerConnection(threading.Thread):
         try:
             while self.running:
                 # Check for stop/pause
-                if state.is_stopped():
+                if self.control.is_stopped():
+                    break
+                if not self.control.wait_if_paused():
                     break
-                if not state.wait_if_paused():
+
+                if self._is_snubbing():
+                    logger.warning(f"Peer {self.address} is snubbing us, disconnecting")
+                    self.snubbed = True
                     break
 
+                if not all(self.storage_manager.pieces_status):
+                    self.request_blocks()
+
                 if (
-                    not self.peer_choking
-                    and self.current_piece_index == -1
-                    and not all(self.storage_manager.pieces_status)
+                    "ut_pex" in self.peer_extensions
+                    and time.monotonic() - self._last_pex >= extensions.PEX_INTERVAL
                 ):
-                    self.request_next_piece()
+                    self.send_pex()
 
                 self.peer_socket.settimeout(0.1)
                 try:
@@ -113,14 +212,23 @@ class PeerConnection(threading.Thread):
         if msg_id == 0:
             logger.info("Peer choked us")
             self.peer_choking = True
+            # Without the fast extension a choke silently drops our requests;
+            # with it the peer rejects each one explicitly
+            if not self.peer_supports_fast:
+                self._release_requests()
         elif msg_id == 1:
             logger.info("Peer unchoked us")
             self.peer_choking = False
+            self.request_blocks()
         elif msg_id == 2:
             logger.info("Peer is interested")
-            self.send_unchoke()
+            self.peer_interested = True
+            if self.choker is not None:
+                self.choker.peer_interested(self)
+            else:
+                self.unchoke()
         elif msg_id == 3:
-            pass
+            self.peer_interested = False
         elif msg_id == 4:
             piece_index = struct.unpack(">I", payload)[0]
             if piece_index < len(self.peer_pieces):
@@ -129,10 +237,126 @@ class PeerConnection(threading.Thread):
             self.process_bitfield(payload)
         elif msg_id == 6:
             piece_index, begin, length = self.parse_request(payload)
-            block = self.storage_manager.read_piece(piece_index, begin, length)
-            self.send_piece(piece_index, begin, block)
+            if (
+                not self._have_piece(piece_index)
+                or begin + length > self.storage_manager.piece_size(piece_index)
+                or (self.am_choking and piece_index not in self.granted_fast)
+            ):
+                if self.peer_supports_fast:
+                    self._send(
+                        extensions.build_reject(piece_index, begin, length)
+                    )
+                return
+            self.send_piece(piece_index, begin, length)
         elif msg_id == 7:
             self.process_piece(payload)
+        elif msg_id == extensions.MSG_SUGGEST_PIECE:
+            piece_index = struct.unpack(">I", payload)[0]
+            if piece_index < len(self.peer_pieces) and piece_index not in self.suggested_pieces:
+                self.suggested_pieces.append(piece_index)
+        elif msg_id == extensions.MSG_HAVE_ALL:
+            self.peer_pieces = [True] * len(self.peer_pieces)
+        elif msg_id == extensions.MSG_HAVE_NONE:
+            pass
+        elif msg_id == extensions.MSG_REJECT_REQUEST:
+            self.process_reject(payload)
+        elif msg_id == extensions.MSG_ALLOWED_FAST:
+            piece_index = struct.unpack(">I", payload)[0]
+            if piece_index < len(self.peer_pieces):
+                self.allowed_fast.add(piece_index)
+        elif msg_id == extensions.MSG_EXTENDED:
+            self.process_extended(payload)
+
+    def process_extended(self, payload):
+        if not payload:
+            return
+        extended_id, body = payload[0], payload[1:]
+        try:
+            if extended_id == extensions.EXTENDED_HANDSHAKE_ID:
+                self.peer_extensions = extensions.parse_extended_handshake(body)
+                logger.info(f"Peer supports extensions: {sorted(self.peer_extensions)}")
+            elif extended_id == extensions.LOCAL_EXTENSIONS["ut_pex"]:
+                added, _ = extensions.parse_pex_payload(body)
+                if self.swarm is not None:
+                    new_peers = self.swarm.extend(added)
+                    if new_peers:
+                        logger.info(f"Learned {new_peers} new peers via PEX")
+        except Exception as e:
+            logger.warning(f"Malformed extension message {extended_id}: {e}")
+
+    def process_reject(self, payload):
+        request = struct.unpack(">III", payload)
+        if request not in self.pending_requests:
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Peer rejected request for piece {request[0]}")
+        self._forget_request(request)
+        self.pool.release(self, [request])
+        if self.peer_choking:
+            # An allowed fast piece the peer won't serve after all
+            self.allowed_fast.discard(request[0])
+        else:
+            # Refused while unchoked: the peer won't give us this piece
+            self._refused.add(request[0])
+        if not self.pending_requests:
+            self._waiting_since = None
+
+    @property
+    def pending_request(self):
+        """The oldest request still in flight"""
+        return self.pending_requests[0] if self.pending_requests else None
+
+    @property
+    def current_piece_index(self):
+        """Piece of the oldest request in flight, -1 when none is"""
+        return self.pending_requests[0][0] if self.pending_requests else -1
+
+    @property
+    def pipeline_depth(self):
+        """Requests to keep in flight, sized to the rate the peer can sustain.
+
+        A throttled peer gets a short queue, so its requests don't go stale
+        waiting for tokens.
+        """
+        depth = math.ceil(self.download_meter.rate * PIPELINE_SECONDS / self.block_size)
+        depth = max(INITIAL_PIPELINE_DEPTH, depth)
+        limit = self.limits.download_limit() if self.limits is not None else 0
+        if limit:
+            depth = min(depth, max(1, math.ceil(limit * PIPELINE_SECONDS / self.block_size)))
+        return min(MAX_PIPELINE_DEPTH, depth)
+
+    @property
+    def block_timeout(self):
+        """Seconds a block request may go unanswered before it is reassigned.
+
+        Based on the peer's measured latency, or on the time its rate needs
+        to deliver a full pipeline if that is longer.
+        """
+        if self.latency is None:
+            return INITIAL_BLOCK_TIMEOUT
+        expected = self.latency
+        rate = self.download_meter.rate
+        if rate:
+            expected = max(expected, self.pipeline_depth * self.block_size / rate)
+        return min(
+            MAX_BLOCK_TIMEOUT, max(MIN_BLOCK_TIMEOUT, BLOCK_TIMEOUT_FACTOR * expected)
+        )
+
+    def _is_snubbing(self):
+        """We have been waiting too long for any block at all"""
+        return (
+            self._waiting_since is not None
+            and time.monotonic() - self._waiting_since > SNUB_TIMEOUT
+        )
+
+    def _have_piece(self, piece_index):
+        return (
+            0 <= piece_index < self.storage_manager.total_pieces
+            and self.storage_manager.pieces_status[piece_index]
+        )
+
+    def _peer_can_send(self, piece_index):
+        return self.peer_pieces[piece_index] and piece_index not in self._refused
 
     def process_bitfield(self, payload):
         for i, byte in enumerate(payload):
@@ -141,86 +365,131 @@ class PeerConnection(threading.Thread):
                     if (byte >> (7 - j)) & 1:
                         self.peer_pieces[i * 8 + j] = True
 
-    def request_next_piece(self):
-        for i in range(self.storage_manager.total_pieces):
-            if not self.storage_manager.pieces_status[i] and self.peer_pieces[i]:
-                self.current_piece_index = i
-                self.current_piece_downloaded = 0
-                self.current_piece_buffer = bytearray()
-                logger.info(f"Starting to download piece {i}")
-                self.request_next_block()
-                return
-
-        if not any(
-            not self.storage_manager.pieces_status[i] and self.peer_pieces[i]
-            for i in range(self.storage_manager.total_pieces)
-        ):
-            logger.info("Peer doesn't have any pieces we need")
-            time.sleep(1)
+    def request_blocks(self):
+        """Top up the request pipeline with blocks from the shared pool.
 
-    def request_next_block(self):
-        if self.current_piece_index == -1:
+        While choked only allowed fast pieces are requested. Pieces the peer
+        suggested are likely in its cache, so they are started first.
+        """
+        self._expire_requests()
+        if self.peer_choking:
+            if not self.allowed_fast:
+                return
+            allowed = sorted(self.allowed_fast)
+        else:
+            allowed = None
+        count = self.pipeline_depth - len(self.pending_requests)
+        if count <= 0:
             return
 
-        piece_length = self.storage_manager.piece_length
-        if self.current_piece_index == self.storage_manager.total_pieces - 1:
-            total_length = 0
-            if "files" in self.storage_manager.torrent_info:
-                total_length = sum(
-                    f["length"] for f in self.storage_manager.torrent_info["files"]
+        now = time.monotonic()
+        deadline = now + self.block_timeout
+        requests = self.pool.pick(
+            self,
+            self._peer_can_send,
+            count,
+            deadline,
+            preferred=self.suggested_pieces,
+            allowed=allowed,
+        )
+        for request in requests:
+            self._send(struct.pack(">IBIII", 13, 6, *request))
+            self.pending_requests.append(request)
+            self._request_times[request] = now
+            self._deadlines[request] = deadline
+        if requests and self._waiting_since is None:
+            self._waiting_since = now
+
+    def _expire_requests(self):
+        """Give up on requests past their deadline so other peers can take them.
+
+        The blocks stay claimed in the pool until another connection picks
+        them up; this peer is only asked again if nobody else was.
+        """
+        now = time.monotonic()
+        expired = [r for r in self.pending_requests if self._deadlines.get(r, now) <= now]
+        for request in expired:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"Request piece={request[0]}, begin={request[1]} to {self.address} timed out"
                 )
-            else:
-                total_length = self.storage_manager.torrent_info["length"]
-            piece_length = total_length % self.storage_manager.piece_length
-            if piece_length == 0:
-                piece_length = self.storage_manager.piece_length
-
-        if self.current_piece_downloaded >= piece_length:
-            self.verify_and_write_piece()
-            return
-
-        begin = self.current_piece_downloaded
-        length = min(self.block_size, piece_length - begin)
-
-        msg = struct.pack(
-            ">IBIII", 13, 6, self.current_piece_index, begin, length)
-        self.peer_socket.sendall(msg)
+            self._forget_request(request)
+            self._send(struct.pack(">IBIII", 13, 8, *request))
+        if expired:
+            self.pool.expire(self, expired)
+
+    def _forget_request(self, request):
+        self.pending_requests.remove(request)
+        self._request_times.pop(request, None)
+        self._deadlines.pop(request, None)
+
+    def _release_requests(self):
+        """Hand every request in flight back to the pool (choke, disconnect)"""
+        self.pool.release(self, list(self.pending_requests))
+        self.pending_requests.clear()
+        self._request_times.clear()
+        self._deadlines.clear()
+        self._waiting_since = None
 
     def process_piece(self, payload):
         piece_index = struct.unpack(">I", payload[:4])[0]
         begin = struct.unpack(">I", payload[4:8])[0]
         block = payload[8:]
-
-        if piece_index != self.current_piece_index:
+        request = (piece_index, begin, len(block))
+
+        requested = request in self.pending_requests
+        if requested:
+            self._record_latency(self._request_times.get(request))
+            self._forget_request(request)
+        # Blocks we gave up on (timeout, choke) still count if nobody else
+        # has delivered them yet
+        accepted, piece_data = self.pool.received(self, piece_index, begin, block)
+        if not requested and not accepted:
             logger.warning(
-                f"Received block for piece {piece_index} but expected {self.current_piece_index}"
+                f"Received unrequested block: piece={piece_index}, begin={begin}"
             )
             return
 
-        if begin != self.current_piece_downloaded:
-            logger.warning(
-                f"Received block at offset {begin} but expected {self.current_piece_downloaded}"
-            )
-            return
+        self._waiting_since = time.monotonic() if self.pending_requests else None
+        self.downloaded += len(block)
+        self.download_meter.update(len(block))
 
-        self.current_piece_buffer.extend(block)
-        self.current_piece_downloaded += len(block)
+        if self.limits is not None:
+            # Fewer requests go out while we wait, shrinking the pipeline
+            self._throttle(self.limits.reserve_download(len(block)))
 
-        self.request_next_block()
+        if piece_data is not None:
+            self.verify_and_write_piece(piece_index, piece_data)
+        if not all(self.storage_manager.pieces_status):
+            self.request_blocks()
 
-    def verify_and_write_piece(self):
-        data = bytes(self.current_piece_buffer)
-        if self.storage_manager.piece_hash_valid(self.current_piece_index, data):
-            self.storage_manager.write_piece(self.current_piece_index, data)
-            self.storage_manager.mark_piece_completed(self.current_piece_index)
-            logger.info(
-                f"Piece {self.current_piece_index} verified and written")
+    def verify_and_write_piece(self, piece_index, data):
+        if self.storage_manager.piece_hash_valid(piece_index, data):
+            self.storage_manager.write_piece(piece_index, data)
+            self.storage_manager.mark_piece_completed(piece_index)
+            logger.info(f"Piece {piece_index} verified and written")
         else:
-            logger.error(f"Piece {self.current_piece_index} hash check failed")
+            logger.error(f"Piece {piece_index} hash check failed")
+            if self.scoreboard is not None:
+                banned = self.scoreboard.record_hash_failure(
+                    self.pool.sources(piece_index)
+                )
+                if self.address in banned:
+                    self.running = False
+        self.pool.finish(piece_index)
 
-        self.current_piece_index = -1
-        self.current_piece_buffer = bytearray()
-        self.current_piece_downloaded = 0
+    def _record_latency(self, sent_at):
+        if sent_at is None:
+            return
+        latency = time.monotonic() - sent_at
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = (
+                LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency
+            )
+        if self.scoreboard is not None and self.address is not None:
+            self.scoreboard.record_latency(self.address, latency)
 
     def stop(self):
         with self._lock:
@@ -237,7 +506,9 @@ class PeerConnection(threading.Thread):
         length = struct.unpack(">I", length_bytes)[0]
         if length == 0:
             return -1, None  # Keep-alive
+        started = profiling.start()
         msg = self._recvall(length)
+        profiling.record(profiling.RECV, started)
         if not msg:
             return None, None
         msg_id = msg[0]
@@ -261,21 +532,113 @@ class PeerConnection(threading.Thread):
     def parse_request(self, payload):
         return struct.unpack(">III", payload)
 
-    def send_piece(self, piece_index, begin, block):
-        msg_len = 1 + 4 + 4 + len(block)
-        msg = struct.pack(">IBII", msg_len, 7, piece_index, begin) + block
-        self.peer_socket.sendall(msg)
+    def send_piece(self, piece_index, begin, length):
+        if self.limits is not None:
+            self._throttle(self.limits.reserve_upload(length))
+        location = self.storage_manager.block_location(piece_index, begin, length)
+        if location is None:
+            # The block spans files: read it into memory
+            block = self.storage_manager.read_piece(piece_index, begin, length)
+            msg_len = 1 + 4 + 4 + len(block)
+            msg = struct.pack(">IBII", msg_len, 7, piece_index, begin) + block
+            self._send(msg)
+            self.upload_meter.update(len(block))
+            return
+
+        path, offset = location
+        header = struct.pack(">IBII", 9 + length, 7, piece_index, begin)
+        started = profiling.start()
+        with open(path, "rb") as fh, self._send_lock:
+            self.peer_socket.sendall(header)
+            # socket.sendfile uses os.sendfile where the platform has it
+            sent = self.peer_socket.sendfile(fh, offset, length)
+        profiling.record(profiling.SEND, started)
+        if sent != length:
+            raise ConnectionError(f"Short read sending piece {piece_index}")
+        self.upload_meter.update(length)
+
+    def _throttle(self, delay):
+        """Wait out a rate limiter's delay, giving up early on stop"""
+        deadline = time.monotonic() + delay
+        while self.running and not self.control.is_stopped():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.5))
+
+    @property
+    def download_rate(self):
+        return self.download_meter.rate
+
+    @property
+    def upload_rate(self):
+        return self.upload_meter.rate
+
+    def choke(self):
+        self.am_choking = True
+        self._send(struct.pack(">IB", 1, 0))
+
+    def unchoke(self):
+        self.am_choking = False
+        self.send_unchoke()
+
+    def _send(self, data):
+        # The choker thread sends choke/unchoke on this socket too
+        started = profiling.start()
+        with self._send_lock:
+            self.peer_socket.sendall(data)
+        profiling.record(profiling.SEND, started)
 
     def send_unchoke(self):
         msg = struct.pack(">IB", 1, 1)
-        self.peer_socket.sendall(msg)
+        self._send(msg)
 
     def send_interested(self):
         msg = struct.pack(">IB", 1, 2)
-        self.peer_socket.sendall(msg)
+        self._send(msg)
+
+    def send_extended_handshake(self):
+        self._send(
+            extensions.build_extended_handshake(self.listen_port)
+        )
+
+    def send_pex(self):
+        """Send the peers we are connected to that this peer hasn't heard of"""
+        self._last_pex = time.monotonic()
+        if self.swarm is None:
+            return
+        current = self.swarm.connected_peers()
+        current.discard(self.address)
+        added = current - self._pex_sent
+        dropped = self._pex_sent - current
+        if not added and not dropped:
+            return
+        added = list(added)[: extensions.PEX_MAX_PEERS]
+        payload = extensions.build_pex_payload(added, dropped)
+        self._send(
+            extensions.build_extended_message(self.peer_extensions["ut_pex"], payload)
+        )
+        self._pex_sent = (self._pex_sent - dropped) | set(added)
 
     def send_bitfield(self):
-        bitfield = self.storage_manager.get_bitfield()
-        msg_len = 1 + len(bitfield)
-        msg = struct.pack(f">IB{len(bitfield)}s", msg_len, 5, bitfield)
-        self.peer_socket.sendall(msg)
+        msg = extensions.build_availability(
+            self.storage_manager.pieces_status,
+            self.peer_supports_fast,
+            self.storage_manager.get_bitfield,
+        )
+        self._send(msg)
+
+    def send_allowed_fast(self):
+        """Let the peer fetch a few of our pieces before we unchoke it"""
+        if self.address is None:
+            return
+        for piece_index in extensions.allowed_fast_set(
+            self.address[0], self.info_hash, self.storage_manager.total_pieces
+        ):
+            if self.storage_manager.pieces_status[piece_index]:
+                self.granted_fast.add(piece_index)
+                self._send(
+                    extensions.build_piece_message(
+                        extensions.MSG_ALLOWED_FAST, piece_index
+                    )
+                )
@@ -0,0 +1,293 @@
+import errno
+import itertools
+import logging
+import os
+import selectors
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# RFC 8305 recommends 250 ms between connection attempts
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+
+def _interleave_families(addr_infos: list) -> list:
+    """Alternate address families so both IPv6 and IPv4 are tried early"""
+    ipv6 = [info for info in addr_infos if info[0] == socket.AF_INET6]
+    ipv4 = [info for info in addr_infos if info[0] != socket.AF_INET6]
+    ordered = []
+    while ipv6 or ipv4:
+        if ipv6:
+            ordered.append(ipv6.pop(0))
+        if ipv4:
+            ordered.append(ipv4.pop(0))
+    return ordered
+
+
+# Outgoing connects in progress at once, across all torrents
+MAX_HALF_OPEN = 20
+CONNECT_TIMEOUT = 5.0
+# A failing address is retried after BACKOFF_BASE * 2**(failures - 1) seconds
+BACKOFF_BASE = 10.0
+MAX_BACKOFF = 600.0
+# Failing peers remembered for their backoff; the least recent are forgotten
+MAX_TRACKED_FAILURES = 10_000
+
+
+class _Attempt:
+    """One queued or in-progress connect to a peer, racing its addresses"""
+
+    def __init__(self, peer: tuple, callback):
+        self.peer = peer
+        self.callback = callback
+        self.addr_infos = None
+        # Sockets still connecting, one per address tried so far
+        self.socks = []
+        self.deadline = None
+        # When the next address joins the race
+        self.next_attempt = None
+        self.error = None
+
+
+class Connector:
+    """Non-blocking outgoing connections, all driven from one thread.
+
+    ``connect`` queues a peer and returns immediately; at most
+    ``max_half_open`` connects are in flight and the rest wait their turn.
+    The resolved addresses race (Happy Eyeballs): IPv6 and IPv4
+    interleaved, a new one joins every ``attempt_delay`` seconds or as
+    soon as one fails, and the first to connect wins.
+    ``callback(peer, sock, error)`` runs on the connector thread as soon as
+    the connect completes, with a blocking socket or the error. Peers
+    that fail are backed off exponentially.
+    """
+
+    def __init__(
+        self,
+        max_half_open: int = MAX_HALF_OPEN,
+        timeout: float = CONNECT_TIMEOUT,
+        attempt_delay: float = CONNECTION_ATTEMPT_DELAY,
+    ):
+        self.max_half_open = max_half_open
+        self.timeout = timeout
+        self.attempt_delay = attempt_delay
+        self.running = False
+        self._queue = []
+        self._in_flight: dict[tuple, _Attempt] = {}
+        # peer -> (consecutive failures, monotonic time it may be dialed again)
+        self._failures: dict[tuple, tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+
+    def connect(self, peer: tuple, callback) -> bool:
+        """Queue a connect; False if the peer is already queued or backed off"""
+        peer = (peer[0], int(peer[1]))
+        with self._lock:
+            if self._pending(peer) or self.backoff_remaining(peer, locked=True) > 0:
+                return False
+            self._queue.append(_Attempt(peer, callback))
+        self._wake()
+        return True
+
+    def _pending(self, peer: tuple) -> bool:
+        return peer in self._in_flight or any(a.peer == peer for a in self._queue)
+
+    def backoff_remaining(self, peer: tuple, locked: bool = False) -> float:
+        """Seconds until ``peer`` may be dialed again"""
+        if not locked:
+            with self._lock:
+                return self.backoff_remaining(peer, locked=True)
+        failure = self._failures.get((peer[0], int(peer[1])))
+        return max(0.0, failure[1] - time.monotonic()) if failure else 0.0
+
+    @property
+    def half_open(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
+
+    def start(self):
+        """Run the connect loop until ``stop`` is called (blocking)"""
+        self.running = True
+        try:
+            while self.running:
+                self._start_queued()
+                for key, _ in self._selector.select(self._select_timeout()):
+                    if key.fileobj is self._wakeup_r:
+                        self._drain_wakeup()
+                    else:
+                        self._complete(key.data, key.fileobj)
+                self._expire()
+                self._stagger()
+        finally:
+            with self._lock:
+                attempts = list(self._in_flight.values())
+                self._in_flight.clear()
+                self._queue.clear()
+            for attempt in attempts:
+                self._close_socks(attempt)
+            self._selector.close()
+            self._wakeup_r.close()
+            self._wakeup_w.close()
+
+    def stop(self):
+        self.running = False
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b"\0")
+        except OSError:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _select_timeout(self):
+        with self._lock:
+            wakeups = [a.deadline for a in self._in_flight.values() if a.socks]
+            wakeups += [
+                a.next_attempt
+                for a in self._in_flight.values()
+                if a.socks and a.addr_infos
+            ]
+        if not wakeups:
+            return None
+        return max(0.0, min(wakeups) - time.monotonic())
+
+    def _start_queued(self):
+        while True:
+            with self._lock:
+                if not self._queue or len(self._in_flight) >= self.max_half_open:
+                    return
+                attempt = self._queue.pop(0)
+                self._in_flight[attempt.peer] = attempt
+            try:
+                attempt.addr_infos = _interleave_families(
+                    socket.getaddrinfo(attempt.peer[0], attempt.peer[1], type=socket.SOCK_STREAM)
+                )
+            except OSError as e:
+                self._finish(attempt, None, e)
+                continue
+            attempt.deadline = time.monotonic() + self.timeout
+            self._try_next_address(attempt)
+
+    def _try_next_address(self, attempt: _Attempt):
+        """Add the next address to the race; finish if nothing is left"""
+        while attempt.addr_infos:
+            family, socktype, proto, _, sockaddr = attempt.addr_infos.pop(0)
+            sock = socket.socket(family, socktype, proto)
+            sock.setblocking(False)
+            err = sock.connect_ex(sockaddr)
+            if err == 0 or err in _IN_PROGRESS:
+                attempt.socks.append(sock)
+                attempt.next_attempt = time.monotonic() + self.attempt_delay
+                self._selector.register(sock, selectors.EVENT_WRITE, attempt)
+                return
+            attempt.error = OSError(err, f"{sockaddr[0]}: {os.strerror(err)}")
+            sock.close()
+        if not attempt.socks:
+            self._finish(
+                attempt,
+                None,
+                attempt.error or OSError(f"No address for {attempt.peer[0]}"),
+            )
+
+    def _complete(self, attempt: _Attempt, sock: socket.socket):
+        if sock not in attempt.socks:
+            # Closed by a faster address earlier in the same select
+            return
+        self._selector.unregister(sock)
+        attempt.socks.remove(sock)
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err == 0:
+            # The race is won: the other addresses are given up
+            self._close_socks(attempt)
+            sock.setblocking(True)
+            sock.settimeout(self.timeout)
+            logger.info(
+                f"Connected to {attempt.peer[0]}:{attempt.peer[1]} "
+                f"via {sock.getpeername()[0]}"
+            )
+            self._finish(attempt, sock, None)
+            return
+        attempt.error = OSError(err, f"{attempt.peer[0]}: {os.strerror(err)}")
+        sock.close()
+        self._try_next_address(attempt)
+
+    def _close_socks(self, attempt: _Attempt):
+        for sock in attempt.socks:
+            self._selector.unregister(sock)
+            sock.close()
+        attempt.socks = []
+
+    def _stagger(self):
+        """Start the next address of races whose attempt delay has passed"""
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                a
+                for a in self._in_flight.values()
+                if a.socks and a.addr_infos and a.next_attempt <= now
+            ]
+        for attempt in due:
+            self._try_next_address(attempt)
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                a for a in self._in_flight.values() if a.socks and a.deadline <= now
+            ]
+        for attempt in expired:
+            self._close_socks(attempt)
+            self._finish(
+                attempt,
+                None,
+                TimeoutError(
+                    f"Connection to {attempt.peer[0]}:{attempt.peer[1]} timed out"
+                ),
+            )
+
+    def _prune_failures(self):
+        """Forget backoffs long expired, then the oldest, leaving room to grow"""
+        now = time.monotonic()
+        self._failures = {
+            peer: failure
+            for peer, failure in self._failures.items()
+            if failure[1] + MAX_BACKOFF > now
+        }
+        excess = len(self._failures) - MAX_TRACKED_FAILURES * 3 // 4
+        for peer in list(itertools.islice(self._failures, max(excess, 0))):
+            del self._failures[peer]
+
+    def _finish(self, attempt: _Attempt, sock, error):
+        with self._lock:
+            self._in_flight.pop(attempt.peer, None)
+            if error is None:
+                self._failures.pop(attempt.peer, None)
+            else:
+                failures = self._failures.pop(attempt.peer, (0, 0.0))[0] + 1
+                delay = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (failures - 1))
+                # Kept in order of the last failure, oldest first
+                self._failures[attempt.peer] = (failures, time.monotonic() + delay)
+                if len(self._failures) > MAX_TRACKED_FAILURES:
+                    self._prune_failures()
+        if error is not None:
+            logger.info(f"Connecting to {attempt.peer[0]}:{attempt.peer[1]} failed: {error}")
+        try:
+            attempt.callback(attempt.peer, sock, error)
+        except Exception as e:
+            logger.error(f"Connect callback for {attempt.peer[0]}:{attempt.peer[1]} failed: {e}")
+            if sock is not None:
+                sock.close()
@@ -0,0 +1,192 @@
+import hashlib
+import ipaddress
+import logging
+import socket
+import struct
+
+import bcoding
+
+from src.tracker.get_peers import (
+    decode_compact_peers,
+    decode_compact_peers6,
+    encode_compact_peers,
+    encode_compact_peers6,
+)
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL = b"BitTorrent protocol"
+
+# BEP 10: bit 20 from the right, i.e. reserved[5] & 0x10
+EXTENSION_PROTOCOL_BYTE = 5
+EXTENSION_PROTOCOL_BIT = 0x10
+
+# BEP 6: reserved[7] & 0x04
+FAST_EXTENSION_BYTE = 7
+FAST_EXTENSION_BIT = 0x04
+
+MSG_SUGGEST_PIECE = 13
+MSG_HAVE_ALL = 14
+MSG_HAVE_NONE = 15
+MSG_REJECT_REQUEST = 16
+MSG_ALLOWED_FAST = 17
+ALLOWED_FAST_COUNT = 10
+
+MSG_EXTENDED = 20
+EXTENDED_HANDSHAKE_ID = 0
+
+# Message ids we ask peers to use when sending extension messages to us
+LOCAL_EXTENSIONS = {"ut_pex": 1}
+
+CLIENT_VERSION = "PC0001"
+
+# BEP 11: at most one PEX message per minute, at most 50 added peers each
+PEX_INTERVAL = 60
+PEX_MAX_PEERS = 50
+
+
+def reserved_bytes(extension_protocol: bool = True, fast: bool = True) -> bytes:
+    reserved = bytearray(8)
+    if extension_protocol:
+        reserved[EXTENSION_PROTOCOL_BYTE] |= EXTENSION_PROTOCOL_BIT
+    if fast:
+        reserved[FAST_EXTENSION_BYTE] |= FAST_EXTENSION_BIT
+    return bytes(reserved)
+
+
+def supports_extensions(reserved: bytes) -> bool:
+    return bool(reserved[EXTENSION_PROTOCOL_BYTE] & EXTENSION_PROTOCOL_BIT)
+
+
+def supports_fast(reserved: bytes) -> bool:
+    return bool(reserved[FAST_EXTENSION_BYTE] & FAST_EXTENSION_BIT)
+
+
+def build_piece_message(msg_id: int, piece_index: int) -> bytes:
+    """have, suggest_piece and allowed_fast all carry a single piece index"""
+    return struct.pack(">IBI", 5, msg_id, piece_index)
+
+
+def build_reject(piece_index: int, begin: int, length: int) -> bytes:
+    return struct.pack(">IBIII", 13, MSG_REJECT_REQUEST, piece_index, begin, length)
+
+
+def build_availability(pieces_status: list[bool], fast: bool, bitfield) -> bytes:
+    """have_all / have_none when the fast extension allows it, else a bitfield.
+
+    ``bitfield`` is only called when a full bitfield is actually needed.
+    """
+    if fast and all(pieces_status):
+        return struct.pack(">IB", 1, MSG_HAVE_ALL)
+    if fast and not any(pieces_status):
+        return struct.pack(">IB", 1, MSG_HAVE_NONE)
+    data = bitfield()
+    return struct.pack(f">IB{len(data)}s", 1 + len(data), 5, data)
+
+
+def allowed_fast_set(
+    ip: str, info_hash: bytes, num_pieces: int, count: int = ALLOWED_FAST_COUNT
+) -> list[int]:
+    """Canonical BEP 6 allowed fast set for an IPv4 peer"""
+    if ip.startswith("::ffff:"):
+        ip = ip[len("::ffff:"):]
+    try:
+        packed_ip = socket.inet_aton(ip)
+    except OSError:
+        return []
+    count = min(count, num_pieces)
+    masked = bytes(b & m for b, m in zip(packed_ip, b"\xff\xff\xff\x00"))
+    x = masked + info_hash
+    pieces = []
+    while len(pieces) < count:
+        x = hashlib.sha1(x).digest()
+        for i in range(0, 20, 4):
+            if len(pieces) >= count:
+                break
+            index = struct.unpack(">I", x[i: i + 4])[0] % num_pieces
+            if index not in pieces:
+                pieces.append(index)
+    return pieces
+
+
+def build_handshake(
+    info_hash: bytes, peer_id: bytes, reserved: bytes | None = None
+) -> bytes:
+    return struct.pack(
+        f">B{len(PROTOCOL)}s8s20s20s",
+        len(PROTOCOL),
+        PROTOCOL,
+        reserved_bytes() if reserved is None else reserved,
+        info_hash,
+        peer_id,
+    )
+
+
+def _raw(value) -> bytes:
+    """bcoding decodes valid UTF-8 strings to str; binary fields need bytes"""
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return value
+
+
+def build_extended_message(extended_id: int, payload: dict) -> bytes:
+    body = bcoding.bencode(payload)
+    return struct.pack(">IBB", 2 + len(body), MSG_EXTENDED, extended_id) + body
+
+
+def build_extended_handshake(listen_port: int | None = None) -> bytes:
+    payload = {"m": dict(LOCAL_EXTENSIONS), "v": CLIENT_VERSION, "reqq": 250}
+    if listen_port:
+        payload["p"] = listen_port
+    return build_extended_message(EXTENDED_HANDSHAKE_ID, payload)
+
+
+def parse_extended_handshake(body: bytes) -> dict:
+    """Return the peer's extension name -> message id map (0 = disabled)"""
+    handshake = bcoding.bdecode(body)
+    extensions = handshake.get("m", {})
+    if not isinstance(extensions, dict):
+        return {}
+    return {
+        name: message_id
+        for name, message_id in extensions.items()
+        if isinstance(message_id, int) and message_id > 0
+    }
+
+
+def _split_families(peers) -> tuple[list, list]:
+    ipv4, ipv6 = [], []
+    for peer in peers:
+        try:
+            version = ipaddress.ip_address(peer[0]).version
+        except ValueError:
+            continue
+        (ipv6 if version == 6 else ipv4).append(peer)
+    return ipv4, ipv6
+
+
+def build_pex_payload(added, dropped) -> dict:
+    added4, added6 = _split_families(list(added)[:PEX_MAX_PEERS])
+    dropped4, dropped6 = _split_families(dropped)
+    return {
+        "added": encode_compact_peers(added4),
+        "added.f": b"\x00" * len(added4),
+        "dropped": encode_compact_peers(dropped4),
+        "added6": encode_compact_peers6(added6),
+        "added6.f": b"\x00" * len(added6),
+        "dropped6": encode_compact_peers6(dropped6),
+    }
+
+
+def parse_pex_payload(body: bytes) -> tuple[list, list]:
+    """Return (added, dropped) peer addresses from a ut_pex message"""
+    message = bcoding.bdecode(body)
+    return _pex_peers(message, "added"), _pex_peers(message, "dropped")
+
+
+def _pex_peers(message: dict, key: str) -> list:
+    """Up to PEX_MAX_PEERS addresses of a PEX list, cut before decoding"""
+    peers = decode_compact_peers(_raw(message.get(key, b""))[: 6 * PEX_MAX_PEERS])
+    room = PEX_MAX_PEERS - len(peers)
+    peers += decode_compact_peers6(_raw(message.get(f"{key}6", b""))[: 18 * room])
+    return peers
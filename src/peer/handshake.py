@@ -1,25 +1,148 @@
+from src.metrics import LatencyStat
+from src.peer.choker import Choker
 from src.peer.connection import PeerConnection
-from src.peer.seeder import SeederServer
+from src.peer.dialer import Connector
+from src.peer.peer_cache import PeerCache
+from src.peer.piece_picker import BlockPool
+from src.peer.ratelimit import RateLimits
+from src.peer.scoreboard import PeerScoreboard
+from src.peer.seeder import DEFAULT_PORT, SeederServer
+from src.peer.swarm import Swarm
 from src.tracker.get_peers import GetPeers
 from src.torrent.parser import TorrentFileParser
-from src.storage.file_manager import StorageManager
+from src.storage.file_manager import CHECK_BACKGROUND, CHECK_FULL, StorageManager
 from src import state
 import logging
-import socket
+import queue
 import threading
 import time
 
+# Peers downloaded from at the same time, per torrent
+MAX_ACTIVE_PEERS = 8
+# How often free connection slots are filled from the swarm
+DIAL_INTERVAL = 1.0
+# With no peer connected or being dialed, look for peers again this often
+RETRY_INTERVAL = 5.0
+
 
 class HandShakeTCP:
     source: str
     destination: str
     logger = logging.getLogger(__name__)
 
-    def __init__(self, source: str, destination: str, seed: bool = True) -> None:
+    def __init__(
+        self,
+        source: str,
+        destination: str,
+        seed: bool = True,
+        dht=None,
+        listener=None,
+        super_seed: bool = False,
+        limits: RateLimits | None = None,
+        connector: Connector | None = None,
+        control: state.Control | None = None,
+        check: str = CHECK_FULL,
+    ) -> None:
         self.source = source
         self.destination = destination
         self.seed = seed
         self.seeder = None
+        self.dht = dht
+        # Shared PeerListener; without one the seeder binds its own port
+        self.listener = listener
+        self.super_seed = super_seed
+        # This torrent's bandwidth limits; each peer gets a child of them
+        self.limits = limits or RateLimits()
+        self.scoreboard = PeerScoreboard()
+        # Shared Connector; without one the torrent runs its own
+        self.connector = connector
+        self.swarm = Swarm(score=self.scoreboard.score)
+        self._active = []
+        self._dialing = set()
+        self._connected = queue.Queue()
+        self.peer_cache = None
+        self.choker = None
+        # Outgoing connection slots; a Session adjusts this to the torrent's need
+        self.max_peers = MAX_ACTIVE_PEERS
+        self.status = "starting"
+        # How data already on disk is checked: CHECK_FULL, _BACKGROUND or _SKIP
+        self.check = check
+        self.info_hash = None
+        self._storage = None
+        self.tracker_latency = LatencyStat()
+        # Pauses and stops this torrent alone; a child of the process' control
+        self.control = control if control is not None else state.Control(state.root())
+
+    def stop(self):
+        """Stop this torrent only, whether downloading or seeding"""
+        self.control.stop()
+
+    @property
+    def complete(self) -> bool:
+        return self._storage is not None and all(self._storage.pieces_status)
+
+    def bytes_left(self) -> int | None:
+        """Bytes still to download, None until the torrent is checked"""
+        return self._storage.bytes_left() if self._storage is not None else None
+
+    def stats(self) -> dict:
+        """Live figures for the torrent as a whole"""
+        storage = self._storage
+        peers = self.peer_stats()
+        stats = {
+            "status": self.status,
+            "pieces": 0,
+            "total_pieces": 0,
+            "bytes_left": self.bytes_left(),
+            "download_rate": sum(p["download_rate"] for p in peers),
+            "upload_rate": sum(p["upload_rate"] for p in peers),
+            "peers": len(peers),
+            "known_peers": len(self.swarm),
+            "requests_in_flight": sum(p.get("in_flight", 0) for p in peers),
+            "uploaded": self.limits.upload.total,
+            "downloaded": self.limits.download.total,
+            "tracker": self.tracker_latency.snapshot(),
+        }
+        if storage is not None:
+            stats.update(
+                name=storage.torrent_info["name"],
+                size=storage.total_length,
+                checking=storage.checking,
+                pieces=storage.completed_pieces,
+                total_pieces=storage.total_pieces,
+                verify=storage.verify_latency.snapshot(),
+                disk_read=storage.read_latency.snapshot(),
+                disk_write=storage.write_latency.snapshot(),
+            )
+        return stats
+
+    def peer_stats(self) -> list[dict]:
+        """One entry per connected peer, outgoing and incoming"""
+        choker = self.choker
+        if choker is None:
+            return []
+        stats = []
+        for peer in choker.registered():
+            outgoing = isinstance(peer, PeerConnection)
+            address = peer.address if outgoing else peer.addr
+            peer_stats = {
+                "address": f"{address[0]}:{address[1]}",
+                "direction": "out" if outgoing else "in",
+                "download_rate": peer.download_rate,
+                "upload_rate": peer.upload_rate,
+                "am_choking": peer.am_choking,
+                "peer_interested": peer.peer_interested,
+            }
+            if outgoing:
+                peer_stats.update(
+                    snubbed=peer.snubbed,
+                    in_flight=len(peer.pending_requests),
+                    latency=peer.latency,
+                )
+            else:
+                peer_stats["queued_bytes"] = peer.pending_output
+            stats.append(peer_stats)
+        return stats
 
     def handshake(self) -> None:
         parse_result = TorrentFileParser(self.source, self.destination).parse()
@@ -28,79 +151,242 @@ class HandShakeTCP:
             return
 
         _, info_hash, peer_id, _, torrent_info = parse_result
-        peers, _, _ = GetPeers(self.source, self.destination).peers()
+        self.info_hash = info_hash
 
-        if peers is None:
-            logging.error("Failed to get peers from tracker")
-            return
+        # Dial peers that served us before while the tracker is announced to
+        self.peer_cache = PeerCache(info_hash)
+        cached_peers = self.peer_cache.best_peers()
+        self.swarm.extend(cached_peers)
+        tracker_thread = threading.Thread(target=self._announce, daemon=True)
+        tracker_thread.start()
 
-        storage = StorageManager(torrent_info, self.destination)
+        if cached_peers:
+            logging.info(f"Dialing {len(cached_peers)} cached peers during announce")
+        else:
+            tracker_thread.join()
+            if not len(self.swarm):
+                if self.dht is None:
+                    logging.error("Failed to get peers from tracker")
+                    return
+                logging.warning("Failed to get peers from tracker, falling back to DHT")
+
+        self.status = "checking"
+        storage = StorageManager(torrent_info, self.destination, check=self.check)
+        self._storage = storage
+        if self.check == CHECK_BACKGROUND:
+            storage.check_in_background(self.control.is_stopped)
+
+        self.choker = Choker(is_seeding=lambda: all(storage.pieces_status))
+        self.choker.start()
 
         if self.seed:
-            self.seeder = SeederServer(info_hash, peer_id, storage)
+            self.seeder = SeederServer(
+                info_hash,
+                peer_id,
+                storage,
+                choker=self.choker,
+                listener=self.listener,
+                super_seed=self.super_seed,
+                limits=self.limits,
+                scoreboard=self.scoreboard,
+            )
             seeder_thread = threading.Thread(target=self.seeder.start, daemon=True)
             seeder_thread.start()
 
-        while not all(storage.pieces_status):
-            if state.is_stopped():
-                logging.info("Download stopped by user")
-                self._stop_seeder()
-                return
-            if not state.wait_if_paused():
-                self._stop_seeder()
-                return
+        if self.dht is not None:
+            if len(self.swarm):
+                threading.Thread(
+                    target=self._discover_dht_peers, args=(info_hash,), daemon=True
+                ).start()
+            else:
+                self._discover_dht_peers(info_hash)
 
-            connected = False
-            for peer in peers:
-                if state.is_stopped():
-                    self._stop_seeder()
+        # Connections download concurrently from one pool of blocks, so a
+        # stalled peer's blocks are fetched from the others
+        self._ids = (info_hash, peer_id)
+        self._pool = BlockPool(storage)
+        owns_connector = self.connector is None
+        if owns_connector:
+            self.connector = Connector()
+            threading.Thread(target=self.connector.start, daemon=True).start()
+
+        try:
+            next_dial = 0.0
+            idle_since = time.monotonic()
+            self.status = "downloading"
+            while not all(storage.pieces_status):
+                if self.control.is_stopped():
+                    logging.info("Download stopped by user")
+                    return
+                if not self.control.wait_if_paused():
                     return
-                if all(storage.pieces_status):
-                    break
-
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(5)
-                try:
-                    logging.info(f"Connecting to {peer[0]}:{peer[1]}")
-                    sock.connect(peer)
-                    # PeerConnection handles the handshake
-                    peer_connection = PeerConnection(sock, info_hash, peer_id, storage)
-                    peer_connection.start()
-                    peer_connection.join()
-                    # Socket closed by PeerConnection.run()
-                    connected = True
-                    if all(storage.pieces_status):
+
+                self._start_sessions()
+                self._reap_connections()
+                now = time.monotonic()
+                if now >= next_dial:
+                    self._dial_peers()
+                    next_dial = now + DIAL_INTERVAL
+
+                if self._active or self._dialing:
+                    idle_since = now
+                elif now - idle_since >= RETRY_INTERVAL and not tracker_thread.is_alive():
+                    logging.error(
+                        "Could not connect to any peer or download incomplete. Retrying..."
+                    )
+                    idle_since = now
+                    if self.dht is not None:
+                        self._discover_dht_peers(info_hash)
+                self.control.wait_stopped(0.1)
+
+            logging.info("Download complete!")
+            if self.seed and self.seeder:
+                logging.info("Seeding")
+                self.status = "seeding"
+                while not self.control.is_stopped():
+                    if not self.control.wait_if_paused():
                         break
+                    self._start_sessions()
+                    self._reap_connections()
+                    self.control.wait_stopped(1)
+        finally:
+            self.status = "stopped"
+            storage.save_resume()
+            self._stop_connections()
+            self._stop_seeder()
+            if owns_connector:
+                self.connector.stop()
+                self.connector = None
 
-                except Exception as e:
-                    logging.error(f"Error connecting to {peer[0]}:{peer[1]}: {e}")
-                    try:
-                        sock.close()
-                    except Exception:
-                        pass
+    def _dial_peers(self):
+        """Queue connects to the best peers we aren't talking to, up to the free slots"""
+        free = self.max_peers - len(self._active) - len(self._dialing)
+        if free <= 0:
+            return
+        busy = self.swarm.connected_peers() | self._dialing
+        # Fastest known peers first; banned ones are skipped
+        for peer in self.swarm.ranked(self.scoreboard.score):
+            if free <= 0:
+                break
+            if peer in busy:
+                continue
+            if self.connector.connect(peer, self._on_connect):
+                self._dialing.add(peer)
+                free -= 1
 
-            if not connected and not all(storage.pieces_status):
-                if state.is_stopped():
-                    self._stop_seeder()
-                    return
-                logging.error(
-                    "Could not connect to any peer or download incomplete. Retrying..."
-                )
-                time.sleep(5)
-            elif all(storage.pieces_status):
-                logging.info("Download complete!")
+    def _on_connect(self, peer, sock, error):
+        # Runs on the connector thread; sessions are started by handshake()
+        self._connected.put((peer, sock, error))
+
+    def _start_sessions(self):
+        """Start a PeerConnection for each connect the connector completed"""
+        while True:
+            try:
+                peer, sock, error = self._connected.get_nowait()
+            except queue.Empty:
+                return
+            self._dialing.discard(peer)
+            if error is not None:
+                self.peer_cache.record_failure(peer)
+                continue
+            if all(self._storage.pieces_status) or self.control.is_stopped():
+                sock.close()
+                continue
+
+            info_hash, peer_id = self._ids
+            # PeerConnection handles the handshake
+            peer_connection = PeerConnection(
+                sock,
+                info_hash,
+                peer_id,
+                self._storage,
+                swarm=self.swarm,
+                address=peer,
+                listen_port=self.seeder.port if self.seeder else None,
+                choker=self.choker,
+                limits=self.limits.peer(),
+                scoreboard=self.scoreboard,
+                pool=self._pool,
+                control=self.control,
+            )
+            self.swarm.mark_connected(peer)
+            peer_connection.start()
+            self._active.append(peer_connection)
+
+    def _reap_connections(self):
+        """Record the sessions of connections that have finished"""
+        for peer_connection in [c for c in self._active if not c.is_alive()]:
+            self._active.remove(peer_connection)
+            self._record_session(peer_connection)
+
+    def _stop_connections(self):
+        for peer_connection in self._active:
+            peer_connection.stop()
+        for peer_connection in self._active:
+            peer_connection.join(timeout=5)
+        self._reap_connections()
+        # Connects that completed after we stopped dialing
+        while True:
+            try:
+                _, sock, _ = self._connected.get_nowait()
+            except queue.Empty:
                 break
+            if sock is not None:
+                sock.close()
 
-        if self.seed and self.seeder:
-            print("\nDownload complete! Seeding... (press 'q' to stop)")
-            while not state.is_stopped():
-                if not state.wait_if_paused():
-                    break
-                time.sleep(1)
-            self._stop_seeder()
+    def _record_session(self, peer_connection):
+        # Socket closed by PeerConnection.run()
+        peer = peer_connection.address
+        self.swarm.mark_disconnected(peer)
+        duration = time.monotonic() - peer_connection.connected_at
+        self.scoreboard.record_session(
+            peer,
+            peer_connection.downloaded,
+            duration,
+            snubbed=peer_connection.snubbed,
+        )
+        if peer_connection.handshake_ok and not peer_connection.snubbed:
+            self.peer_cache.record_success(peer, peer_connection.downloaded, duration)
+        else:
+            self.peer_cache.record_failure(peer)
+        self.peer_cache.save()
+
+    def _announce(self):
+        try:
+            peers, _, _ = GetPeers(
+                self.source,
+                self.destination,
+                port=self._listen_port(),
+                latency=self.tracker_latency,
+            ).peers()
+        except Exception as e:
+            logging.error(f"Tracker announce failed: {e}")
+            return
+        if peers is None:
+            logging.warning("Failed to get peers from tracker")
+            return
+        self.swarm.extend(peers)
+
+    def _listen_port(self) -> int:
+        """The port peers can reach us on, as announced to trackers"""
+        if self.listener is not None and self.listener.listening.wait(5):
+            return self.listener.port
+        return DEFAULT_PORT
+
+    def _discover_dht_peers(self, info_hash: bytes):
+        """Add peers found through the DHT and announce ourselves if seeding"""
+        try:
+            self.swarm.extend(self.dht.get_peers(info_hash))
+            if self.seeder is not None:
+                self.dht.announce_peer(info_hash, self.seeder.port)
+        except Exception as e:
+            logging.error(f"DHT lookup failed: {e}")
 
     def _stop_seeder(self):
-        """Stop the seeder server if running"""
+        """Stop the seeder server and choker if running"""
         if self.seeder:
             self.seeder.stop()
             self.seeder = None
+        if self.choker:
+            self.choker.stop()
+            self.choker = None
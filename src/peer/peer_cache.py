@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from src.storage.paths import data_dir
+
+logger = logging.getLogger(__name__)
+
+MAX_CACHED_PEERS = 200
+# Entries not seen for this long are forgotten
+MAX_AGE = 30 * 24 * 3600
+# Consecutive failures after which a peer is no longer dialed from the cache
+MAX_FAILURES = 3
+# Weight of the newest sample in the throughput moving average
+RATE_SMOOTHING = 0.5
+
+
+class PeerCache:
+    """Peers that recently served a torrent, persisted per info_hash.
+
+    Each entry keeps when the peer was last seen, a moving average of the
+    download rate it gave us (bytes/s) and its consecutive failure count.
+    """
+
+    def __init__(self, info_hash: bytes, cache_dir: str | None = None):
+        self.info_hash = info_hash
+        cache_dir = cache_dir or os.path.join(data_dir(), "peers")
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"{info_hash.hex()}.json")
+        self.entries: dict[tuple[str, int], dict] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as fh:
+                saved = json.load(fh)
+            now = time.time()
+            with self._lock:
+                for entry in saved.get("peers", []):
+                    if now - entry["last_seen"] > MAX_AGE:
+                        continue
+                    peer = (entry["ip"], entry["port"])
+                    self.entries[peer] = {
+                        "last_seen": entry["last_seen"],
+                        "rate": entry.get("rate", 0.0),
+                        "failures": entry.get("failures", 0),
+                    }
+            logger.info(f"Loaded {len(self.entries)} cached peers from '{self.path}'")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Failed to load peer cache '{self.path}': {e}")
+
+    def save(self):
+        with self._lock:
+            ranked = sorted(self.entries.items(), key=lambda item: self._score(item[1]))
+            peers = [
+                {"ip": peer[0], "port": peer[1], **entry}
+                for peer, entry in ranked[:MAX_CACHED_PEERS]
+            ]
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as fh:
+                json.dump({"peers": peers}, fh)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Failed to save peer cache '{self.path}': {e}")
+
+    def record_success(self, peer: tuple, downloaded: int, duration: float):
+        """A session with ``peer`` completed the handshake"""
+        with self._lock:
+            entry = self.entries.setdefault(
+                peer, {"last_seen": 0.0, "rate": 0.0, "failures": 0}
+            )
+            entry["last_seen"] = time.time()
+            entry["failures"] = 0
+            if downloaded > 0 and duration > 0:
+                rate = downloaded / duration
+                if entry["rate"]:
+                    rate = RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * entry["rate"]
+                entry["rate"] = rate
+
+    def record_failure(self, peer: tuple):
+        with self._lock:
+            entry = self.entries.get(peer)
+            if entry is not None:
+                entry["failures"] += 1
+
+    def best_peers(self, limit: int = 50) -> list[tuple[str, int]]:
+        """Cached peers worth dialing, fastest and most recently seen first"""
+        with self._lock:
+            usable = [
+                (peer, entry)
+                for peer, entry in self.entries.items()
+                if entry["failures"] < MAX_FAILURES
+            ]
+        usable.sort(key=lambda item: self._score(item[1]))
+        return [peer for peer, _ in usable[:limit]]
+
+    @staticmethod
+    def _score(entry: dict):
+        return -entry["rate"], entry["failures"], -entry["last_seen"]
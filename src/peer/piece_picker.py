@@ -0,0 +1,217 @@
+import bisect
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 16384
+# A block that timed out on a connection goes back to that same connection
+# only after this many seconds, giving other peers the first chance
+RETAKE_AFTER = 5
+
+
+class PartialPiece:
+    """A piece being downloaded: its buffer and the state of each block"""
+
+    def __init__(self, index: int, size: int, block_size: int):
+        self.index = index
+        self.buffer = bytearray(size)
+        self.blocks = [
+            (begin, min(block_size, size - begin)) for begin in range(0, size, block_size)
+        ]
+        self.received = set()
+        # begin -> (connection, deadline) for blocks requested from a peer
+        self.owners = {}
+        # Addresses of the peers that sent blocks, blamed if the hash fails
+        self.sources = set()
+        self.verifying = False
+
+    @property
+    def complete(self) -> bool:
+        return len(self.received) == len(self.blocks)
+
+
+class BlockPool:
+    """Blocks of the pieces in progress, shared by a torrent's connections.
+
+    Connections take blocks to request from the pool and hand back what
+    arrives. A block whose request misses its deadline can be handed to
+    another connection, so a stalled peer never freezes a piece; blocks a
+    connection can no longer expect (choke, reject, disconnect) are
+    released straight away.
+    """
+
+    def __init__(self, storage_manager, block_size: int = BLOCK_SIZE):
+        self.storage_manager = storage_manager
+        self.block_size = block_size
+        self._pieces: dict[int, PartialPiece] = {}
+        # Pieces neither done nor in progress, in index order, so picking a
+        # new piece doesn't walk every piece of the torrent; pieces done
+        # elsewhere (a background check) are dropped when next come across
+        self._missing = [
+            i for i, done in enumerate(storage_manager.pieces_status) if not done
+        ]
+        self._lock = threading.Lock()
+
+    def pick(
+        self,
+        conn,
+        has_piece,
+        count: int,
+        deadline: float,
+        preferred=(),
+        allowed=None,
+    ) -> list[tuple[int, int, int]]:
+        """Assign up to ``count`` blocks to ``conn``, returning its requests.
+
+        Pieces already in progress are finished first, including blocks
+        whose request to another peer timed out. New pieces come from
+        ``preferred`` first, then in index order. ``allowed`` restricts
+        both to a set of pieces (e.g. allowed fast while choked). Blocks
+        that timed out on ``conn`` itself are only retried from it when
+        there is nothing else to ask it for.
+        """
+        now = time.monotonic()
+        requests = []
+        total_pieces = self.storage_manager.total_pieces
+        with self._lock:
+            for piece in list(self._pieces.values()):
+                if len(requests) >= count:
+                    return requests
+                if piece.verifying or not self._eligible(piece.index, has_piece, allowed):
+                    continue
+                self._assign(piece, conn, count - len(requests), now, deadline, requests)
+
+            candidates = itertools.chain(
+                preferred, allowed if allowed is not None else self._missing
+            )
+            # Taken out of _missing once the loop is done with it
+            taken = []
+            for index in candidates:
+                if len(requests) >= count:
+                    break
+                if index in self._pieces or not 0 <= index < total_pieces:
+                    continue
+                if self.storage_manager.pieces_status[index]:
+                    taken.append(index)
+                    continue
+                if not self._eligible(index, has_piece, allowed):
+                    continue
+                piece = PartialPiece(
+                    index, self.storage_manager.piece_size(index), self.block_size
+                )
+                self._pieces[index] = piece
+                taken.append(index)
+                logger.info(f"Starting to download piece {index}")
+                self._assign(piece, conn, count - len(requests), now, deadline, requests)
+            for index in taken:
+                self._discard_missing(index)
+
+            for piece in list(self._pieces.values()):
+                if len(requests) >= count:
+                    break
+                if piece.verifying or not self._eligible(piece.index, has_piece, allowed):
+                    continue
+                self._assign(
+                    piece, conn, count - len(requests), now, deadline, requests, retake=True
+                )
+        return requests
+
+    def _discard_missing(self, index: int):
+        position = bisect.bisect_left(self._missing, index)
+        if position < len(self._missing) and self._missing[position] == index:
+            del self._missing[position]
+
+    @staticmethod
+    def _eligible(index: int, has_piece, allowed) -> bool:
+        return has_piece(index) and (allowed is None or index in allowed)
+
+    @staticmethod
+    def _assign(piece, conn, count, now, deadline, requests, retake=False):
+        for begin, length in piece.blocks:
+            if count <= 0:
+                return
+            if begin in piece.received:
+                continue
+            owner = piece.owners.get(begin)
+            if owner is not None and (
+                owner[1] > now
+                or (owner[0] is conn and not (retake and owner[1] + RETAKE_AFTER <= now))
+            ):
+                continue
+            if owner is not None and owner[0] is not conn:
+                logger.info(
+                    f"Reassigning timed out block piece={piece.index}, begin={begin}"
+                )
+            piece.owners[begin] = (conn, deadline)
+            requests.append((piece.index, begin, length))
+            count -= 1
+
+    def received(self, conn, piece_index: int, begin: int, data: bytes):
+        """Store a block; returns (accepted, finished piece data or None).
+
+        Once every block is in, the piece's data is returned for the caller
+        to verify, and the piece waits for ``finish``.
+        """
+        with self._lock:
+            piece = self._pieces.get(piece_index)
+            if (
+                piece is None
+                or piece.verifying
+                or begin in piece.received
+                or (begin, len(data)) not in piece.blocks
+            ):
+                return False, None
+            piece.buffer[begin: begin + len(data)] = data
+            piece.received.add(begin)
+            piece.owners.pop(begin, None)
+            if getattr(conn, "address", None) is not None:
+                piece.sources.add(conn.address)
+            if not piece.complete:
+                return True, None
+            piece.verifying = True
+            return True, bytes(piece.buffer)
+
+    def sources(self, piece_index: int) -> set:
+        with self._lock:
+            piece = self._pieces.get(piece_index)
+            return set(piece.sources) if piece else set()
+
+    def finish(self, piece_index: int):
+        """The piece was verified (and written) or failed: forget it either way"""
+        with self._lock:
+            if (
+                self._pieces.pop(piece_index, None) is not None
+                and not self.storage_manager.pieces_status[piece_index]
+            ):
+                # Failed its hash check: to be downloaded again
+                bisect.insort(self._missing, piece_index)
+
+    def release(self, conn, requests):
+        """Return blocks ``conn`` requested so other connections can take them"""
+        with self._lock:
+            for piece_index, begin, _ in requests:
+                piece = self._pieces.get(piece_index)
+                if piece is None:
+                    continue
+                owner = piece.owners.get(begin)
+                if owner is not None and owner[0] is conn:
+                    del piece.owners[begin]
+
+    def expire(self, conn, requests):
+        """``conn`` gave up waiting for these blocks; let other connections take them"""
+        now = time.monotonic()
+        with self._lock:
+            for piece_index, begin, _ in requests:
+                piece = self._pieces.get(piece_index)
+                if piece is None:
+                    continue
+                owner = piece.owners.get(begin)
+                if owner is not None and owner[0] is conn:
+                    piece.owners[begin] = (conn, min(owner[1], now))
+
+    def in_progress(self) -> list[int]:
+        with self._lock:
+            return list(self._pieces)
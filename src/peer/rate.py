@@ -0,0 +1,32 @@
+import math
+import threading
+import time
+
+
+class RateMeter:
+    """Exponentially decaying transfer rate estimate in bytes per second"""
+
+    def __init__(self, window: float = 20.0):
+        self.window = window
+        self.total = 0
+        self._rate = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _decay(self, now: float):
+        elapsed = now - self._last
+        if elapsed > 0:
+            self._rate *= math.exp(-elapsed / self.window)
+            self._last = now
+
+    def update(self, amount: int):
+        with self._lock:
+            self._decay(time.monotonic())
+            self._rate += amount / self.window
+            self.total += amount
+
+    @property
+    def rate(self) -> float:
+        with self._lock:
+            self._decay(time.monotonic())
+            return self._rate
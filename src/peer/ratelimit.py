@@ -0,0 +1,133 @@
+import threading
+import time
+import weakref
+
+# A bucket holds at least this much so a full block can always go out
+MIN_BURST = 2 * 16384
+
+
+class TokenBucket:
+    """Token bucket limiting a byte rate; a rate of 0 means unlimited.
+
+    ``reserve`` always takes the tokens, letting the balance go negative,
+    and returns how long the caller should wait before moving more data.
+    That way several buckets can be charged for the same bytes and the
+    longest wait honoured. ``total`` counts every byte charged, limited
+    or not.
+    """
+
+    def __init__(self, rate: float = 0, burst: float | None = None):
+        self.rate = 0.0
+        self.burst = 0.0
+        self.tokens = 0.0
+        self.total = 0
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: float, burst: float | None = None):
+        """Change the limit (bytes/s); takes effect immediately"""
+        with self._lock:
+            self._refill()
+            was_unlimited = not self.rate
+            self.rate = max(0.0, float(rate))
+            # About one second of traffic by default
+            self.burst = burst if burst is not None else max(self.rate, MIN_BURST)
+            if was_unlimited:
+                self.tokens = self.burst
+            self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self, n: int) -> float:
+        """Take ``n`` bytes worth of tokens, returning the seconds to wait"""
+        with self._lock:
+            self.total += n
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self.tokens -= n
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            elapsed = now - self._stamp
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self._stamp = now
+
+
+class RateLimits:
+    """Upload and download buckets at one level: process, torrent or peer.
+
+    Traffic is charged to a level's buckets and to all of its parents', so
+    a peer is held to its own limit, its torrent's and the process-wide one.
+    ``peer_upload`` / ``peer_download`` are the limits given to each new
+    peer created with ``peer()``; ``set_peer_limits`` changes them for the
+    live peers below a level too.
+    """
+
+    def __init__(
+        self,
+        upload: float = 0,
+        download: float = 0,
+        parent: "RateLimits | None" = None,
+    ):
+        self.upload = TokenBucket(upload)
+        self.download = TokenBucket(download)
+        self.parent = parent
+        self.peer_upload = parent.peer_upload if parent else 0
+        self.peer_download = parent.peer_download if parent else 0
+        # Levels below that inherit the peer limits, and peers of this one
+        self._children = weakref.WeakSet()
+        self._peers = weakref.WeakSet()
+
+    def child(self, upload: float = 0, download: float = 0) -> "RateLimits":
+        child = RateLimits(upload, download, parent=self)
+        self._children.add(child)
+        return child
+
+    def peer(self) -> "RateLimits":
+        peer = RateLimits(self.peer_upload, self.peer_download, parent=self)
+        self._peers.add(peer)
+        return peer
+
+    def set_limits(self, upload: float | None = None, download: float | None = None):
+        """Adjust this level's limits at runtime (bytes/s, 0 = unlimited)"""
+        if upload is not None:
+            self.upload.set_rate(upload)
+        if download is not None:
+            self.download.set_rate(download)
+
+    def set_peer_limits(
+        self, upload: float | None = None, download: float | None = None
+    ):
+        """Adjust the per-peer limits here and below, live peers included"""
+        if upload is not None:
+            self.peer_upload = upload
+        if download is not None:
+            self.peer_download = download
+        for peer in list(self._peers):
+            peer.set_limits(upload, download)
+        for child in list(self._children):
+            child.set_peer_limits(upload, download)
+
+    def reserve_upload(self, n: int) -> float:
+        return max(limits.upload.reserve(n) for limits in self._chain())
+
+    def reserve_download(self, n: int) -> float:
+        return max(limits.download.reserve(n) for limits in self._chain())
+
+    def upload_limit(self) -> float:
+        """The tightest upload limit along the chain, 0 if unlimited"""
+        return min((l.upload.rate for l in self._chain() if l.upload.rate), default=0)
+
+    def download_limit(self) -> float:
+        """The tightest download limit along the chain, 0 if unlimited"""
+        return min(
+            (l.download.rate for l in self._chain() if l.download.rate), default=0
+        )
+
+    def _chain(self):
+        limits = self
+        while limits is not None:
+            yield limits
+            limits = limits.parent
@@ -0,0 +1,101 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Failed pieces a peer may contribute to before its IP is banned
+MAX_HASH_FAILURES = 2
+# Weight of the newest sample in the latency moving average
+LATENCY_SMOOTHING = 0.3
+# Score multiplier for a peer that snubbed us last time
+SNUB_PENALTY = 0.1
+
+
+class PeerRecord:
+    """What one torrent session has learned about a peer"""
+
+    def __init__(self):
+        self.downloaded = 0
+        self.rate = 0.0
+        self.latency = None
+        self.hash_failures = 0
+        self.snubbed = False
+        self.sessions = 0
+
+
+class PeerScoreboard:
+    """Per-torrent peer quality: throughput, latency, hash failures, bans.
+
+    Bans are by IP, so a peer that sent corrupt data can't come back on
+    another port, through either our dialer or our listener.
+    """
+
+    def __init__(self, max_hash_failures: int = MAX_HASH_FAILURES):
+        self.max_hash_failures = max_hash_failures
+        self.records: dict[tuple[str, int], PeerRecord] = {}
+        self.banned: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _record(self, peer: tuple) -> PeerRecord:
+        return self.records.setdefault((peer[0], int(peer[1])), PeerRecord())
+
+    def record_session(self, peer: tuple, downloaded: int, duration: float, snubbed=False):
+        with self._lock:
+            record = self._record(peer)
+            record.sessions += 1
+            record.downloaded += downloaded
+            record.snubbed = snubbed
+            if duration > 0:
+                record.rate = downloaded / duration
+
+    def record_latency(self, peer: tuple, latency: float):
+        with self._lock:
+            record = self._record(peer)
+            if record.latency is None:
+                record.latency = latency
+            else:
+                record.latency = (
+                    LATENCY_SMOOTHING * latency
+                    + (1 - LATENCY_SMOOTHING) * record.latency
+                )
+
+    def record_hash_failure(self, contributors) -> list[tuple[str, int]]:
+        """Charge a failed piece to every peer that sent blocks of it.
+
+        Returns the peers banned as a result.
+        """
+        banned = []
+        with self._lock:
+            for peer in contributors:
+                record = self._record(peer)
+                record.hash_failures += 1
+                if (
+                    record.hash_failures >= self.max_hash_failures
+                    and peer[0] not in self.banned
+                ):
+                    self.banned.add(peer[0])
+                    banned.append(peer)
+        for peer in banned:
+            logger.warning(f"Banned {peer[0]} after repeated hash failures")
+        return banned
+
+    def is_banned(self, peer) -> bool:
+        """``peer`` is an address tuple or a bare IP"""
+        ip = peer if isinstance(peer, str) else peer[0]
+        if ip.startswith("::ffff:"):
+            ip = ip[len("::ffff:"):]
+        with self._lock:
+            return ip in self.banned
+
+    def score(self, peer: tuple) -> float | None:
+        """Higher is better; None for banned peers, 0 for unknown ones"""
+        if self.is_banned(peer):
+            return None
+        with self._lock:
+            record = self.records.get((peer[0], int(peer[1])))
+            if record is None:
+                return 0.0
+            score = record.rate
+            if record.snubbed:
+                score = score * SNUB_PENALTY - 1
+            return score
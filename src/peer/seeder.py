@@ -1,213 +1,763 @@
+import os
+import selectors
 import socket
 import struct
 import threading
 import logging
+import time
+from collections import OrderedDict, deque
 
-from src import state
+from src import profiling, state
+from src.peer import extensions
+from src.peer.choker import Choker
+from src.peer.rate import RateMeter
+from src.peer.ratelimit import RateLimits
+from src.peer.superseed import SuperSeeder
+from src.storage.piece_cache import PieceCache
 
 logger = logging.getLogger(__name__)
 
+MAX_CONNECTIONS = 200
+MAX_CONNECTIONS_PER_IP = 4
+HANDSHAKE_TIMEOUT = 30
+# Peers send a keep-alive every two minutes, so this much silence means dead
+IDLE_TIMEOUT = 180
+# Stop reading requests from a peer while this much output is queued for it
+OUTPUT_HIGH_WATER = 1024 * 1024
+MAX_MESSAGE_LENGTH = 1 + 8 + 128 * 1024
+MAX_BLOCK_LENGTH = 128 * 1024
+# Matches the reqq we advertise in the extended handshake
+MAX_QUEUED_REQUESTS = 250
+# Blocks within a single file go from the page cache to the socket directly
+USE_SENDFILE = hasattr(os, "sendfile")
+# Pieces whose last requester is remembered, to spot pieces several peers want
+SHARED_PIECES_TRACKED = 256
+# Files a torrent keeps open for sendfile, least recently used closed first
+MAX_OPEN_FILES = 32
+DEFAULT_PORT = 6889
+
+
+def _normalize_ip(ip: str) -> str:
+    """IPv4 peers reach a dual-stack socket as IPv4-mapped IPv6 addresses"""
+    return ip[len("::ffff:"):] if ip.startswith("::ffff:") else ip
+
+
+class UploadPeer:
+    """An incoming connection as seen by the choker.
+
+    Sends only queue data; the server's event loop writes it out as the
+    socket becomes writable, so ``send`` is safe from any thread. Queued
+    chunks are either buffers or ``(file, offset, count)`` file segments
+    written with ``os.sendfile``.
+    """
+
+    def __init__(self, sock: socket.socket, addr: tuple, fast: bool = False):
+        self.sock = sock
+        self.addr = addr
+        self.ip = _normalize_ip(addr[0])
+        self.fast = fast
+        self.torrent = None
+        self.handshaken = False
+        self.am_choking = True
+        self.peer_interested = False
+        self.allowed_fast = set()
+        self.connected_at = time.monotonic()
+        self.last_activity = self.connected_at
+        self.upload_meter = RateMeter()
+        self.download_meter = RateMeter()
+        self.inbuf = bytearray()
+        # Requests waiting for upload tokens, oldest first
+        self.requests = deque()
+        self.limits = None
+        # When the rate limiters next let us send / read
+        self.send_at = 0.0
+        self.read_at = 0.0
+        self.events = 0
+        self.wakeup = None
+        self._outbuf = deque()
+        self._pending = 0
+        self._send_lock = threading.Lock()
+
+    @property
+    def upload_rate(self) -> float:
+        return self.upload_meter.rate
+
+    @property
+    def download_rate(self) -> float:
+        return self.download_meter.rate
+
+    @property
+    def pending_output(self) -> int:
+        return self._pending
+
+    def send(self, data: bytes):
+        with self._send_lock:
+            self._outbuf.append(memoryview(data))
+            self._pending += len(data)
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def send_file(self, header: bytes, file, offset: int, count: int):
+        """Queue a message whose payload is sent straight from a file"""
+        with self._send_lock:
+            self._outbuf.append(memoryview(header))
+            self._outbuf.append((file, offset, count))
+            self._pending += len(header) + count
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def flush(self):
+        """Write as much queued output as the socket accepts without blocking"""
+        started = profiling.start()
+        try:
+            self._flush()
+        finally:
+            profiling.record(profiling.SEND, started)
 
-class SeederServer:
-    """Server that listens for incoming peer connections and seeds files"""
+    def _flush(self):
+        with self._send_lock:
+            while self._outbuf:
+                chunk = self._outbuf[0]
+                try:
+                    if isinstance(chunk, tuple):
+                        file, offset, count = chunk
+                        sent = os.sendfile(
+                            self.sock.fileno(), file.fileno(), offset, count
+                        )
+                        if sent == 0:
+                            raise EOFError("file shorter than the requested block")
+                        remainder = (file, offset + sent, count - sent)
+                    else:
+                        count = len(chunk)
+                        sent = self.sock.send(chunk)
+                        remainder = chunk[sent:]
+                except BlockingIOError:
+                    return
+                self._pending -= sent
+                if sent < count:
+                    self._outbuf[0] = remainder
+                    return
+                self._outbuf.popleft()
+
+    def choke(self):
+        self.am_choking = True
+        self.send(struct.pack(">IB", 1, 0))
+        logger.info(f"Choked {self.addr}")
+
+    def unchoke(self):
+        self.am_choking = False
+        self.send(struct.pack(">IB", 1, 1))
+        logger.info(f"Unchoked {self.addr}")
+
+
+class PeerListener:
+    """One listening socket shared by every torrent in the process.
+
+    Incoming peers are multiplexed on one selector loop, bounded by
+    ``max_connections`` in total and ``max_per_ip`` per address. Each
+    handshake's info_hash picks the registered ``SeederServer`` that
+    serves the connection. Blocks are read through one ``PieceCache``
+    shared by every upload.
+    """
 
     def __init__(
-        self, info_hash: bytes, peer_id: bytes, storage_manager, port: int = 6889
+        self,
+        port: int = DEFAULT_PORT,
+        max_connections: int = MAX_CONNECTIONS,
+        max_per_ip: int = MAX_CONNECTIONS_PER_IP,
+        piece_cache: PieceCache | None = None,
     ):
-        self.info_hash = info_hash
-        self.peer_id = peer_id
-        self.storage_manager = storage_manager
         self.port = port
+        self.piece_cache = piece_cache or PieceCache()
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
         self.server_socket = None
+        self.selector = None
         self.running = False
-        self.connections = []
+        self.listening = threading.Event()
+        self.torrents: dict[bytes, "SeederServer"] = {}
+        self.connections: dict[socket.socket, UploadPeer] = {}
+        self._ip_counts: dict[str, int] = {}
         self._lock = threading.Lock()
+        self._wakeup_r = None
+        self._wakeup_w = None
+
+    def register(self, torrent: "SeederServer"):
+        with self._lock:
+            self.torrents[torrent.info_hash] = torrent
+        logger.info(f"Serving {torrent.info_hash.hex()} on the shared listener")
+
+    def unregister(self, torrent: "SeederServer"):
+        """Stop serving a torrent; its connections are closed by the loop"""
+        with self._lock:
+            if self.torrents.get(torrent.info_hash) is torrent:
+                del self.torrents[torrent.info_hash]
+        self.piece_cache.discard(torrent.storage_manager)
+        self._wakeup()
 
     def start(self):
-        """Start the seeder server (new thread)"""
+        """Run the listener's event loop (blocks; call from its own thread)"""
         self.running = True
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         try:
-            self.server_socket.bind(("0.0.0.0", self.port))
-            self.server_socket.listen(10)
-            self.server_socket.settimeout(1.0)
-            logger.info(f"Seeder listening on port {self.port}")
-            print(f"\n🌱 Seeding on port {self.port}")
-
-            while self.running and not state.is_stopped():
-                try:
-                    client_sock, addr = self.server_socket.accept()
-                    logger.info(f"Incoming connection from {addr[0]}:{addr[1]}")
-                    handler = threading.Thread(
-                        target=self._handle_incoming,
-                        args=(client_sock, addr),
-                        daemon=True,
-                    )
-                    handler.start()
-                    with self._lock:
-                        self.connections.append(handler)
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    if self.running:
-                        logger.error(f"Accept error: {e}")
-                    break
+            self.server_socket = self._create_server_socket()
         except OSError as e:
             logger.error(f"Failed to bind to port {self.port}: {e}")
+            self.stop()
+            return
+
+        self.server_socket.setblocking(False)
+        self.port = self.server_socket.getsockname()[1]
+        self.selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ, "accept")
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, "wakeup")
+        logger.info(f"Listening for peers on port {self.port}")
+        self.listening.set()
+
+        try:
+            while self.running and not state.is_stopped():
+                self._serve_queued()
+                self._update_interest()
+                for key, mask in self.selector.select(timeout=self._select_timeout()):
+                    if key.data == "accept":
+                        self._accept()
+                    elif key.data == "wakeup":
+                        self._drain_wakeup()
+                    else:
+                        self._service(key.data, mask)
+                self._reap_idle()
+        except Exception as e:
+            if self.running:
+                logger.error(f"Listener loop error: {e}")
         finally:
+            for peer in list(self.connections.values()):
+                self._close(peer)
+            self.selector.close()
+            self._wakeup_r.close()
+            self._wakeup_w.close()
             self.stop()
 
-    def _handle_incoming(self, client_sock: socket.socket, addr: tuple):
-        """Handle an incoming peer connection"""
-        client_sock.settimeout(30)
+    def _create_server_socket(self) -> socket.socket:
+        """Listen on both IPv6 and IPv4 when the host supports dual-stack"""
+        if socket.has_dualstack_ipv6():
+            return socket.create_server(
+                ("::", self.port),
+                family=socket.AF_INET6,
+                backlog=128,
+                dualstack_ipv6=True,
+            )
+        return socket.create_server(("0.0.0.0", self.port), backlog=128)
+
+    def _wakeup(self):
         try:
-            if not self._recv_handshake(client_sock):
-                client_sock.close()
-                return
+            self._wakeup_w.send(b"\x00")
+        except (AttributeError, OSError):
+            pass
 
-            self._send_handshake(client_sock)
-            self._send_bitfield(client_sock)
-            self._handle_requests(client_sock, addr)
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
 
-        except Exception as e:
-            logger.error(f"Error handling peer {addr}: {e}")
-        finally:
+    def _accept(self):
+        while True:
             try:
+                client_sock, addr = self.server_socket.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if self.running:
+                    logger.error(f"Accept error: {e}")
+                return
+
+            ip = _normalize_ip(addr[0])
+            if len(self.connections) >= self.max_connections:
+                logger.warning(f"Connection limit reached, refusing {ip}")
                 client_sock.close()
-            except Exception:
-                pass
+                continue
+            if self._ip_counts.get(ip, 0) >= self.max_per_ip:
+                logger.warning(f"Too many connections from {ip}, refusing")
+                client_sock.close()
+                continue
 
-    def _recv_handshake(self, sock: socket.socket) -> bool:
-        """Receive and validate incoming handshake"""
+            logger.info(f"Incoming connection from {addr[0]}:{addr[1]}")
+            client_sock.setblocking(False)
+            peer = UploadPeer(client_sock, addr)
+            peer.wakeup = self._wakeup
+            peer.events = selectors.EVENT_READ
+            self.selector.register(client_sock, peer.events, peer)
+            self.connections[client_sock] = peer
+            self._ip_counts[ip] = self._ip_counts.get(ip, 0) + 1
+
+    def _serve_queued(self):
+        now = time.monotonic()
+        for peer in list(self.connections.values()):
+            if peer.requests and peer.send_at <= now:
+                peer.torrent._serve_requests(peer)
+
+    def _select_timeout(self) -> float:
+        """Wake up in time for the next peer whose rate limit expires"""
+        now = time.monotonic()
+        timeout = 0.5
+        for peer in self.connections.values():
+            if peer.requests and peer.send_at > now:
+                timeout = min(timeout, peer.send_at - now)
+            if peer.read_at > now:
+                timeout = min(timeout, peer.read_at - now)
+        return timeout
+
+    def _update_interest(self):
+        now = time.monotonic()
+        for peer in list(self.connections.values()):
+            events = 0
+            if peer.pending_output < OUTPUT_HIGH_WATER and peer.read_at <= now:
+                events |= selectors.EVENT_READ
+            if peer.pending_output:
+                events |= selectors.EVENT_WRITE
+            if events != peer.events:
+                peer.events = events
+                self.selector.modify(peer.sock, events, peer)
+
+    def _service(self, peer: UploadPeer, mask: int):
+        try:
+            if mask & selectors.EVENT_WRITE:
+                peer.flush()
+            if mask & selectors.EVENT_READ:
+                started = profiling.start()
+                data = peer.sock.recv(65536)
+                profiling.record(profiling.RECV, started)
+                if not data:
+                    self._close(peer)
+                    return
+                peer.last_activity = time.monotonic()
+                if peer.limits is not None:
+                    delay = peer.limits.reserve_download(len(data))
+                    if delay > 0:
+                        peer.read_at = peer.last_activity + delay
+                peer.inbuf.extend(data)
+                self._process_input(peer)
+        except BlockingIOError:
+            pass
+        except Exception as e:
+            logger.error(f"Error handling peer {peer.addr}: {e}")
+            self._close(peer)
+
+    def _process_input(self, peer: UploadPeer):
+        if not peer.handshaken:
+            if not peer.inbuf:
+                return
+            handshake_len = 1 + peer.inbuf[0] + 48
+            if len(peer.inbuf) < handshake_len:
+                return
+            handshake = self._parse_handshake(bytes(peer.inbuf[:handshake_len]))
+            del peer.inbuf[:handshake_len]
+            if handshake is None:
+                self._close(peer)
+                return
+            reserved, torrent = handshake
+            if torrent.is_banned(peer.ip):
+                logger.info(f"Refusing banned peer {peer.ip}")
+                self._close(peer)
+                return
+            peer.torrent = torrent
+            peer.handshaken = True
+            torrent._start_session(peer, extensions.supports_fast(reserved))
+
+        while len(peer.inbuf) >= 4:
+            msg_len = struct.unpack(">I", peer.inbuf[:4])[0]
+            if msg_len > MAX_MESSAGE_LENGTH:
+                logger.warning(f"Oversized message from {peer.addr}, disconnecting")
+                self._close(peer)
+                return
+            if len(peer.inbuf) < 4 + msg_len:
+                return
+            msg = bytes(peer.inbuf[4: 4 + msg_len])
+            del peer.inbuf[: 4 + msg_len]
+            if msg_len == 0:
+                continue
+            peer.torrent._handle_message(peer, msg[0], msg[1:])
+
+    def _parse_handshake(self, data: bytes):
+        """Validate an incoming handshake, returning (reserved, torrent)"""
+        pstrlen = data[0]
+        pstr = data[1: 1 + pstrlen]
+        reserved = data[1 + pstrlen: 1 + pstrlen + 8]
+        recv_info_hash = data[1 + pstrlen + 8: 1 + pstrlen + 8 + 20]
+
+        if pstr != b"BitTorrent protocol":
+            logger.warning("Invalid protocol in handshake")
+            return None
+
+        with self._lock:
+            torrent = self.torrents.get(recv_info_hash)
+        if torrent is None:
+            logger.warning(f"Handshake for unknown torrent {recv_info_hash.hex()}")
+            return None
+
+        logger.info("Received valid handshake from peer")
+        return reserved, torrent
+
+    def _reap_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            active = set(self.torrents.values())
+        for peer in list(self.connections.values()):
+            if peer.torrent is not None and peer.torrent not in active:
+                self._close(peer)
+            elif not peer.handshaken and now - peer.connected_at > HANDSHAKE_TIMEOUT:
+                logger.info(f"Handshake timeout for {peer.addr}")
+                self._close(peer)
+            elif now - peer.last_activity > IDLE_TIMEOUT:
+                logger.info(f"Closing idle connection {peer.addr}")
+                self._close(peer)
+
+    def _close(self, peer: UploadPeer):
+        if self.connections.pop(peer.sock, None) is None:
+            return
+        count = self._ip_counts.get(peer.ip, 1) - 1
+        if count > 0:
+            self._ip_counts[peer.ip] = count
+        else:
+            self._ip_counts.pop(peer.ip, None)
+        if peer.torrent is not None:
+            peer.torrent._end_session(peer)
+        peer.wakeup = None
         try:
-            pstrlen_bytes = self._recvall(sock, 1)
-            if not pstrlen_bytes:
-                return False
-            pstrlen = pstrlen_bytes[0]
+            self.selector.unregister(peer.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            peer.sock.close()
+        except Exception:
+            pass
 
-            remaining = self._recvall(sock, pstrlen + 8 + 20 + 20)
-            if not remaining or len(remaining) < pstrlen + 48:
-                return False
+    def stop(self):
+        """Stop the listener and close every incoming connection"""
+        self.running = False
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except Exception:
+                pass
+        self._wakeup()
+        stats = self.piece_cache.stats()
+        logger.info(
+            f"Peer listener stopped, piece cache: {stats['hits']} hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.0%})"
+        )
 
-            pstr = remaining[:pstrlen]
-            recv_info_hash = remaining[pstrlen + 8 : pstrlen + 8 + 20]
 
-            if pstr != b"BitTorrent protocol":
-                logger.warning("Invalid protocol in handshake")
-                return False
+class SeederServer:
+    """Seeds one torrent to peers arriving through a ``PeerListener``.
 
-            if recv_info_hash != self.info_hash:
-                logger.warning("Info hash mismatch in handshake")
-                return False
+    Without a shared ``listener`` the server runs its own on ``port``.
+    With ``super_seed`` a complete torrent is super-seeded (BEP 16).
+    Each peer's traffic is shaped by a child of the torrent's ``limits``.
+    """
 
-            logger.info("Received valid handshake from peer")
-            return True
+    def __init__(
+        self,
+        info_hash: bytes,
+        peer_id: bytes,
+        storage_manager,
+        port: int = DEFAULT_PORT,
+        choker: Choker | None = None,
+        max_connections: int = MAX_CONNECTIONS,
+        max_per_ip: int = MAX_CONNECTIONS_PER_IP,
+        listener: PeerListener | None = None,
+        super_seed: bool = False,
+        limits: RateLimits | None = None,
+        scoreboard=None,
+    ):
+        self.info_hash = info_hash
+        self.peer_id = peer_id
+        self.storage_manager = storage_manager
+        self._owns_listener = listener is None
+        self.listener = listener or PeerListener(port, max_connections, max_per_ip)
+        # A choker passed in is shared with the torrent's outgoing connections
+        self._owns_choker = choker is None
+        self.choker = choker or Choker(
+            is_seeding=lambda: all(self.storage_manager.pieces_status)
+        )
+        self._lock = threading.Lock()
+        # Recently served pieces are likely still in the page cache
+        self._hot_pieces = deque(maxlen=32)
+        # The torrent's files opened for sendfile, least recently used first.
+        # An evicted file is closed once the last queued segment using it
+        # is sent, as those segments hold the only other references to it
+        self._files: OrderedDict[str, object] = OrderedDict()
+        # piece index -> address of the peer it was last served to
+        self._last_requester: OrderedDict[int, tuple] = OrderedDict()
+        self.super_seed = super_seed
+        self.super_seeder = None
+        self.limits = limits or RateLimits()
+        # Shared with the torrent's downloads so banned IPs stay out
+        self.scoreboard = scoreboard
+
+    @property
+    def port(self) -> int:
+        return self.listener.port
+
+    @property
+    def listening(self) -> threading.Event:
+        return self.listener.listening
 
-        except Exception as e:
-            logger.error(f"Handshake receive error: {e}")
+    def start(self):
+        """Start seeding; blocks only when running a private listener"""
+        if self._owns_choker:
+            self.choker.start()
+        self.listener.register(self)
+        if self._owns_listener:
+            self.listener.start()
+
+    def is_banned(self, ip: str) -> bool:
+        return self.scoreboard is not None and self.scoreboard.is_banned(ip)
+
+    def _start_session(self, peer: UploadPeer, fast: bool):
+        peer.fast = fast
+        peer.limits = self.limits.peer()
+        self._send_handshake(peer)
+        if self._super_seeding():
+            # Advertise nothing up front; pieces are revealed one by one
+            peer.send(
+                extensions.build_availability(
+                    [False] * self.storage_manager.total_pieces,
+                    fast,
+                    lambda: bytes((self.storage_manager.total_pieces + 7) // 8),
+                )
+            )
+            self._offer(peer, self.super_seeder.peer_joined(peer))
+        else:
+            self._send_bitfield(peer)
+            if fast:
+                self._send_fast_hints(peer)
+        self.choker.register(peer)
+
+    def _end_session(self, peer: UploadPeer):
+        self.choker.unregister(peer)
+        if self.super_seeder is not None:
+            self.super_seeder.peer_left(peer)
+
+    def _super_seeding(self) -> bool:
+        """Super-seed only while we hold every piece"""
+        if not self.super_seed or not all(self.storage_manager.pieces_status):
             return False
-
-    def _send_handshake(self, sock: socket.socket):
+        if self.super_seeder is None:
+            logger.info(f"Super-seeding {self.info_hash.hex()}")
+            self.super_seeder = SuperSeeder(self.storage_manager.total_pieces)
+        return True
+
+    def _offer(self, peer: UploadPeer, piece_index: int | None):
+        if piece_index is None:
+            return
+        logger.info(f"Super-seeding piece {piece_index} to {peer.addr}")
+        peer.send(extensions.build_piece_message(4, piece_index))
+
+    def _peer_has(self, peer: UploadPeer, piece_index: int):
+        if self.super_seeder is None:
+            return
+        if 0 <= piece_index < self.storage_manager.total_pieces:
+            for other, offer in self.super_seeder.peer_has(peer, piece_index):
+                self._offer(other, offer)
+
+    def _peer_bitfield(self, peer: UploadPeer, pieces):
+        if self.super_seeder is None:
+            return
+        total = self.storage_manager.total_pieces
+        pieces = [i for i in pieces if i < total]
+        for other, offer in self.super_seeder.peer_bitfield(peer, pieces):
+            self._offer(other, offer)
+
+    def _send_handshake(self, peer: UploadPeer):
         """Send handshake response"""
-        protocol = b"BitTorrent protocol"
-        packet = struct.pack(
-            f">B{len(protocol)}s8s20s20s",
-            len(protocol),
-            protocol,
-            b"\x00" * 8,
+        packet = extensions.build_handshake(
             self.info_hash,
             self.peer_id,
+            extensions.reserved_bytes(extension_protocol=False),
         )
-        sock.sendall(packet)
+        peer.send(packet)
         logger.info("Sent handshake to peer")
 
-    def _send_bitfield(self, sock: socket.socket):
-        """Send our bitfield to the peer"""
-        bitfield = self.storage_manager.get_bitfield()
-        msg_len = 1 + len(bitfield)
-        msg = struct.pack(f">IB{len(bitfield)}s", msg_len, 5, bitfield)
-        sock.sendall(msg)
+    def _send_bitfield(self, peer: UploadPeer):
+        """Send our bitfield (or have_all / have_none) to the peer"""
+        msg = extensions.build_availability(
+            self.storage_manager.pieces_status,
+            peer.fast,
+            self.storage_manager.get_bitfield,
+        )
+        peer.send(msg)
         logger.info("Sent bitfield to peer")
 
-    def _handle_requests(self, sock: socket.socket, addr: tuple):
-        """Handle piece requests from the peer."""
-        # Unchoke
-        sock.sendall(struct.pack(">IB", 1, 1))
-        logger.info(f"Sent unchoke to {addr}")
-
-        while self.running and not state.is_stopped():
-            try:
-                len_bytes = self._recvall(sock, 4)
-                if not len_bytes:
-                    break
-
-                msg_len = struct.unpack(">I", len_bytes)[0]
-                if msg_len == 0:
-                    continue
-
-                msg = self._recvall(sock, msg_len)
-                if not msg:
-                    break
-
-                msg_id = msg[0]
-                payload = msg[1:]
-
-                if msg_id == 2:
-                    logger.info(f"Peer {addr} is interested")
-                    # Unchoke
-                    sock.sendall(struct.pack(">IB", 1, 1))
-
-                elif msg_id == 6:
-                    piece_index, begin, length = struct.unpack(">III", payload)
-                    logger.info(
-                        f"Request from {addr}: piece={piece_index}, begin={begin}, length={length}"
-                    )
-
-                    block = self.storage_manager.read_piece(piece_index, begin, length)
-
-                    piece_msg_len = 1 + 4 + 4 + len(block)
-                    piece_msg = (
-                        struct.pack(">IBII", piece_msg_len, 7, piece_index, begin)
-                        + block
-                    )
-                    sock.sendall(piece_msg)
-                    logger.info(
-                        f"Sent block to {addr}: piece={piece_index}, begin={begin}, length={len(block)}"
+    def _send_fast_hints(self, peer: UploadPeer):
+        """Send allowed_fast pieces and suggest recently served ones"""
+        for piece_index in extensions.allowed_fast_set(
+            peer.addr[0], self.info_hash, self.storage_manager.total_pieces
+        ):
+            if self.storage_manager.pieces_status[piece_index]:
+                peer.allowed_fast.add(piece_index)
+                peer.send(
+                    extensions.build_piece_message(
+                        extensions.MSG_ALLOWED_FAST, piece_index
                     )
+                )
+        with self._lock:
+            hot_pieces = list(dict.fromkeys(reversed(self._hot_pieces)))
+        for piece_index in hot_pieces[:4]:
+            peer.send(
+                extensions.build_piece_message(extensions.MSG_SUGGEST_PIECE, piece_index)
+            )
+
+    def _handle_message(self, peer: UploadPeer, msg_id: int, payload: bytes):
+        """Handle one message from the peer"""
+        addr = peer.addr
+        if msg_id == 2:
+            logger.info(f"Peer {addr} is interested")
+            peer.peer_interested = True
+            self.choker.peer_interested(peer)
+
+        elif msg_id == 3:
+            logger.info(f"Peer {addr} is not interested")
+            peer.peer_interested = False
+
+        elif msg_id == 4:
+            self._peer_has(peer, struct.unpack(">I", payload)[0])
+
+        elif msg_id == 5:
+            self._peer_bitfield(
+                peer,
+                [
+                    i * 8 + bit
+                    for i, byte in enumerate(payload)
+                    for bit in range(8)
+                    if byte & (0x80 >> bit)
+                ],
+            )
+
+        elif msg_id == extensions.MSG_HAVE_ALL:
+            self._peer_bitfield(peer, range(self.storage_manager.total_pieces))
+
+        elif msg_id == 6:
+            piece_index, begin, length = struct.unpack(">III", payload)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"Request from {addr}: piece={piece_index}, begin={begin}, length={length}"
+                )
+
+            if not (
+                0 <= piece_index < self.storage_manager.total_pieces
+                and self.storage_manager.pieces_status[piece_index]
+                and 0 < length <= MAX_BLOCK_LENGTH
+                and begin + length <= self.storage_manager.piece_size(piece_index)
+            ) or (peer.am_choking and piece_index not in peer.allowed_fast) or (
+                self.super_seeder is not None
+                and not self.super_seeder.may_serve(peer, piece_index)
+            ):
+                # Choked peers' requests are dropped (rejected if fast)
+                if peer.fast:
+                    peer.send(extensions.build_reject(piece_index, begin, length))
+                return
 
-                elif msg_id == 3:
-                    logger.info(f"Peer {addr} is not interested")
-                    break
-
-            except socket.timeout:
+            if len(peer.requests) >= MAX_QUEUED_REQUESTS:
+                logger.warning(f"Request queue of {addr} is full, dropping request")
+                return
+            peer.requests.append((piece_index, begin, length))
+            self._serve_requests(peer)
+
+        elif msg_id == 8:
+            request = struct.unpack(">III", payload)
+            if request in peer.requests:
+                peer.requests.remove(request)
+
+    def _serve_requests(self, peer: UploadPeer):
+        """Send queued blocks while the peer's rate limits allow"""
+        while (
+            peer.requests
+            and peer.send_at <= time.monotonic()
+            and peer.pending_output < OUTPUT_HIGH_WATER
+        ):
+            piece_index, begin, length = peer.requests.popleft()
+            if peer.am_choking and piece_index not in peer.allowed_fast:
+                # Choked since the request was queued
+                if peer.fast:
+                    peer.send(extensions.build_reject(piece_index, begin, length))
                 continue
-            except Exception as e:
-                logger.error(f"Error handling request from {addr}: {e}")
-                break
-
-    def _recvall(self, sock: socket.socket, n: int) -> bytes | None:
-        """Receive exactly n bytes"""
-        data = bytearray()
-        while len(data) < n:
+
+            self._send_block(peer, piece_index, begin, length)
+            with self._lock:
+                self._hot_pieces.append(piece_index)
+            peer.upload_meter.update(length)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"Sent block to {peer.addr}: piece={piece_index}, begin={begin}, length={length}"
+                )
+            delay = peer.limits.reserve_upload(length) if peer.limits else 0.0
+            if delay > 0:
+                peer.send_at = time.monotonic() + delay
+
+    def _send_block(self, peer: UploadPeer, piece_index: int, begin: int, length: int):
+        """Queue a piece message, zero-copy when the block lies in one file.
+
+        A piece one peer downloads is sent with sendfile, straight from the
+        page cache: reading it into the PieceCache would only copy it. Once
+        a second peer asks for it, it is read into the cache and everyone
+        is served from memory. Blocks spanning files always go through the
+        cache.
+        """
+        header = struct.pack(">IBII", 9 + length, 7, piece_index, begin)
+        cache = self.listener.piece_cache
+        block = cache.lookup(self.storage_manager, piece_index, begin, length)
+        if block is None and USE_SENDFILE and not self._shared(peer, piece_index):
+            location = self.storage_manager.block_location(piece_index, begin, length)
+            file = self._open_file(location[0]) if location else None
+            if file is not None:
+                peer.send_file(header, file, location[1], length)
+                return
+        if block is None:
+            block = cache.read_block(self.storage_manager, piece_index, begin, length)
+        peer.send(header + block)
+
+    def _shared(self, peer: UploadPeer, piece_index: int) -> bool:
+        """Whether another peer asked for this piece before ``peer`` did"""
+        with self._lock:
+            last = self._last_requester.pop(piece_index, None)
+            self._last_requester[piece_index] = peer.addr
+            if len(self._last_requester) > SHARED_PIECES_TRACKED:
+                self._last_requester.popitem(last=False)
+        return last is not None and last != peer.addr
+
+    def _open_file(self, path: str):
+        with self._lock:
+            file = self._files.get(path)
+            if file is not None:
+                self._files.move_to_end(path)
+                return file
             try:
-                chunk = sock.recv(n - len(data))
-                if not chunk:
-                    return None
-                data.extend(chunk)
-            except socket.timeout:
-                continue
-            except Exception:
+                file = open(path, "rb", buffering=0)
+            except OSError as e:
+                logger.error(f"Failed to open '{path}' for upload: {e}")
                 return None
-        return bytes(data)
+            self._files[path] = file
+            while len(self._files) > MAX_OPEN_FILES:
+                self._files.popitem(last=False)
+            return file
 
     def stop(self):
-        """Stop the seeder server"""
-        self.running = False
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except Exception:
-                pass
+        """Stop seeding this torrent"""
+        self.listener.unregister(self)
+        if self._owns_choker:
+            self.choker.stop()
+        if self._owns_listener:
+            self.listener.stop()
+        with self._lock:
+            files = list(self._files.values())
+            self._files.clear()
+        # Unregistered, the torrent's connections are closed by the loop and
+        # a segment still queued goes with its connection
+        for file in files:
+            file.close()
         logger.info("Seeder server stopped")
@@ -0,0 +1,113 @@
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+
+class SuperSeeder:
+    """Piece revealing for BEP 16 super-seeding.
+
+    Instead of advertising every piece, an initial seeder offers each
+    leecher one piece at a time via ``have``. A leecher gets its next piece
+    only once the one it was offered shows up at another peer, i.e. once
+    it has passed it on. Pieces that few peers have and that we have
+    offered least are revealed first.
+    """
+
+    def __init__(self, num_pieces: int):
+        self.num_pieces = num_pieces
+        # How many connected peers are known to have each piece
+        self.seen = [0] * num_pieces
+        # How many peers each piece is currently offered to
+        self.offer_counts = [0] * num_pieces
+        self.peer_pieces: dict[object, set[int]] = {}
+        self.offered: dict[object, set[int]] = {}
+
+    def peer_joined(self, peer) -> int | None:
+        """Register a leecher and return the first piece to offer it"""
+        self.peer_pieces.setdefault(peer, set())
+        self.offered.setdefault(peer, set())
+        return self._next_piece(peer)
+
+    def peer_left(self, peer):
+        for piece_index in self.peer_pieces.pop(peer, ()):
+            self.seen[piece_index] -= 1
+        for piece_index in self.offered.pop(peer, ()):
+            self.offer_counts[piece_index] -= 1
+
+    def may_serve(self, peer, piece_index: int) -> bool:
+        """Peers we super-seed are only uploaded the pieces offered to them"""
+        offered = self.offered.get(peer)
+        return offered is None or piece_index in offered
+
+    def peer_bitfield(self, peer, pieces) -> list[tuple[object, int]]:
+        """Record what a peer already had when it connected.
+
+        Unlike ``have`` this says nothing about pieces spreading; it only
+        replaces an offer the peer turns out not to need.
+        """
+        for piece_index in pieces:
+            self._record(peer, piece_index)
+        offered = self.offered.get(peer)
+        if not offered:
+            return []
+        stale = offered & self.peer_pieces[peer]
+        for piece_index in stale:
+            self._retire(peer, piece_index)
+        if not stale or offered:
+            return []
+        piece_index = self._next_piece(peer)
+        return [] if piece_index is None else [(peer, piece_index)]
+
+    def peer_has(self, peer, piece_index: int) -> list[tuple[object, int]]:
+        """Record a have from ``peer``; return the (peer, piece) offers it unlocks"""
+        if not self._record(peer, piece_index):
+            return []
+
+        offers = []
+        # The piece reached another peer, so whoever we gave it to shared it
+        for other, offered in self.offered.items():
+            if other is not peer and piece_index in offered:
+                self._retire(other, piece_index)
+                offers.append((other, self._next_piece(other)))
+
+        # The peer finished its own offer, which stays open until it spreads
+        if piece_index in self.offered[peer] and not self._other_leechers(peer):
+            # Nobody else to pass it on to; don't stall a lone leecher
+            self._retire(peer, piece_index)
+            offers.append((peer, self._next_piece(peer)))
+        return [(p, piece) for p, piece in offers if piece is not None]
+
+    def _record(self, peer, piece_index: int) -> bool:
+        pieces = self.peer_pieces.get(peer)
+        if pieces is None or piece_index in pieces:
+            return False
+        pieces.add(piece_index)
+        self.seen[piece_index] += 1
+        return True
+
+    def _retire(self, peer, piece_index: int):
+        self.offered[peer].discard(piece_index)
+        self.offer_counts[piece_index] -= 1
+
+    def _other_leechers(self, peer) -> bool:
+        return any(
+            other is not peer and len(pieces) < self.num_pieces
+            for other, pieces in self.peer_pieces.items()
+        )
+
+    def _next_piece(self, peer) -> int | None:
+        have = self.peer_pieces[peer]
+        offered = self.offered[peer]
+        candidates = [
+            i for i in range(self.num_pieces) if i not in have and i not in offered
+        ]
+        if not candidates:
+            return None
+        rarest = min((self.seen[i], self.offer_counts[i]) for i in candidates)
+        piece_index = random.choice(
+            [i for i in candidates if (self.seen[i], self.offer_counts[i]) == rarest]
+        )
+        offered.add(piece_index)
+        self.offer_counts[piece_index] += 1
+        return piece_index
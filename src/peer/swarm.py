@@ -0,0 +1,134 @@
+import threading
+
+# Peers remembered per torrent; trackers, the DHT and PEX can hand out many more
+MAX_KNOWN_PEERS = 2000
+# Past the cap, peers are forgotten down to this share of it at once, so the
+# ranking isn't redone for every peer added
+TRIM_TO = 0.9
+
+
+class Swarm:
+    """Peer addresses known for one torrent, shared by all its connections.
+
+    Iterating a swarm also yields peers added while the iteration is in
+    progress, so peers learned through PEX or the DHT are dialed in the
+    same pass. Past ``max_peers`` the lowest-ranked by ``score`` (banned
+    first, then the oldest of equal score) are forgotten, down to
+    ``TRIM_TO`` of the cap; connected peers are kept.
+    """
+
+    def __init__(self, peers=None, max_peers: int = MAX_KNOWN_PEERS, score=None):
+        self.max_peers = max_peers
+        self.score = score
+        self._known = []
+        self._known_set = set()
+        self._connected = set()
+        self._lock = threading.Lock()
+        if peers:
+            self.extend(peers)
+
+    def add(self, peer: tuple) -> bool:
+        added = self._add(peer)
+        self._trim()
+        return added
+
+    def extend(self, peers) -> int:
+        added = sum(1 for peer in peers if self._add(peer))
+        self._trim()
+        return added
+
+    def _add(self, peer: tuple) -> bool:
+        peer = (peer[0], int(peer[1]))
+        with self._lock:
+            if peer in self._known_set:
+                return False
+            self._known.append(peer)
+            self._known_set.add(peer)
+            return True
+
+    def _trim(self):
+        with self._lock:
+            if len(self._known) <= self.max_peers:
+                return
+            candidates = [p for p in self._known if p not in self._connected]
+        if self.score is not None:
+            scores = {peer: self.score(peer) for peer in candidates}
+            # Stable sort: equally scored peers go in discovery order
+            candidates.sort(
+                key=lambda p: float("-inf") if scores[p] is None else scores[p]
+            )
+        with self._lock:
+            excess = len(self._known) - int(self.max_peers * TRIM_TO)
+            dropped = set()
+            for peer in candidates:
+                if len(dropped) >= excess:
+                    break
+                if peer in self._known_set and peer not in self._connected:
+                    dropped.add(peer)
+            if dropped:
+                self._known = [p for p in self._known if p not in dropped]
+                self._known_set -= dropped
+
+    def mark_connected(self, peer: tuple):
+        with self._lock:
+            self._connected.add(peer)
+
+    def mark_disconnected(self, peer: tuple):
+        with self._lock:
+            self._connected.discard(peer)
+
+    def connected_peers(self) -> set:
+        with self._lock:
+            return set(self._connected)
+
+    def __contains__(self, peer) -> bool:
+        with self._lock:
+            return peer in self._known_set
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._known)
+
+    def ranked(self, score):
+        """Like iteration, but always yield the best-scored peer not yet yielded.
+
+        ``score(peer)`` returning None skips the peer (e.g. banned). Peers
+        added during the iteration compete with the remaining ones.
+        """
+        yielded = set()
+        while True:
+            with self._lock:
+                remaining = [peer for peer in self._known if peer not in yielded]
+                known = len(self._known)
+            if not remaining:
+                return
+            scored = []
+            for peer in remaining:
+                peer_score = score(peer)
+                if peer_score is None:
+                    yielded.add(peer)
+                else:
+                    scored.append((peer_score, peer))
+            if not scored:
+                return
+            # Stable sort: equally scored peers keep their discovery order
+            scored.sort(key=lambda item: item[0], reverse=True)
+            for _, peer in scored:
+                yielded.add(peer)
+                yield peer
+                with self._lock:
+                    if len(self._known) != known:
+                        # New peers arrived: rank again
+                        break
+
+    def __iter__(self):
+        yielded = set()
+        while True:
+            # A copy, as forgetting peers would shift the indices under us
+            with self._lock:
+                remaining = [peer for peer in self._known if peer not in yielded]
+            if not remaining:
+                return
+            for peer in remaining:
+                yielded.add(peer)
+                yield peer
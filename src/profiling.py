@@ -0,0 +1,118 @@
+import bisect
+import threading
+import time
+
+# Upper bounds of the histogram buckets: 1 µs, 2 µs, 4 µs ... ~1 s, then +Inf
+BUCKETS = tuple(2**i / 1_000_000 for i in range(21))
+
+# Stages the transfer code reports
+RECV = "recv"
+HASH = "hash"
+DISK_READ = "disk_read"
+DISK_WRITE = "disk_write"
+SEND = "send"
+
+# Hot paths bracket a stage with start() and record(). While profiling is
+# off, start() reads this one flag and returns None and record() returns
+# at once, so the hooks cost next to nothing; it can be switched at
+# runtime (--profile, the RPC "profile" method).
+_enabled = False
+_lock = threading.Lock()
+_stages: dict[str, "Histogram"] = {}
+
+
+class Histogram:
+    """Latencies of one stage in power-of-two buckets from 1 µs up"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+            # Per-bucket counts; the last bucket has no upper bound
+            "buckets": list(self.counts),
+        }
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+
+def start() -> float | None:
+    """A start time to pass to ``record``, None while profiling is off"""
+    return time.perf_counter() if _enabled else None
+
+
+def record(stage: str, started: float | None):
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = Histogram()
+        histogram.add(elapsed)
+
+
+def snapshot() -> dict:
+    """Histograms of every stage seen so far"""
+    with _lock:
+        return {stage: histogram.snapshot() for stage, histogram in _stages.items()}
+
+
+def _format_bound(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.0f}µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.0f}ms"
+    return f"{seconds:.0f}s"
+
+
+def dump() -> str:
+    """The histograms as a human-readable table, e.g. for the log"""
+    lines = []
+    for stage, stats in sorted(snapshot().items()):
+        mean = stats["total"] / stats["count"] if stats["count"] else 0.0
+        lines.append(
+            f"{stage}: {stats['count']} samples, mean {_format_bound(mean)}, "
+            f"max {_format_bound(stats['max'])}"
+        )
+        for index, count in enumerate(stats["buckets"]):
+            if not count:
+                continue
+            bound = (
+                f"<= {_format_bound(BUCKETS[index])}"
+                if index < len(BUCKETS)
+                else f"> {_format_bound(BUCKETS[-1])}"
+            )
+            bar = "#" * max(1, round(40 * count / stats["count"]))
+            lines.append(f"  {bound:>9} {count:>8} {bar}")
+    return "\n".join(lines) if lines else "No profiling samples"
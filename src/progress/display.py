@@ -0,0 +1,151 @@
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+
+from src.progress.indicator import ProgressIndicator
+
+# Redraws per second on a terminal: 4
+REFRESH_INTERVAL = 0.25
+# Without a terminal, one line per torrent this often
+LOG_INTERVAL = 30.0
+NAME_WIDTH = 24
+BAR_LENGTH = 20
+
+
+def format_rate(rate: float) -> str:
+    for unit, scale in (("MiB/s", 1 << 20), ("KiB/s", 1 << 10)):
+        if rate >= scale:
+            return f"{rate / scale:.1f} {unit}"
+    return f"{rate:.0f} B/s"
+
+
+def format_eta(seconds: float | None) -> str:
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def eta(stats: dict) -> float | None:
+    """Seconds left at the current download rate, None if unknown or stalled"""
+    left = stats.get("bytes_left")
+    rate = stats.get("download_rate", 0)
+    if not left:
+        return 0.0 if left == 0 else None
+    return left / rate if rate > 0 else None
+
+
+def ratio(stats: dict) -> float:
+    """Uploaded per byte downloaded this session.
+
+    A torrent that downloaded nothing, say one seeding data already on
+    disk, is measured against what it holds instead.
+    """
+    downloaded = stats.get("downloaded", 0)
+    if not downloaded:
+        downloaded = stats.get("size", 0) - (stats.get("bytes_left") or 0)
+    return stats.get("uploaded", 0) / downloaded if downloaded > 0 else 0.0
+
+
+def format_torrent(stats: dict) -> str:
+    """One status line for a torrent, from its ``TorrentEntry.stats()``"""
+    name = stats.get("name") or os.path.basename(stats["source"]).removesuffix(
+        ".torrent"
+    )
+    if len(name) > NAME_WIDTH:
+        name = name[: NAME_WIDTH - 1] + "…"
+    state = "paused" if stats.get("paused") else stats.get("state", stats["status"])
+    if stats.get("checking"):
+        state += ", checking"
+    if "total_pieces" not in stats or not stats["total_pieces"]:
+        return f"{name:<{NAME_WIDTH}}  {state}"
+    bar = ProgressIndicator(stats["total_pieces"], BAR_LENGTH).format(stats["pieces"])
+    return (
+        f"{name:<{NAME_WIDTH}}  {bar:<{BAR_LENGTH + 10}}  "
+        f"↓ {format_rate(stats['download_rate']):>11}  "
+        f"↑ {format_rate(stats['upload_rate']):>11}  "
+        f"ETA {format_eta(eta(stats)):>6}  "
+        f"peers {stats['peers']:>3}  ratio {ratio(stats):.2f}  {state}"
+    )
+
+
+class ProgressDisplay:
+    """Shows every torrent of a session from a timer of its own.
+
+    The figures are read from the session's counters rather than pushed
+    by the threads moving data. On a terminal the lines are redrawn in
+    place several times a second; on any other stream
+    they are written out every ``log_interval`` seconds instead. Other
+    output goes through ``message``, so it doesn't tear the lines apart.
+    """
+
+    def __init__(
+        self,
+        session,
+        stream=None,
+        interval: float = REFRESH_INTERVAL,
+        log_interval: float = LOG_INTERVAL,
+    ):
+        self.session = session
+        self.stream = stream if stream is not None else sys.stdout
+        try:
+            self.tty = self.stream.isatty()
+        except (AttributeError, ValueError):
+            self.tty = False
+        self.interval = interval if self.tty else log_interval
+        # Lines drawn last time, to move back over on a terminal
+        self._drawn = 0
+        # Shown above the torrents at the next refresh
+        self._messages = deque()
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Refresh until stopped, then show the final figures; blocks"""
+        while not self._stopped.wait(self.interval):
+            self.render()
+        self.render()
+
+    def stop(self):
+        self._stopped.set()
+
+    def message(self, text: str):
+        """Print a line above the torrents; safe from any thread"""
+        self._messages.append(text)
+
+    def lines(self) -> list[str]:
+        return [format_torrent(entry.stats()) for entry in list(self.session.torrents)]
+
+    def render(self):
+        lines = self.lines()
+        messages = []
+        while self._messages:
+            messages.append(self._messages.popleft())
+        if self.tty:
+            self._redraw(messages, lines)
+        elif messages or lines:
+            stamp = time.strftime("%H:%M:%S")
+            self.stream.write(
+                "".join(f"{stamp} {line}\n" for line in messages + lines)
+            )
+        self.stream.flush()
+
+    def _redraw(self, messages: list[str], lines: list[str]):
+        # Wrapped lines would throw the count of lines to go back over off
+        width = shutil.get_terminal_size().columns - 1
+        out = []
+        if self._drawn:
+            # To the start of the first line drawn, then clear downwards
+            out.append(f"\x1b[{self._drawn}F")
+        out.append("\x1b[J")
+        # Messages stay where they are written; only the torrents are redrawn
+        out.extend(line + "\n" for line in messages)
+        out.extend(line[:width] + "\n" for line in lines)
+        self.stream.write("".join(out))
+        self._drawn = len(lines)
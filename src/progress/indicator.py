@@ -6,17 +6,19 @@ class ProgressIndicator:
         self.total_pieces = total_pieces
         self.bar_length = bar_length
 
-    def update(self, completed_pieces: int):
-        if self.total_pieces == 0:
-            return
-
-        progress = completed_pieces / self.total_pieces
+    def format(self, completed_pieces: int) -> str:
+        """The bar and percentage, e.g. '[#####-----] 50.00%'"""
+        progress = completed_pieces / self.total_pieces if self.total_pieces else 0.0
         block = int(round(self.bar_length * progress))
 
         bar = "#" * block + "-" * (self.bar_length - block)
-        text = f"\rProgress: [{bar}] {progress * 100:.2f}%"
+        return f"[{bar}] {progress * 100:.2f}%"
+
+    def update(self, completed_pieces: int):
+        if self.total_pieces == 0:
+            return
 
-        sys.stdout.write(text)
+        sys.stdout.write(f"\rProgress: {self.format(completed_pieces)}")
         sys.stdout.flush()
 
     def close(self):
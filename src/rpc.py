@@ -0,0 +1,295 @@
+import errno
+import json
+import logging
+import os
+import socket
+import stat
+import threading
+
+from src import metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+UNKNOWN_TORRENT = -32000
+
+MAX_LINE = 1 << 20
+
+
+class RPCError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class RPCServer:
+    """JSON-RPC 2.0 control endpoint for a Session on a Unix socket.
+
+    Requests and responses are JSON objects, one per line. Every method
+    acts on the running session, so torrents keep transferring while they
+    are added, paused or re-limited. Rates are in bytes/s throughout.
+    The socket is only accessible to its owner.
+    """
+
+    def __init__(self, session, path: str, listener=None):
+        self.session = session
+        self.path = path
+        # For the process-wide figures of the metrics method
+        self.listener = listener
+        self.server_socket = None
+        # Whether the socket at path is ours to remove
+        self._bound = False
+        self.running = False
+        self.listening = threading.Event()
+        self._methods = {
+            "add": self._add,
+            "remove": self._remove,
+            "pause": self._pause,
+            "resume": self._resume,
+            "set_priority": self._set_priority,
+            "set_limits": self._set_limits,
+            "list": self._list,
+            "stats": self._stats,
+            "peers": self._peers,
+            "metrics": self._metrics,
+            "profile": self._profile,
+            "shutdown": self._shutdown,
+        }
+
+    def start(self):
+        """Accept clients until stopped (blocks; call from its own thread)"""
+        self.running = True
+        try:
+            self._remove_stale_socket()
+            self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._bind_private()
+            self.server_socket.listen(8)
+        except OSError as e:
+            logger.error(f"Failed to open RPC socket {self.path}: {e}")
+            self.stop()
+            return
+        self.server_socket.settimeout(0.5)
+        logger.info(f"RPC listening on {self.path}")
+        self.listening.set()
+
+        while self.running:
+            try:
+                client, _ = self.server_socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _remove_stale_socket(self):
+        """Unlink a socket a previous run left behind, and nothing else"""
+        try:
+            mode = os.lstat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise OSError(errno.EEXIST, f"{self.path} exists and is not a socket")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.path)
+            except ConnectionRefusedError:
+                # Nobody listens on it any more
+                os.unlink(self.path)
+                return
+        raise OSError(errno.EADDRINUSE, f"{self.path} is served by another process")
+
+    def _bind_private(self):
+        """Bind at path with the socket never accessible to anyone else.
+
+        The socket is bound inside a directory only we can enter, made
+        owner-only there and then moved into place; changing the umask
+        instead would affect files other threads create meanwhile.
+        """
+        # Only needed for the RPC socket, so kept off the startup path
+        import tempfile
+
+        directory = tempfile.mkdtemp(
+            prefix=".rpc-", dir=os.path.dirname(os.path.abspath(self.path))
+        )
+        staging = os.path.join(directory, "sock")
+        try:
+            self.server_socket.bind(staging)
+            os.chmod(staging, 0o600)
+            os.rename(staging, self.path)
+            self._bound = True
+        finally:
+            if not self._bound and os.path.exists(staging):
+                os.unlink(staging)
+            os.rmdir(directory)
+
+    def stop(self):
+        self.running = False
+        if self.server_socket is not None:
+            try:
+                self.server_socket.close()
+            except OSError:
+                pass
+            self.server_socket = None
+        if self._bound:
+            self._bound = False
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _serve(self, client: socket.socket):
+        with client, client.makefile("rb") as reader:
+            for line in reader:
+                if not line.strip():
+                    continue
+                if len(line) > MAX_LINE:
+                    break
+                response = self.handle_line(line)
+                if response is None:
+                    continue
+                try:
+                    client.sendall(json.dumps(response).encode() + b"\n")
+                except OSError:
+                    break
+
+    def handle_line(self, line: bytes) -> dict | None:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return self._error(None, PARSE_ERROR, "Parse error")
+        return self.handle(request)
+
+    def handle(self, request) -> dict | None:
+        """Run one request; None for notifications (requests without an id)"""
+        if not isinstance(request, dict):
+            return self._error(None, INVALID_REQUEST, "Invalid request")
+        request_id = request.get("id")
+        method = request.get("method")
+        params = request.get("params", {})
+        if not isinstance(method, str) or not isinstance(params, dict):
+            return self._error(request_id, INVALID_REQUEST, "Invalid request")
+        handler = self._methods.get(method)
+        if handler is None:
+            return self._error(
+                request_id, METHOD_NOT_FOUND, f"Unknown method {method}"
+            )
+        # Only needed once a request comes in, so kept off the startup path
+        import inspect
+
+        try:
+            # A TypeError from inside the handler is a bug, not bad params
+            inspect.signature(handler).bind(**params)
+        except TypeError as e:
+            return self._error(request_id, INVALID_PARAMS, str(e))
+        try:
+            result = handler(**params)
+        except RPCError as e:
+            return self._error(request_id, e.code, e.message)
+        except Exception as e:
+            logger.error(f"RPC {method} failed: {e}")
+            return self._error(request_id, INTERNAL_ERROR, str(e))
+        if "id" not in request:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    @staticmethod
+    def _error(request_id, code: int, message: str) -> dict:
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "error": {"code": code, "message": message},
+        }
+
+    def _entry(self, torrent_id):
+        entry = self.session.get(torrent_id)
+        if entry is None:
+            raise RPCError(UNKNOWN_TORRENT, f"No torrent with id {torrent_id}")
+        return entry
+
+    def _add(self, source: str, destination: str | None = None, priority: int = 0):
+        if not os.path.isfile(source):
+            raise RPCError(INVALID_PARAMS, f"No such torrent file: {source}")
+        entry = self.session.add(source, destination, priority)
+        logger.info(f"RPC added {source} as torrent {entry.id}")
+        return entry.stats()
+
+    def _remove(self, id: int):
+        self.session.remove(self._entry(id))
+        return True
+
+    def _pause(self, id: int | None = None):
+        if id is None:
+            self.session.control.pause()
+        else:
+            self.session.pause(self._entry(id))
+        return True
+
+    def _resume(self, id: int | None = None):
+        if id is None:
+            self.session.control.resume()
+        else:
+            self.session.resume(self._entry(id))
+        return True
+
+    def _set_priority(self, id: int, priority: int):
+        self.session.set_priority(self._entry(id), priority)
+        return True
+
+    def _set_limits(
+        self,
+        id: int | None = None,
+        upload: float | None = None,
+        download: float | None = None,
+        peer_upload: float | None = None,
+        peer_download: float | None = None,
+    ):
+        """Without an id the process-wide limits change; peer_* apply per peer"""
+        limits = self.session.limits if id is None else self._entry(id).limits
+        limits.set_limits(upload=upload, download=download)
+        limits.set_peer_limits(upload=peer_upload, download=peer_download)
+        return {
+            "upload": limits.upload.rate,
+            "download": limits.download.rate,
+            "peer_upload": limits.peer_upload,
+            "peer_download": limits.peer_download,
+        }
+
+    def _list(self):
+        return [entry.stats() for entry in list(self.session.torrents)]
+
+    def _stats(self, id: int | None = None):
+        if id is None:
+            return self.session.stats()
+        return self._entry(id).stats()
+
+    def _peers(self, id: int):
+        entry = self._entry(id)
+        return entry.loader.peer_stats() if entry.loader is not None else []
+
+    def _metrics(self):
+        return metrics.snapshot(self.session, self.listener)
+
+    def _profile(self, enable: bool | None = None, reset: bool = False):
+        """Switch stage timing on or off and return its histograms"""
+        if reset:
+            profiling.reset()
+        if enable is True:
+            profiling.enable()
+        elif enable is False:
+            profiling.disable()
+        return {
+            "enabled": profiling.is_enabled(),
+            "buckets": list(profiling.BUCKETS),
+            "stages": profiling.snapshot(),
+        }
+
+    def _shutdown(self):
+        logger.info("Shutdown requested over RPC")
+        self.session.control.stop()
+        return True
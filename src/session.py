@@ -0,0 +1,333 @@
+import itertools
+import logging
+import threading
+import time
+
+from src import state
+from src.peer.dialer import MAX_HALF_OPEN, Connector
+from src.peer.handshake import HandShakeTCP
+from src.peer.ratelimit import RateLimits
+from src.storage.file_manager import CHECK_FULL
+from src.torrent.parser import TorrentFileParser
+
+logger = logging.getLogger(__name__)
+
+MAX_ACTIVE_DOWNLOADS = 4
+MAX_ACTIVE_SEEDS = 8
+MAX_PEERS = 200
+# Every downloading torrent gets at least this many connection slots
+MIN_PEERS_PER_TORRENT = 2
+SCHEDULE_INTERVAL = 1.0
+# Each priority level doubles a torrent's share of connection slots
+PRIORITY_WEIGHT = 2
+# Priorities outside this range are clamped to it
+MIN_PRIORITY = -5
+MAX_PRIORITY = 5
+
+
+def clamp_priority(priority: int) -> int:
+    return min(max(int(priority), MIN_PRIORITY), MAX_PRIORITY)
+
+
+class TorrentEntry:
+    """A torrent added to a session and where it is in the queue"""
+
+    def __init__(
+        self,
+        torrent_id: int,
+        source: str,
+        destination: str | None,
+        control: state.Control,
+        limits: RateLimits,
+        info_hash: bytes | None = None,
+    ):
+        self.id = torrent_id
+        self.source = source
+        self.destination = destination
+        # Pause, stop and priority set for this torrent by the user
+        self.control = control
+        # Kept across restarts, so limits set at runtime stick
+        self.limits = limits
+        # Known up front for watched torrents, otherwise once the loader parses
+        self._info_hash = info_hash
+        # queued -> active -> (seed_queued <-> active) -> finished
+        self.status = "queued"
+        self.loader = None
+        self.thread = None
+        self.seed_time = 0.0
+        self._seeding_since = None
+
+    @property
+    def info_hash(self) -> bytes | None:
+        if self._info_hash is None and self.loader is not None:
+            self._info_hash = self.loader.info_hash
+        return self._info_hash
+
+    @property
+    def downloading(self) -> bool:
+        """Holds a download slot; a paused torrent gives its slot up"""
+        return (
+            self.status == "active"
+            and self.loader.status != "seeding"
+            and not self.control.is_paused()
+        )
+
+    @property
+    def seeding(self) -> bool:
+        return self.status == "active" and self.loader.status == "seeding"
+
+    def stats(self) -> dict:
+        stats = {
+            "id": self.id,
+            "source": self.source,
+            "status": self.status,
+            "paused": self.control.is_paused(),
+            "priority": self.control.priority,
+            "seed_time": self.seed_time,
+            "upload_limit": self.limits.upload.rate,
+            "download_limit": self.limits.download.rate,
+        }
+        if self.loader is not None:
+            stats.update(self.loader.stats(), status=self.status)
+            stats["state"] = self.loader.status
+        return stats
+
+
+class Session:
+    """Every torrent of the process and the limits they share.
+
+    Torrents beyond ``max_active_downloads`` wait in a queue, and complete
+    torrents beyond ``max_active_seeds`` wait for a seed slot; those that
+    have seeded least get one first. Outgoing connection slots, at most
+    ``max_peers`` together with incoming connections, are split among the
+    downloading torrents by how much each has left. One Connector enforces
+    the half-open limit for all of them.
+    """
+
+    def __init__(
+        self,
+        seed: bool = True,
+        dht=None,
+        listener=None,
+        super_seed: bool = False,
+        limits: RateLimits | None = None,
+        torrent_upload: float = 0,
+        torrent_download: float = 0,
+        max_active_downloads: int = MAX_ACTIVE_DOWNLOADS,
+        max_active_seeds: int = MAX_ACTIVE_SEEDS,
+        max_peers: int = MAX_PEERS,
+        max_half_open: int = MAX_HALF_OPEN,
+        check: str = CHECK_FULL,
+    ):
+        self.seed = seed
+        self.dht = dht
+        self.listener = listener
+        self.super_seed = super_seed
+        self.limits = limits or RateLimits()
+        self.torrent_upload = torrent_upload
+        self.torrent_download = torrent_download
+        self.max_active_downloads = max_active_downloads
+        self.max_active_seeds = max_active_seeds
+        self.max_peers = max_peers
+        self.connector = Connector(max_half_open)
+        # How each torrent checks the data it already has on disk
+        self.check = check
+        self.control = state.Control(state.root())
+        # Keep running with no torrents left, waiting for new ones (daemon)
+        self.persistent = False
+        self.torrents: list[TorrentEntry] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        source: str,
+        destination: str | None = None,
+        priority: int = 0,
+        info_hash: bytes | None = None,
+    ) -> TorrentEntry:
+        """Queue a torrent; it starts when the scheduler has a slot for it"""
+        if info_hash is None:
+            # Cheap next to the download, and lets find() see queued torrents
+            try:
+                info_hash = TorrentFileParser(source, destination).parse()[1]
+            except Exception:
+                # The loader reports the broken file when it starts
+                pass
+        entry = TorrentEntry(
+            next(self._ids),
+            source,
+            destination,
+            state.Control(self.control, clamp_priority(priority)),
+            self.limits.child(self.torrent_upload, self.torrent_download),
+            info_hash,
+        )
+        with self._lock:
+            self.torrents.append(entry)
+        return entry
+
+    def get(self, torrent_id: int) -> TorrentEntry | None:
+        with self._lock:
+            return next((e for e in self.torrents if e.id == torrent_id), None)
+
+    def find(self, info_hash: bytes) -> TorrentEntry | None:
+        return next((e for e in self._entries() if e.info_hash == info_hash), None)
+
+    def remove(self, entry: TorrentEntry):
+        """Stop a torrent and drop it from the session"""
+        entry.control.stop()
+        with self._lock:
+            if entry in self.torrents:
+                self.torrents.remove(entry)
+
+    def pause(self, entry: TorrentEntry):
+        entry.control.pause()
+
+    def resume(self, entry: TorrentEntry):
+        entry.control.resume()
+
+    def set_priority(self, entry: TorrentEntry, priority: int):
+        """Higher priorities leave the queue first and get more connections"""
+        entry.control.priority = clamp_priority(priority)
+
+    def run(self):
+        """Schedule torrents until all have finished or the user stops (blocking)"""
+        threading.Thread(target=self.connector.start, daemon=True).start()
+        try:
+            while not self.control.is_stopped():
+                if not self.schedule() and not self.persistent:
+                    break
+                self.control.wait_stopped(SCHEDULE_INTERVAL)
+        finally:
+            self.control.stop()
+            for entry in self._entries():
+                if entry.thread is not None:
+                    entry.thread.join()
+            self.connector.stop()
+
+    def schedule(self) -> bool:
+        """One scheduling pass; False once no torrent is left to run"""
+        entries = self._entries()
+        for entry in entries:
+            self._update(entry)
+
+        downloading = [e for e in entries if e.downloading]
+        queued = [e for e in entries if e.status == "queued"]
+        for entry in sorted(queued, key=lambda e: e.control.priority, reverse=True):
+            if len(downloading) >= self.max_active_downloads:
+                break
+            self._start(entry)
+            downloading.append(entry)
+
+        seeding = [e for e in entries if e.seeding]
+        # Finished downloads may push us over the seed limit
+        for entry in sorted(seeding, key=lambda e: e.seed_time, reverse=True):
+            if len(seeding) <= self.max_active_seeds:
+                break
+            logger.info(f"Seed limit reached, queueing {entry.source}")
+            entry.status = "seed_queued"
+            entry.loader.stop()
+            seeding.remove(entry)
+        waiting = sorted(
+            (e for e in entries if e.status == "seed_queued" and not e.thread.is_alive()),
+            key=lambda e: e.seed_time,
+        )
+        for entry in waiting:
+            if len(seeding) >= self.max_active_seeds:
+                break
+            self._start(entry)
+            seeding.append(entry)
+
+        self._allocate_peers(downloading)
+        return any(e.status != "finished" for e in entries)
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        torrents = [e.stats() for e in entries]
+        return {
+            "torrents": len(entries),
+            "downloading": sum(1 for e in entries if e.downloading),
+            "seeding": sum(1 for e in entries if e.seeding),
+            "queued": sum(1 for e in entries if e.status in ("queued", "seed_queued")),
+            "download_rate": sum(t.get("download_rate", 0) for t in torrents),
+            "upload_rate": sum(t.get("upload_rate", 0) for t in torrents),
+            "peers": sum(t.get("peers", 0) for t in torrents),
+            "half_open": self.connector.half_open,
+            "upload_limit": self.limits.upload.rate,
+            "download_limit": self.limits.download.rate,
+        }
+
+    def _entries(self) -> list[TorrentEntry]:
+        with self._lock:
+            return list(self.torrents)
+
+    def _start(self, entry: TorrentEntry):
+        logger.info(f"Starting {entry.source}")
+        entry.loader = HandShakeTCP(
+            entry.source,
+            entry.destination,
+            seed=self.seed,
+            dht=self.dht,
+            listener=self.listener,
+            super_seed=self.super_seed,
+            limits=entry.limits,
+            connector=self.connector,
+            # Seed queueing stops this run only, not the torrent
+            control=state.Control(entry.control),
+            check=self.check,
+        )
+        entry.thread = threading.Thread(target=entry.loader.handshake, daemon=True)
+        entry.status = "active"
+        entry.thread.start()
+
+    def _update(self, entry: TorrentEntry):
+        """Track seeding time and notice torrents whose thread has ended"""
+        if entry.status != "active":
+            return
+        now = time.monotonic()
+        if entry._seeding_since is not None:
+            entry.seed_time += now - entry._seeding_since
+            entry._seeding_since = None
+        if entry.loader.status == "seeding":
+            entry._seeding_since = now
+        if not entry.thread.is_alive():
+            entry.status = "finished"
+
+    def _allocate_peers(self, downloading: list[TorrentEntry]):
+        """Split the connection budget by bytes left and priority, capped by swarm size.
+
+        Slots a torrent can't use because it knows too few peers go to
+        the others.
+        """
+        if not downloading:
+            return
+        incoming = len(self.listener.connections) if self.listener is not None else 0
+        budget = max(
+            self.max_peers - incoming, MIN_PEERS_PER_TORRENT * len(downloading)
+        )
+        need = {
+            e: max(e.loader.bytes_left() or 0, 1) * PRIORITY_WEIGHT ** e.control.priority
+            for e in downloading
+        }
+        shares = {}
+        remaining = list(downloading)
+        while remaining:
+            total_need = sum(need[e] for e in remaining) or 1
+            capped = []
+            for entry in remaining:
+                # Negative priorities make the need a float; slots are counted
+                share = max(
+                    MIN_PEERS_PER_TORRENT, 1, int(budget * need[entry] // total_need)
+                )
+                cap = max(MIN_PEERS_PER_TORRENT, len(entry.loader.swarm))
+                shares[entry] = min(share, cap)
+                if share > cap:
+                    capped.append(entry)
+            if not capped:
+                break
+            for entry in capped:
+                remaining.remove(entry)
+                budget -= shares[entry]
+            budget = max(budget, MIN_PEERS_PER_TORRENT * len(remaining))
+        for entry, share in shares.items():
+            entry.loader.max_peers = share
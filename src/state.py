@@ -1,41 +1,154 @@
+import logging
 import threading
+import weakref
 
-_pause_event = threading.Event()
-_pause_event.set()
-_stop_flag = False
-_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+class Control:
+    """Pause/stop switch for a session, a torrent or anything below them.
+
+    Controls form a tree: pausing or stopping one affects its children
+    too, while a child can be paused, stopped or re-prioritised on its own.
+    ``is_stopped`` reads a plain flag, so hot loops can poll it without
+    taking a lock. Callbacks registered with ``on_stop`` run when the
+    control (or an ancestor) stops, e.g. to shut down a socket a thread is
+    blocked on.
+    """
+
+    def __init__(self, parent: "Control | None" = None, priority: int = 0):
+        self.parent = parent
+        self.priority = priority
+        self._stopped = False
+        self._stop_event = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        # Notified when this control stops or it or an ancestor resumes
+        self._changed = threading.Condition()
+        self._children = weakref.WeakSet()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        if parent is not None:
+            parent._adopt(self)
+
+    def _adopt(self, child: "Control"):
+        with self._lock:
+            self._children.add(child)
+            stopped = self._stopped
+        if stopped:
+            child.stop()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+        self._wake()
+
+    def stop(self):
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            callbacks, self._callbacks = self._callbacks, []
+            children = list(self._children)
+        self._stop_event.set()
+        # Wake anything waiting for a resume so it sees the stop
+        self._resumed.set()
+        self._wake()
+        for callback in callbacks:
+            callback()
+        for child in children:
+            child.stop()
+
+    def reset(self):
+        """Clear the stop and pause of this control (not of its children)"""
+        with self._lock:
+            self._stopped = False
+            self._stop_event.clear()
+        self._resumed.set()
+        self._wake()
+
+    def is_stopped(self) -> bool:
+        return self._stopped
+
+    def is_paused(self) -> bool:
+        """This control itself is paused, whatever its ancestors do"""
+        return not self._resumed.is_set()
+
+    def wait_if_paused(self) -> bool:
+        """Block while this control or an ancestor is paused; False once stopped"""
+        with self._changed:
+            while not self._stopped and any(c.is_paused() for c in self._chain()):
+                self._changed.wait()
+        return not self._stopped
+
+    def _wake(self):
+        """Let waiters here and below re-check their pause and stop"""
+        with self._changed:
+            self._changed.notify_all()
+        with self._lock:
+            children = list(self._children)
+        for child in children:
+            child._wake()
+
+    def wait_stopped(self, timeout: float | None = None) -> bool:
+        """Sleep up to ``timeout``, returning early (True) on stop"""
+        return self._stop_event.wait(timeout)
+
+    def on_stop(self, callback):
+        """Run ``callback`` on stop (at once if already stopped); returns an unregister function"""
+        with self._lock:
+            stopped = self._stopped
+            if not stopped:
+                self._callbacks.append(callback)
+        if stopped:
+            callback()
+
+        def unregister():
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+        return unregister
+
+    def _chain(self):
+        control = self
+        while control is not None:
+            yield control
+            control = control.parent
+
+
+# The whole process; sessions and torrents hang below it
+_root = Control()
+
+
+def root() -> Control:
+    return _root
 
 
 def pause():
-    _pause_event.clear()
-    print("\n⏸ Paused")
+    _root.pause()
+    logger.info("Paused")
 
 
 def resume():
-    _pause_event.set()
-    print("\n⏵ Resumed")
+    _root.resume()
+    logger.info("Resumed")
 
 
 def stop():
-    global _stop_flag
-    with _lock:
-        _stop_flag = True
-    _pause_event.set()
-    print("\n⏹ Stopped")
+    _root.stop()
+    logger.info("Stopped")
 
 
 def reset():
-    global _stop_flag
-    with _lock:
-        _stop_flag = False
-    _pause_event.set()
+    _root.reset()
 
 
 def is_stopped() -> bool:
-    with _lock:
-        return _stop_flag
+    return _root.is_stopped()
 
 
 def wait_if_paused() -> bool:
-    _pause_event.wait()
-    return not is_stopped()
+    return _root.wait_if_paused()
@@ -1,47 +1,185 @@
-from src.progress.indicator import ProgressIndicator
+from src import profiling
+from src.metrics import LatencyStat
+import bisect
 import hashlib
 import math
 import os
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# How data already on disk is checked when a torrent is opened: hash every
+# piece first, hash them while the torrent already runs, or trust the files
+CHECK_FULL = "full"
+CHECK_BACKGROUND = "background"
+CHECK_SKIP = "skip"
+# Pieces known to have passed their hash check are saved next to the data,
+# at most this often while downloading, so CHECK_SKIP can trust them later
+RESUME_SUFFIX = ".bt-resume"
+RESUME_INTERVAL = 10.0
+
 
 class StorageManager:
-    def __init__(self, torrent_info, download_dir):
+    def __init__(self, torrent_info, download_dir, check: str = CHECK_FULL):
         self.torrent_info = torrent_info
         self.download_dir = download_dir
         self.piece_length = torrent_info["piece length"]
         self.total_pieces = len(self.torrent_info["pieces"]) // 20
         self.pieces_status = [False] * self.total_pieces
+        # Disk and hash timings; hash failures count as failed verifications
+        self.read_latency = LatencyStat()
+        self.write_latency = LatencyStat()
+        self.verify_latency = LatencyStat()
         self.file_map = self._build_file_map()
-        self._validate_existing_pieces()
-        self.progress = ProgressIndicator(self.total_pieces)
+        self._file_ends = [f["end_off"] for f in self.file_map]
+        self.total_length = self.file_map[-1]["end_off"] if self.file_map else 0
+        # Kept up to date as pieces complete, so progress is read in O(1)
+        self.completed_pieces = 0
+        self.bytes_completed = 0
+        self._completed_lock = threading.Lock()
+        self._create_lock = threading.Lock()
+        # True while the data on disk is being hashed
+        self.checking = False
+        self.resume_path = os.path.join(
+            download_dir, f".{torrent_info['name']}{RESUME_SUFFIX}"
+        )
+        self._resume_lock = threading.Lock()
+        self._resume_saved = 0.0
+        if check == CHECK_FULL:
+            self._validate_existing_pieces()
+        elif check == CHECK_SKIP:
+            self._trust_existing_pieces()
         logger.info(
             f"StorageManager initialized for download_dir='{self.download_dir}' with {self.total_pieces} pieces"
         )
 
-    def _validate_existing_pieces(self):
-        logger.info("Validating existing data...")
-        for i in range(self.total_pieces):
+    def check_in_background(self, should_stop=None) -> threading.Thread:
+        """Hash the data on disk from a thread of its own.
+
+        Meant for CHECK_BACKGROUND: the torrent talks to peers meanwhile and
+        pieces count as done as they pass.
+        """
+        self.checking = True
+        thread = threading.Thread(
+            target=self._validate_existing_pieces, args=(should_stop,), daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _validate_existing_pieces(self, should_stop=None):
+        self.checking = True
+        try:
+            if not any(f["created"] for f in self.file_map):
+                # A fresh download: nothing to read
+                return
+            logger.info("Validating existing data...")
+            for i in range(self.total_pieces):
+                if should_stop is not None and should_stop():
+                    return
+                if self.pieces_status[i] or not self._on_disk(i):
+                    continue
+                try:
+                    data = self.read_piece(i, 0, self.piece_size(i))
+                    if self._hash_matches(i, data):
+                        self._record_completed(i)
+                except Exception:
+                    pass
+
+            if self.completed_pieces > 0:
+                logger.info(
+                    f"Found {self.completed_pieces} valid pieces already downloaded"
+                )
+            self.save_resume()
+        finally:
+            self.checking = False
+
+    def _trust_existing_pieces(self):
+        """Count the pieces saved as verified as done, without hashing.
+
+        Files are created sparse at full length, so their existence says
+        nothing about which pieces they hold; without resume data every
+        piece is hashed after all.
+        """
+        verified = self._load_resume()
+        if verified is None:
+            logger.warning("No resume data to trust, checking existing data")
+            self._validate_existing_pieces()
+            return
+        for i, done in enumerate(verified):
+            if done and self._on_disk(i):
+                self._record_completed(i)
+        logger.info(
+            f"Skipped checking: {self.completed_pieces} pieces trusted "
+            "from resume data"
+        )
+
+    def _resume_key(self) -> bytes:
+        # Ties the resume data to this torrent's pieces
+        return hashlib.sha1(self.torrent_info["pieces"]).digest()
+
+    def save_resume(self):
+        """Save which pieces passed their hash check, once there is data on disk"""
+        if not any(f["created"] for f in self.file_map):
+            return
+        with self._resume_lock:
+            self._resume_saved = time.monotonic()
+            tmp = self.resume_path + ".tmp"
             try:
-                # Calculate piece length (handle last piece)
-                piece_len = self.piece_length
-                if i == self.total_pieces - 1:
-                    total_length = sum(f["length"] for f in self.file_map)
-                    rem = total_length % self.piece_length
-                    if rem > 0:
-                        piece_len = rem
-
-                data = self.read_piece(i, 0, piece_len)
-                if self.piece_hash_valid(i, data):
-                    self.pieces_status[i] = True
-            except Exception:
-                pass
-
-        completed = sum(self.pieces_status)
-        if completed > 0:
-            logger.info(f"Found {completed} valid pieces already downloaded")
+                with open(tmp, "wb") as f:
+                    f.write(self._resume_key() + self.get_bitfield())
+                os.replace(tmp, self.resume_path)
+            except OSError as e:
+                logger.warning(f"Failed to save resume data: {e}")
+
+    def _load_resume(self) -> list[bool] | None:
+        """Pieces saved as verified, None without usable resume data"""
+        try:
+            with open(self.resume_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        key, bitfield = data[:20], data[20:]
+        if key != self._resume_key() or len(bitfield) != math.ceil(
+            self.total_pieces / 8
+        ):
+            logger.warning(
+                f"Ignoring resume data of another torrent: {self.resume_path}"
+            )
+            return None
+        return [
+            bool(bitfield[i // 8] & (1 << (7 - i % 8))) for i in range(self.total_pieces)
+        ]
+
+    def _on_disk(self, piece_index: int) -> bool:
+        """Whether all the files a piece lies in exist"""
+        start = piece_index * self.piece_length
+        end = start + self.piece_size(piece_index)
+        first = bisect.bisect_right(self._file_ends, start)
+        last = bisect.bisect_left(self._file_ends, end)
+        return all(
+            f["created"] or not f["length"] for f in self.file_map[first : last + 1]
+        )
+
+    def piece_size(self, piece_index: int) -> int:
+        """Length of a piece; the last one may be shorter"""
+        start = piece_index * self.piece_length
+        return max(0, min(self.piece_length, self.total_length - start))
+
+    def bytes_left(self) -> int:
+        """Bytes of the pieces not downloaded yet"""
+        return self.total_length - self.bytes_completed
+
+    def block_location(self, piece_index: int, begin: int, length: int):
+        """(path, file offset) of a block lying within a single file, else None"""
+        global_offset = piece_index * self.piece_length + begin
+        for f in self.file_map:
+            if global_offset < f["end_off"]:
+                if global_offset + length > f["end_off"]:
+                    return None
+                return f["path"], global_offset - f["start_off"]
+        return None
 
     def get_bitfield(self) -> bytes:
         num_bytes = math.ceil(self.total_pieces / 8)
@@ -56,16 +194,33 @@ class StorageManager:
         return bytes(bitfield)
 
     def mark_piece_completed(self, piece_index: int):
-        if 0 <= piece_index < self.total_pieces:
-            self.pieces_status[piece_index] = True
-            completed = sum(self.pieces_status)
+        if 0 <= piece_index < self.total_pieces and self._record_completed(
+            piece_index
+        ):
+            completed = self.completed_pieces
             logger.info(
                 f"Piece {piece_index} marked as completed, {completed}/{self.total_pieces} pieces done"
             )
-            self.progress.update(completed)
             if completed == self.total_pieces:
                 logger.info("All pieces downloaded")
-                self.progress.close()
+                self.save_resume()
+            elif time.monotonic() - self._resume_saved >= RESUME_INTERVAL:
+                self.save_resume()
+
+    def _record_completed(self, piece_index: int) -> bool:
+        """Mark a piece done and count it; False if it already was"""
+        with self._completed_lock:
+            if self.pieces_status[piece_index]:
+                return False
+            self.pieces_status[piece_index] = True
+            self.completed_pieces += 1
+            self.bytes_completed += self.piece_size(piece_index)
+            complete = self.completed_pieces == self.total_pieces
+        if complete:
+            # Empty files are never written to
+            for f in self.file_map:
+                self._ensure_file(f)
+        return True
 
     def _build_file_map(self):
         files = []
@@ -93,20 +248,38 @@ class StorageManager:
                 {"path": path, "length": length, "start_off": 0, "end_off": length}
             )
 
+        # Files are created on their first write, so opening a torrent
+        # with many files doesn't have to touch each of them
         for file in files:
-            os.makedirs(os.path.dirname(file["path"]), exist_ok=True)
-            if not os.path.exists(file["path"]):
-                try:
-                    with open(file["path"], "wb") as tmp:
-                        tmp.truncate(file["length"])
+            file["created"] = os.path.exists(file["path"])
+        return files
+
+    def _ensure_file(self, f: dict):
+        """Create a file, sparse at its full length, unless it exists"""
+        if f["created"]:
+            return
+        with self._create_lock:
+            if f["created"]:
+                return
+            try:
+                os.makedirs(os.path.dirname(f["path"]), exist_ok=True)
+                if not os.path.exists(f["path"]):
+                    with open(f["path"], "wb") as tmp:
+                        tmp.truncate(f["length"])
                     logger.info(
-                        f"Created file '{file['path']}' with length {file['length']} bytes"
+                        f"Created file '{f['path']}' with length {f['length']} bytes"
                     )
-                except Exception as e:
-                    logger.error(f"Failed to create file '{file['path']}': {e}")
-        return files
+                f["created"] = True
+            except Exception as e:
+                logger.error(f"Failed to create file '{f['path']}': {e}")
 
     def write_piece(self, piece_index: int, data: bytes):
+        started = profiling.start()
+        with self.write_latency.time():
+            self._write_piece(piece_index, data)
+        profiling.record(profiling.DISK_WRITE, started)
+
+    def _write_piece(self, piece_index: int, data: bytes):
         global_offset = piece_index * self.piece_length
         remaining = len(data)
         data_offset = 0
@@ -115,12 +288,14 @@ class StorageManager:
                 if global_offset < f["end_off"]:
                     file_rel_offset = max(global_offset - f["start_off"], 0)
                     write_len = min(remaining, f["end_off"] - global_offset)
+                    self._ensure_file(f)
                     with open(f["path"], "r+b") as fh:
                         fh.seek(file_rel_offset)
                         fh.write(data[data_offset : data_offset + write_len])
-                    logger.info(
-                        f"Wrote {write_len} bytes to '{f['path']}' at offset {file_rel_offset} for piece {piece_index}"
-                    )
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            f"Wrote {write_len} bytes to '{f['path']}' at offset {file_rel_offset} for piece {piece_index}"
+                        )
                     remaining -= write_len
                     global_offset += write_len
                     data_offset += write_len
@@ -130,6 +305,13 @@ class StorageManager:
             logger.error(f"Error writing piece {piece_index}: {e}")
 
     def read_piece(self, piece_index: int, offset: int, length: int) -> bytes:
+        started = profiling.start()
+        with self.read_latency.time():
+            data = self._read_piece(piece_index, offset, length)
+        profiling.record(profiling.DISK_READ, started)
+        return data
+
+    def _read_piece(self, piece_index: int, offset: int, length: int) -> bytes:
         global_offset = piece_index * self.piece_length + offset
         remaining = length
         data = bytearray()
@@ -141,9 +323,10 @@ class StorageManager:
                     with open(f["path"], "rb") as fh:
                         fh.seek(file_rel_offset)
                         data.extend(fh.read(read_len))
-                    logger.info(
-                        f"Read {read_len} bytes from '{f['path']}' at offset {file_rel_offset} for piece {piece_index}"
-                    )
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            f"Read {read_len} bytes from '{f['path']}' at offset {file_rel_offset} for piece {piece_index}"
+                        )
                     remaining -= read_len
                     global_offset += read_len
                     if remaining <= 0:
@@ -155,6 +338,15 @@ class StorageManager:
         return bytes(data)
 
     def piece_hash_valid(self, piece_index: int, data: bytes) -> bool:
+        """Check a downloaded piece, recording the time taken and any failure"""
+        started = profiling.start()
+        start = time.perf_counter()
+        valid = self._hash_matches(piece_index, data)
+        self.verify_latency.observe(time.perf_counter() - start, failed=not valid)
+        profiling.record(profiling.HASH, started)
+        return valid
+
+    def _hash_matches(self, piece_index: int, data: bytes) -> bool:
         pieces_hashes = self.torrent_info["pieces"]
         piece_hash = pieces_hashes[piece_index * 20 : (piece_index + 1) * 20]
         real_hash = hashlib.sha1(data).digest()
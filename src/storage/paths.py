@@ -0,0 +1,10 @@
+import os
+
+
+def data_dir() -> str:
+    """Directory for state kept across runs (DHT nodes, peer caches)"""
+    path = os.environ.get("BITTORRENT_HOME") or os.path.join(
+        os.path.expanduser("~"), ".bittorrent"
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
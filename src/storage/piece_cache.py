@@ -0,0 +1,85 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Enough for a few dozen typical pieces
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+class PieceCache:
+    """Memory-bounded LRU of whole pieces read for uploading.
+
+    The first block requested from a piece reads the entire piece, so the
+    remaining blocks, and every other peer asking for the same piece, are
+    served from memory. Entries are keyed by storage manager, so one cache
+    can be shared between torrents.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._pieces: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, storage_manager, piece_index: int, begin: int, length: int):
+        """Return a block if its piece is cached, without reading from disk"""
+        key = (storage_manager, piece_index)
+        with self._lock:
+            piece = self._pieces.get(key)
+            if piece is None:
+                return None
+            self._pieces.move_to_end(key)
+            self.hits += 1
+            return piece[begin: begin + length]
+
+    def read_block(self, storage_manager, piece_index: int, begin: int, length: int) -> bytes:
+        block = self.lookup(storage_manager, piece_index, begin, length)
+        if block is not None:
+            return block
+        with self._lock:
+            self.misses += 1
+
+        piece_size = storage_manager.piece_size(piece_index)
+        piece = storage_manager.read_piece(piece_index, 0, piece_size)
+        if len(piece) != piece_size:
+            # Short read: serve what we got, but don't cache a broken piece
+            return piece[begin: begin + length]
+        self._store((storage_manager, piece_index), piece)
+        return piece[begin: begin + length]
+
+    def _store(self, key: tuple, piece: bytes):
+        if len(piece) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._pieces:
+                return
+            self._pieces[key] = piece
+            self.size += len(piece)
+            while self.size > self.max_bytes:
+                _, evicted = self._pieces.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, storage_manager):
+        """Drop every cached piece of a torrent that is no longer served"""
+        with self._lock:
+            for key in [key for key in self._pieces if key[0] is storage_manager]:
+                self.size -= len(self._pieces.pop(key))
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "pieces": len(self._pieces),
+                "bytes": self.size,
+            }
@@ -1,21 +1,82 @@
+from src.metrics import LatencyStat
 from src.torrent.parser import TorrentFileParser
 import bcoding
-import requests
 import socket
 import struct
 import random
 import logging
+import time
+from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
 
+def decode_compact_peers(data: bytes) -> list[tuple[str, int]]:
+    """Decode BEP 23 compact IPv4 peers (6 bytes per peer)"""
+    peers = []
+    for i in range(0, len(data) - 5, 6):
+        ip_str = socket.inet_ntoa(data[i: i + 4])
+        port_int = struct.unpack("!H", data[i + 4: i + 6])[0]
+        peers.append((ip_str, port_int))
+    return peers
+
+
+def decode_compact_peers6(data: bytes) -> list[tuple[str, int]]:
+    """Decode BEP 7 compact IPv6 peers (18 bytes per peer)"""
+    peers = []
+    for i in range(0, len(data) - 17, 18):
+        ip_str = socket.inet_ntop(socket.AF_INET6, data[i: i + 16])
+        port_int = struct.unpack("!H", data[i + 16: i + 18])[0]
+        peers.append((ip_str, port_int))
+    return peers
+
+
+def encode_compact_peers(peers: list[tuple[str, int]]) -> bytes:
+    return b"".join(
+        socket.inet_aton(ip) + struct.pack("!H", port) for ip, port in peers
+    )
+
+
+def encode_compact_peers6(peers: list[tuple[str, int]]) -> bytes:
+    return b"".join(
+        socket.inet_pton(socket.AF_INET6, ip) + struct.pack("!H", port)
+        for ip, port in peers
+    )
+
+
+def local_ipv6_address() -> str | None:
+    """Return our global IPv6 address, or None if the host has no IPv6 route"""
+    if not socket.has_ipv6:
+        return None
+    try:
+        # connect() on a UDP socket only selects a route, nothing is sent
+        with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+            sock.connect(("2001:4860:4860::8888", 80))
+            address = sock.getsockname()[0]
+    except OSError:
+        return None
+    if address.startswith("fe80") or address == "::1":
+        return None
+    return address
+
+
 class GetPeers:
     source: str
     destination: str
 
-    def __init__(self, source: str, destination: str) -> None:
+    def __init__(
+        self,
+        source: str,
+        destination: str,
+        port: int = 6889,
+        latency: LatencyStat | None = None,
+    ) -> None:
         self.source = source
         self.destination = destination
+        # The port our peer listener accepts connections on
+        self.port = port
+        # Response time of every tracker asked, failures included
+        self.latency = latency if latency is not None else LatencyStat()
 
     def peers(self) -> tuple[list[str], int, bytes] | tuple[None, None, None]:
         parser = TorrentFileParser(self.source, self.destination)
@@ -27,136 +88,151 @@ class GetPeers:
             "uploaded": 0,
             "downloaded": 0,
             "left": list_args[3],
-            "port": 6889,
+            "port": self.port,
             "compact": 1,
         }
+        ipv6 = local_ipv6_address()
+        if ipv6:
+            params["ipv6"] = ipv6
 
         for index in list_args[0]:
-            if "http" in index or "https" in index:
-                try:
-                    response = requests.get(index, params=params, timeout=5)
-                    if response.status_code == 200:
-                        tracker_response = bcoding.bdecode(response.content)
-                        if "peers" in tracker_response:
-                            peers_data = tracker_response["peers"]
-                            peers = []
-                            if isinstance(peers_data, bytes):
-                                # Compact format
-                                for i in range(0, len(peers_data), 6):
-                                    ip_bytes = peers_data[i:i+4]
-                                    port_bytes = peers_data[i+4:i+6]
-                                    ip_str = socket.inet_ntoa(ip_bytes)
-                                    port_int = struct.unpack(
-                                        "!H", port_bytes)[0]
-                                    peers.append((ip_str, port_int))
-                            else:
-                                # Dictionary format
-                                for peer in peers_data:
-                                    peers.append((peer["ip"], peer["port"]))
-                            if peers:
-                                logger.info(
-                                    f"Found {len(peers)} peers from HTTP tracker {index}")
-                                return peers, list_args[1], list_args[2]
-                except Exception as e:
-                    logger.error(f"HTTP tracker error: {e}")
-                    continue
-            else:
-                try:
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    sock.settimeout(5)
-                    domain_name = index.split(":")
-                    domain_name = domain_name[1][2:]
-                    port = index.split(":")[2].split("/")[0]
-                    server_address = (str(domain_name), int(port))
-                    protocol_id = 0x41727101980
-                    action_connect = 0
-                    transaction_id = random.randint(0, 2**32 - 1)
-
-                    connect_packed = struct.pack(
-                        "!QII", protocol_id, action_connect, transaction_id
-                    )
-                    sock.sendto(connect_packed, server_address)
-
-                    response, _ = sock.recvfrom(10000)
-
-                    if len(response) < 16:
-                        logger.error(f"Error bad response from {index}")
-                        continue
-
-                    action, response_transaction_id, connection_id = struct.unpack(
-                        "!IIQ", response[:16]
-                    )
-
-                    if response_transaction_id != transaction_id:
-                        logger.error(f"Wrong transaction id from {index}")
-                        continue
-
-                    action_announce = 1
-                    event = 0
-                    ip = 0
-                    key = random.randint(0, 2**32 - 1)
-                    num_want = -1
-                    for param_key, value in params.items():
-                        if param_key == "peer_id":
-                            peer_id = value.encode("utf-8")
-                        if param_key == "info_hash":
-                            info_hash = value
-                        if param_key == "downloaded":
-                            downloaded = int(value)
-                        if param_key == "uploaded":
-                            uploaded = int(value)
-                        if param_key == "left":
-                            left = int(value)
-                        if param_key == "port":
-                            port_for_request = int(value)
-
-                    announce_packet = struct.pack(
-                        "!QII20s20sQQQIIIiH",
-                        connection_id,
-                        action_announce,
-                        transaction_id,
-                        info_hash,
-                        peer_id,
-                        downloaded,
-                        left,
-                        uploaded,
-                        event,
-                        ip,
-                        key,
-                        num_want,
-                        port_for_request,
-                    )
-
-                    sock.sendto(announce_packet, server_address)
-
-                    response, _ = sock.recvfrom(10000)
-
-                    if len(response) < 20:
-                        logger.error(
-                            f"Response is smaller than 20 from {index}")
-                        continue
-
-                    peers_ip = response[20:]
-
-                    peers = []
-                    for i in range(0, len(peers_ip), 6):
-                        ip_bites = peers_ip[i: i + 4]
-                        port_bytes = peers_ip[i + 4: i + 6]
-
-                        ip_str = socket.inet_ntoa(ip_bites)
-                        port_int = struct.unpack("!H", port_bytes)[0]
-                        peers.append((ip_str, int(port_int)))
-
-                    logger.info(f"Found {len(peers)} peers from {index}")
-                    sock.close()
-                    return peers, info_hash, peer_id
-
-                except Exception as e:
-                    logger.error(f"Error connecting to tracker {index}: {e}")
-                    try:
-                        sock.close()
-                    except Exception:
-                        pass
-                    continue
+            started = time.perf_counter()
+            result = self._announce(index, params)
+            self.latency.observe(time.perf_counter() - started, failed=result is None)
+            if result is not None:
+                return result
 
         return None, None, None
+
+    def _announce(self, index: str, params: dict):
+        """Ask one tracker; (peers, info_hash, peer_id) or None on failure"""
+        if "http" in index or "https" in index:
+            # Imported on first use: requests pulls in urllib3 and friends,
+            # which torrents with UDP trackers only never need
+            import requests
+
+            try:
+                response = requests.get(index, params=params, timeout=5)
+                if response.status_code == 200:
+                    tracker_response = bcoding.bdecode(response.content)
+                    peers = self._parse_http_peers(tracker_response)
+                    if peers:
+                        logger.info(
+                            f"Found {len(peers)} peers from HTTP tracker {index}")
+                        return peers, params["info_hash"], params["peer_id"]
+            except Exception as e:
+                logger.error(f"HTTP tracker error: {e}")
+                return None
+        else:
+            try:
+                url = urlparse(index)
+                family, _, _, _, server_address = socket.getaddrinfo(
+                    url.hostname, url.port, type=socket.SOCK_DGRAM
+                )[0]
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.settimeout(5)
+                protocol_id = 0x41727101980
+                action_connect = 0
+                transaction_id = random.randint(0, 2**32 - 1)
+
+                connect_packed = struct.pack(
+                    "!QII", protocol_id, action_connect, transaction_id
+                )
+                sock.sendto(connect_packed, server_address)
+
+                response, _ = sock.recvfrom(10000)
+
+                if len(response) < 16:
+                    logger.error(f"Error bad response from {index}")
+                    return None
+
+                action, response_transaction_id, connection_id = struct.unpack(
+                    "!IIQ", response[:16]
+                )
+
+                if response_transaction_id != transaction_id:
+                    logger.error(f"Wrong transaction id from {index}")
+                    return None
+
+                action_announce = 1
+                event = 0
+                ip = 0
+                key = random.randint(0, 2**32 - 1)
+                num_want = -1
+                for param_key, value in params.items():
+                    if param_key == "peer_id":
+                        peer_id = value.encode("utf-8")
+                    if param_key == "info_hash":
+                        info_hash = value
+                    if param_key == "downloaded":
+                        downloaded = int(value)
+                    if param_key == "uploaded":
+                        uploaded = int(value)
+                    if param_key == "left":
+                        left = int(value)
+                    if param_key == "port":
+                        port_for_request = int(value)
+
+                announce_packet = struct.pack(
+                    "!QII20s20sQQQIIIiH",
+                    connection_id,
+                    action_announce,
+                    transaction_id,
+                    info_hash,
+                    peer_id,
+                    downloaded,
+                    left,
+                    uploaded,
+                    event,
+                    ip,
+                    key,
+                    num_want,
+                    port_for_request,
+                )
+
+                sock.sendto(announce_packet, server_address)
+
+                response, _ = sock.recvfrom(10000)
+
+                if len(response) < 20:
+                    logger.error(
+                        f"Response is smaller than 20 from {index}")
+                    return None
+
+                peers_ip = response[20:]
+
+                # BEP 15: an announce over IPv6 returns 18-byte peers
+                if family == socket.AF_INET6:
+                    peers = decode_compact_peers6(peers_ip)
+                else:
+                    peers = decode_compact_peers(peers_ip)
+
+                logger.info(f"Found {len(peers)} peers from {index}")
+                sock.close()
+                return peers, info_hash, peer_id
+
+            except Exception as e:
+                logger.error(f"Error connecting to tracker {index}: {e}")
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+                return None
+
+        return None
+
+    @staticmethod
+    def _parse_http_peers(tracker_response: dict) -> list[tuple[str, int]]:
+        peers = []
+        peers_data = tracker_response.get("peers", b"")
+        if isinstance(peers_data, bytes):
+            # Compact format
+            peers.extend(decode_compact_peers(peers_data))
+        else:
+            # Dictionary format
+            for peer in peers_data:
+                peers.append((peer["ip"], peer["port"]))
+        peers6_data = tracker_response.get("peers6", b"")
+        if isinstance(peers6_data, bytes):
+            peers.extend(decode_compact_peers6(peers6_data))
+        return peers
@@ -0,0 +1,224 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.torrent.parser import TorrentFileParser
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 2.0
+PARSE_WORKERS = 4
+# Processed files are moved into these subdirectories of the watched one
+ADDED_DIR = "added"
+DUPLICATE_DIR = "duplicate"
+FAILED_DIR = "failed"
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify(7) binding through ctypes, Linux only.
+
+    ``read`` returns the names of files finished being written to or moved
+    into the directory, or None when the kernel queue overflowed and
+    events were lost.
+    """
+
+    def __init__(self, path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(
+            self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {path}")
+
+    @classmethod
+    def open(cls, path: str) -> "Inotify | None":
+        """An Inotify for ``path``, or None where inotify isn't available"""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            return cls(path)
+        except (OSError, AttributeError) as e:
+            logger.info(f"inotify unavailable ({e}), polling {path}")
+            return None
+
+    def read(self, timeout: float) -> list[str] | None:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """Adds .torrent files dropped into a directory to a running Session.
+
+    New files are noticed through inotify where available, otherwise by
+    polling; a polled file is only taken once its size and mtime have
+    held still between two polls, so half-written files are skipped.
+    Up to ``parse_workers`` files are parsed at once. Torrents whose
+    info_hash the session already has are not added again. Each
+    processed file is moved into ``added/``, ``duplicate/`` or
+    ``failed/`` below the watched directory; added torrents are loaded
+    from their new place.
+    """
+
+    def __init__(
+        self,
+        session,
+        path: str,
+        destination: str | None = None,
+        parse_workers: int = PARSE_WORKERS,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        self.session = session
+        self.path = path
+        self.destination = destination
+        self.poll_interval = poll_interval
+        self.running = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=parse_workers, thread_name_prefix="torrent-parse"
+        )
+        self._pending = set()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        for name in (ADDED_DIR, DUPLICATE_DIR, FAILED_DIR):
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+
+    def start(self):
+        """Watch until stopped (blocks; call from its own thread)"""
+        self.running = True
+        inotify = Inotify.open(self.path)
+        logger.info(
+            f"Watching {self.path} for torrents "
+            f"({'inotify' if inotify else 'polling'})"
+        )
+        try:
+            # Files that were already waiting are complete
+            self.scan(settle=False)
+            while self.running and not self.session.control.is_stopped():
+                if inotify is None:
+                    self.session.control.wait_stopped(self.poll_interval)
+                    self.scan()
+                    continue
+                names = inotify.read(min(self.poll_interval, 0.5))
+                if names is None:
+                    logger.warning("inotify queue overflowed, rescanning")
+                    self.scan(settle=False)
+                else:
+                    for name in names:
+                        self._submit(os.path.join(self.path, name))
+        finally:
+            if inotify is not None:
+                inotify.close()
+            self._executor.shutdown(wait=True)
+
+    def stop(self):
+        self.running = False
+
+    def scan(self, settle: bool = True):
+        """Queue the directory's .torrent files; ``settle`` waits for them to stop changing"""
+        try:
+            names = os.listdir(self.path)
+        except OSError as e:
+            logger.error(f"Cannot list {self.path}: {e}")
+            return
+        seen = {}
+        for name in names:
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not name.endswith(".torrent") or not os.path.isfile(path):
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            seen[path] = signature
+            if not settle or self._sizes.get(path) == signature:
+                self._submit(path)
+        self._sizes = seen
+
+    def _submit(self, path: str):
+        if not path.endswith(".torrent"):
+            return
+        with self._lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+        self._executor.submit(self._ingest, path)
+
+    def _ingest(self, path: str):
+        try:
+            if not os.path.isfile(path):
+                return
+            try:
+                _, info_hash, _, _, _ = TorrentFileParser(path, self.destination).parse()
+            except Exception as e:
+                logger.warning(f"Cannot parse watched torrent {path}: {e}")
+                self._move(path, FAILED_DIR)
+                return
+            # Parsing runs in parallel, additions one at a time
+            with self._lock:
+                if self.session.find(info_hash) is not None:
+                    logger.info(f"{path} is already in the session, skipping")
+                    self._move(path, DUPLICATE_DIR)
+                    return
+                source = self._move(path, ADDED_DIR)
+                if source is None:
+                    return
+                entry = self.session.add(source, self.destination, info_hash=info_hash)
+            logger.info(f"Added watched torrent {source} as {entry.id}")
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def _move(self, path: str, folder: str) -> str | None:
+        """Move ``path`` into ``folder`` without overwriting, returning the new path"""
+        name = os.path.basename(path)
+        stem, ext = os.path.splitext(name)
+        target = os.path.join(self.path, folder, name)
+        count = 1
+        while os.path.exists(target):
+            target = os.path.join(self.path, folder, f"{stem}-{count}{ext}")
+            count += 1
+        try:
+            os.replace(path, target)
+        except OSError as e:
+            logger.error(f"Cannot move {path} to {folder}/: {e}")
+            return None
+        return target
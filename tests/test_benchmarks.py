@@ -0,0 +1,113 @@
+import hashlib
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from benchmarks import micro, startup, swarm
+from benchmarks.torrents import SyntheticTorrent, parse_size
+from benchmarks.wanproxy import WanProxy
+
+
+class TestSyntheticTorrent(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("256K"), 256 * 1024)
+        self.assertEqual(parse_size("1.5M"), 3 << 19)
+        self.assertEqual(parse_size("2GiB"), 2 << 30)
+        self.assertEqual(parse_size("1000"), 1000)
+
+    def test_pieces_hash_the_content(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            torrent = SyntheticTorrent(tmp, 100_000, piece_length=16384, files=3)
+            data = b"".join(open(p, "rb").read() for p in torrent.file_paths())
+            self.assertEqual(len(data), 100_000)
+            pieces = torrent.info["pieces"]
+            self.assertEqual(len(pieces), 7 * 20)
+            for i in range(7):
+                piece = data[i * 16384 : (i + 1) * 16384]
+                self.assertEqual(
+                    pieces[i * 20 : (i + 1) * 20], hashlib.sha1(piece).digest()
+                )
+            self.assertTrue(torrent.matches(tmp))
+            self.assertFalse(torrent.matches(os.path.join(tmp, "elsewhere")))
+
+
+class TestWanProxy(unittest.TestCase):
+
+    def test_round_trip_is_delayed(self):
+        server = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(server.close)
+
+        def echo():
+            conn, _ = server.accept()
+            with conn:
+                while data := conn.recv(1024):
+                    conn.sendall(data)
+
+        threading.Thread(target=echo, daemon=True).start()
+        proxy = WanProxy(server.getsockname(), latency=0.05).start()
+        self.addCleanup(proxy.stop)
+
+        with socket.create_connection(proxy.address, timeout=5) as client:
+            started = time.monotonic()
+            client.sendall(b"ping")
+            self.assertEqual(client.recv(1024), b"ping")
+            # Delayed once on the way there and once on the way back
+            self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+
+class TestSwarm(unittest.TestCase):
+
+    @patch.dict(os.environ)
+    def test_small_swarm_completes(self):
+        result = swarm.run(256 * 1024, piece_length=32 * 1024, timeout=30)
+        self.assertEqual(result["completed"], 1)
+        self.assertGreater(result["mb_per_s"], 0)
+        self.assertIsNotNone(result["ttfb_median"])
+        self.assertIn("completed        1/1", swarm.format_report(result))
+
+
+class TestMicro(unittest.TestCase):
+
+    def test_run_and_compare_with_a_saved_baseline(self):
+        names = micro.select(["decode_compact_peers6"])
+        self.assertEqual(len(names), 1)
+        results = micro.run(names, repeat=1)
+        self.assertGreater(results[names[0]]["min"], 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            micro.save_baseline("base", results, tmp)
+            baseline = micro.load_baseline("base", tmp)
+        [row] = micro.compare(results, baseline)
+        self.assertEqual((row[3], row[4]), (0.0, ""))
+        self.assertIn(names[0], micro.format_comparison([row]))
+
+    def test_verdicts(self):
+        baseline = {"results": {"a": {"min": 1.0}, "b": {"min": 1.0}}}
+        results = {
+            "a": {"min": 1.5, "median": 1.5},
+            "b": {"min": 0.5, "median": 0.5},
+            "c": {"min": 1.0, "median": 1.0},
+        }
+        verdicts = {row[0]: row[4] for row in micro.compare(results, baseline)}
+        self.assertEqual(verdicts, {"a": "slower", "b": "faster", "c": "new"})
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_import_report(self):
+        results, report = startup.run("src.torrent.parser", runs=1)
+        own, cumulative = report["src.torrent.parser"]
+        self.assertGreaterEqual(cumulative, own)
+        self.assertIn("startup.import[src.torrent.parser]", results)
+        self.assertIn(
+            "optional imports at startup: none", startup.format_report(report)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
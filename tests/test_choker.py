@@ -0,0 +1,131 @@
+import unittest
+import time
+from unittest.mock import patch
+
+from src.peer.choker import OPTIMISTIC_UNCHOKE_INTERVAL, Choker
+from src.peer.rate import RateMeter
+
+
+class FakePeer:
+
+    def __init__(self, name, download_rate=0.0, upload_rate=0.0, interested=True):
+        self.name = name
+        self.download_rate = download_rate
+        self.upload_rate = upload_rate
+        self.peer_interested = interested
+        self.am_choking = True
+        self.connected_at = time.monotonic() - 3600
+        self.events = []
+
+    def choke(self):
+        self.am_choking = True
+        self.events.append("choke")
+
+    def unchoke(self):
+        self.am_choking = False
+        self.events.append("unchoke")
+
+    def __repr__(self):
+        return self.name
+
+
+class TestChoker(unittest.TestCase):
+
+    def _choker(self, peers, seeding=False, slots=3):
+        choker = Choker(upload_slots=slots, is_seeding=lambda: seeding)
+        for peer in peers:
+            choker.register(peer)
+        return choker
+
+    def test_unchokes_best_downloaders_plus_optimistic(self):
+        peers = [FakePeer(f"p{i}", download_rate=i * 100) for i in range(6)]
+        choker = self._choker(peers)
+        choker.rechoke()
+
+        unchoked = {p.name for p in peers if not p.am_choking}
+        self.assertEqual(len(unchoked), 3)
+        self.assertIn("p5", unchoked)
+        self.assertIn("p4", unchoked)
+        self.assertIsNotNone(choker.optimistic)
+        self.assertIn(choker.optimistic.name, {"p0", "p1", "p2", "p3"})
+
+    def test_ranks_by_upload_rate_when_seeding(self):
+        peers = [
+            FakePeer("fast_up", download_rate=0, upload_rate=900),
+            FakePeer("fast_down", download_rate=900, upload_rate=0),
+            FakePeer("other", upload_rate=100),
+        ]
+        choker = self._choker(peers, seeding=True, slots=2)
+        with patch("src.peer.choker.random.choices", side_effect=lambda c, weights: [c[0]]):
+            choker.rechoke()
+        self.assertFalse(peers[0].am_choking)
+        self.assertTrue(peers[1].am_choking)
+        self.assertFalse(peers[2].am_choking)
+
+    def test_uninterested_peers_stay_choked(self):
+        peers = [FakePeer("a", download_rate=1000, interested=False), FakePeer("b")]
+        choker = self._choker(peers)
+        choker.rechoke()
+        self.assertTrue(peers[0].am_choking)
+        self.assertFalse(peers[1].am_choking)
+
+    def test_peer_rechoked_when_overtaken(self):
+        peers = [FakePeer("a", download_rate=10), FakePeer("b", download_rate=5)]
+        choker = self._choker(peers, slots=2)
+        with patch("src.peer.choker.random.choices", side_effect=lambda c, weights: [c[0]]):
+            choker.rechoke()
+            self.assertFalse(peers[0].am_choking)
+
+            newcomer = FakePeer("c", download_rate=50)
+            choker.register(newcomer)
+            choker.optimistic = None
+            choker.rechoke()
+        self.assertFalse(newcomer.am_choking)
+        self.assertEqual(peers[1].events[-1], "choke")
+
+    def test_optimistic_unchoke_rotates(self):
+        peers = [FakePeer(f"p{i}") for i in range(5)]
+        choker = self._choker(peers, slots=1)
+        with patch("src.peer.choker.random.choices", side_effect=lambda c, weights: [c[0]]):
+            choker.rechoke()
+            first = choker.optimistic
+            choker._last_optimistic -= OPTIMISTIC_UNCHOKE_INTERVAL
+            peers.remove(first)
+            first.peer_interested = False
+            choker.rechoke()
+        self.assertIsNot(choker.optimistic, first)
+        self.assertTrue(first.am_choking)
+
+    def test_interest_fills_free_slot_immediately(self):
+        peer = FakePeer("a")
+        choker = self._choker([peer], slots=1)
+        choker.peer_interested(peer)
+        self.assertFalse(peer.am_choking)
+
+        other = FakePeer("b")
+        choker.register(other)
+        choker.peer_interested(other)
+        self.assertTrue(other.am_choking)
+
+    def test_unregister_clears_optimistic(self):
+        peer = FakePeer("a")
+        choker = self._choker([peer], slots=1)
+        choker.rechoke()
+        choker.unregister(peer)
+        self.assertIsNone(choker.optimistic)
+        self.assertEqual(choker.peers, [])
+
+
+class TestRateMeter(unittest.TestCase):
+
+    def test_rate_tracks_updates_and_decays(self):
+        meter = RateMeter(window=10.0)
+        meter.update(1000)
+        self.assertEqual(meter.total, 1000)
+        self.assertAlmostEqual(meter.rate, 100.0, delta=1.0)
+        meter._last -= 10.0
+        self.assertAlmostEqual(meter.rate, 100.0 / 2.718281828, delta=1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
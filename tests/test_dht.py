@@ -0,0 +1,102 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from src.dht.node import DHTNode, decode_nodes, encode_nodes
+from src.dht.routing_table import NodeInfo, RoutingTable, distance
+
+
+class TestRoutingTable(unittest.TestCase):
+
+    def test_insert_and_closest(self):
+        table = RoutingTable(b"\x00" * 20)
+        ids = [bytes([i]) + b"\x00" * 19 for i in range(1, 6)]
+        for i, node_id in enumerate(ids):
+            self.assertTrue(table.insert(node_id, ("127.0.0.1", 6000 + i)))
+        closest = table.closest(b"\x02" + b"\x00" * 19, count=2)
+        self.assertEqual([n.node_id for n in closest], [ids[1], ids[2]])
+
+    def test_own_bucket_splits_and_far_bucket_fills(self):
+        table = RoutingTable(b"\x00" * 20, k=2)
+        far = [b"\xff" + bytes([i]) * 19 for i in range(3)]
+        self.assertTrue(table.insert(far[0], ("127.0.0.1", 1)))
+        self.assertTrue(table.insert(far[1], ("127.0.0.1", 2)))
+        # Bucket covering our own id is split, the far half stays full
+        self.assertFalse(table.insert(far[2], ("127.0.0.1", 3)))
+        self.assertGreater(len(table.buckets), 1)
+        near = b"\x00" * 19 + b"\x01"
+        self.assertTrue(table.insert(near, ("127.0.0.1", 4)))
+
+    def test_bad_nodes_are_replaced(self):
+        table = RoutingTable(b"\x00" * 20, k=1)
+        first = b"\xff" * 20
+        second = b"\xfe" * 20
+        table.insert(first, ("127.0.0.1", 1))
+        table.mark_failed(first)
+        table.mark_failed(first)
+        self.assertTrue(table.insert(second, ("127.0.0.1", 2)))
+        self.assertEqual([n.node_id for n in table.nodes()], [second])
+
+    def test_compact_nodes_roundtrip(self):
+        nodes = [NodeInfo(b"\x01" * 20, ("10.0.0.1", 6881))]
+        self.assertEqual(decode_nodes(encode_nodes(nodes)), [(b"\x01" * 20, ("10.0.0.1", 6881))])
+
+    def test_distance(self):
+        self.assertEqual(distance(b"\x00" * 20, b"\x00" * 19 + b"\x03"), 3)
+
+
+class TestDHTCluster(unittest.TestCase):
+    """Small DHT swarm on loopback, no external network needed"""
+
+    CLUSTER_SIZE = 8
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.nodes = []
+        seed = self._start_node(bootstrap=[])
+        for _ in range(self.CLUSTER_SIZE - 1):
+            self._start_node(bootstrap=[("127.0.0.1", seed.port)])
+        for node in self.nodes[1:]:
+            node.bootstrap()
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _start_node(self, bootstrap, state_path=None):
+        node = DHTNode(port=0, host="127.0.0.1", state_path=state_path, bootstrap_nodes=bootstrap)
+        node.start()
+        self.nodes.append(node)
+        return node
+
+    def test_nodes_learn_about_each_other(self):
+        for node in self.nodes:
+            self.assertGreater(len(node.routing_table), 1)
+
+    def test_announce_and_get_peers(self):
+        info_hash = os.urandom(20)
+        self.assertGreater(self.nodes[2].announce_peer(info_hash, 51413), 0)
+
+        peers = self.nodes[-1].get_peers(info_hash)
+        self.assertIn(("127.0.0.1", 51413), peers)
+
+    def test_unknown_info_hash_has_no_peers(self):
+        self.assertEqual(self.nodes[3].get_peers(os.urandom(20)), [])
+
+    def test_state_persists_across_restarts(self):
+        state_path = os.path.join(self.tmp_dir, "dht.json")
+        node = self._start_node([("127.0.0.1", self.nodes[0].port)], state_path)
+        node.bootstrap()
+        node_id = node.node_id
+        node.stop()
+
+        restarted = self._start_node([], state_path)
+        self.assertEqual(restarted.node_id, node_id)
+        restarted.bootstrap()
+        self.assertGreater(len(restarted.routing_table), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
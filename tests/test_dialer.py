@@ -0,0 +1,164 @@
+import unittest
+import socket
+import threading
+from unittest.mock import patch
+
+from src.peer import dialer
+from src.peer.dialer import Connector
+
+
+class TestConnector(unittest.TestCase):
+
+    def setUp(self):
+        self.results = []
+        self.done = threading.Event()
+
+    def _callback(self, peer, sock, error):
+        self.results.append((peer, sock, error))
+        if sock is not None:
+            self.addCleanup(sock.close)
+        self.done.set()
+
+    def _listen(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(8)
+        self.addCleanup(server.close)
+        return ("127.0.0.1", server.getsockname()[1])
+
+    def _closed_port(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        port = server.getsockname()[1]
+        server.close()
+        return ("127.0.0.1", port)
+
+    def _run(self, connector):
+        thread = threading.Thread(target=connector.start, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 2)
+        self.addCleanup(connector.stop)
+
+    def test_connected_socket_is_handed_over(self):
+        connector = Connector(timeout=2)
+        self._run(connector)
+        peer = self._listen()
+        self.assertTrue(connector.connect(peer, self._callback))
+        self.assertTrue(self.done.wait(2))
+        (result_peer, sock, error), = self.results
+        self.assertEqual(result_peer, peer)
+        self.assertIsNone(error)
+        self.assertEqual(sock.getpeername(), peer)
+        self.assertEqual(sock.gettimeout(), 2)
+
+    @unittest.skipUnless(socket.has_ipv6, "IPv6 not available")
+    def test_connects_over_ipv6(self):
+        server = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        try:
+            server.bind(("::1", 0))
+        except OSError:
+            self.skipTest("IPv6 loopback not configured")
+        server.listen(1)
+        connector = Connector(timeout=2)
+        self._run(connector)
+        connector.connect(("::1", server.getsockname()[1]), self._callback)
+        self.assertTrue(self.done.wait(2))
+        (_, sock, error), = self.results
+        self.assertIsNone(error)
+        self.assertEqual(sock.family, socket.AF_INET6)
+
+    def test_addresses_race(self):
+        host, port = self._listen()
+        # The first address never answers (TEST-NET) or fails; either way
+        # the second joins the race and wins well before the timeout
+        infos = [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", port)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", (host, port)),
+        ]
+        connector = Connector(timeout=5, attempt_delay=0.05)
+        self._run(connector)
+        with patch("src.peer.dialer.socket.getaddrinfo", return_value=infos):
+            connector.connect(("dual.example", port), self._callback)
+            self.assertTrue(self.done.wait(2))
+        (_, sock, error), = self.results
+        self.assertIsNone(error)
+        self.assertEqual(sock.getpeername(), (host, port))
+        self.assertEqual(connector.half_open, 0)
+
+    def test_falls_back_when_first_family_fails(self):
+        host, port = self._listen()
+        # Nothing listens on [::1]:port, so the race must be won by IPv4
+        infos = [
+            (socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("::1", port, 0, 0)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", (host, port)),
+        ]
+        connector = Connector(timeout=2, attempt_delay=1)
+        self._run(connector)
+        with patch("src.peer.dialer.socket.getaddrinfo", return_value=infos):
+            connector.connect(("dual.example", port), self._callback)
+            self.assertTrue(self.done.wait(2))
+        (_, sock, error), = self.results
+        self.assertIsNone(error)
+        self.assertEqual(sock.getpeername()[0], host)
+
+    def test_failed_address_is_backed_off(self):
+        connector = Connector(timeout=2)
+        self._run(connector)
+        peer = self._closed_port()
+        connector.connect(peer, self._callback)
+        self.assertTrue(self.done.wait(2))
+        self.assertIsInstance(self.results[0][2], OSError)
+        self.assertGreater(connector.backoff_remaining(peer), 0)
+        self.assertFalse(connector.connect(peer, self._callback))
+
+    def test_backoff_doubles(self):
+        connector = Connector()
+        self.addCleanup(connector.stop)
+        peer = ("127.0.0.1", 1)
+        for expected in (dialer.BACKOFF_BASE, 2 * dialer.BACKOFF_BASE):
+            attempt = dialer._Attempt(peer, self._callback)
+            connector._finish(attempt, None, OSError("refused"))
+            self.assertAlmostEqual(connector.backoff_remaining(peer), expected, places=0)
+
+    def test_failures_are_bounded(self):
+        connector = Connector()
+        self.addCleanup(connector.stop)
+        with patch.object(dialer, "MAX_TRACKED_FAILURES", 8):
+            for port in range(1, 10):
+                attempt = dialer._Attempt(("127.0.0.1", port), self._callback)
+                connector._finish(attempt, None, OSError("refused"))
+        self.assertEqual(len(connector._failures), 6)
+        # The most recent failures are the ones kept
+        self.assertIn(("127.0.0.1", 9), connector._failures)
+        self.assertNotIn(("127.0.0.1", 1), connector._failures)
+
+    def test_half_open_limit(self):
+        connector = Connector(max_half_open=2)
+        self.addCleanup(connector.stop)
+        peers = [self._listen() for _ in range(4)]
+        for peer in peers:
+            self.assertTrue(connector.connect(peer, self._callback))
+        # Already queued
+        self.assertFalse(connector.connect(peers[0], self._callback))
+        connector._start_queued()
+        self.assertEqual(connector.half_open, 2)
+        self.assertEqual(len(connector._queue), 2)
+
+    def test_connect_timeout(self):
+        connector = Connector(max_half_open=1)
+        self.addCleanup(connector.stop)
+        peer = self._listen()
+        connector.connect(peer, self._callback)
+        connector._start_queued()
+        for attempt in connector._in_flight.values():
+            attempt.deadline = 0
+        connector._expire()
+        (_, sock, error), = self.results
+        self.assertIsNone(sock)
+        self.assertIsInstance(error, TimeoutError)
+        self.assertEqual(connector.half_open, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import unittest
+import struct
+import socket
+from unittest.mock import Mock
+
+import bcoding
+
+from src.peer import extensions
+from src.peer.connection import PeerConnection
+from src.peer.swarm import Swarm
+from tests.test_peer_connection import MockStorageManager
+
+
+def sent_messages(mock_socket):
+    return [call.args[0] for call in mock_socket.sendall.call_args_list]
+
+
+class TestExtensionProtocol(unittest.TestCase):
+
+    def test_handshake_advertises_extension_bit(self):
+        packet = extensions.build_handshake(b"A" * 20, b"B" * 20)
+        self.assertEqual(len(packet), 68)
+        reserved = packet[20:28]
+        self.assertTrue(extensions.supports_extensions(reserved))
+        self.assertFalse(extensions.supports_extensions(b"\x00" * 8))
+
+    def test_extended_handshake_roundtrip(self):
+        message = extensions.build_extended_handshake(listen_port=6889)
+        length, msg_id, extended_id = struct.unpack(">IBB", message[:6])
+        self.assertEqual(length, len(message) - 4)
+        self.assertEqual(msg_id, extensions.MSG_EXTENDED)
+        self.assertEqual(extended_id, extensions.EXTENDED_HANDSHAKE_ID)
+        self.assertEqual(bcoding.bdecode(message[6:])["p"], 6889)
+        self.assertEqual(
+            extensions.parse_extended_handshake(message[6:]), {"ut_pex": 1}
+        )
+
+    def test_disabled_extensions_are_dropped(self):
+        body = bcoding.bencode({"m": {"ut_pex": 0, "ut_metadata": 3}})
+        self.assertEqual(extensions.parse_extended_handshake(body), {"ut_metadata": 3})
+
+    def test_pex_payload_roundtrip(self):
+        added = [("10.0.0.1", 6881), ("2001:db8::1", 51413)]
+        dropped = [("10.0.0.2", 6882)]
+        body = bcoding.bencode(extensions.build_pex_payload(added, dropped))
+        parsed_added, parsed_dropped = extensions.parse_pex_payload(body)
+        self.assertEqual(parsed_added, added)
+        self.assertEqual(parsed_dropped, dropped)
+
+    def test_pex_added_is_capped(self):
+        added4 = [(f"10.0.{i // 256}.{i % 256}", 6881) for i in range(60)]
+        added6 = [("2001:db8::1", 51413)]
+        body = bcoding.bencode(
+            {
+                "added": extensions.encode_compact_peers(added4),
+                "added6": extensions.encode_compact_peers6(added6),
+            }
+        )
+        added, _ = extensions.parse_pex_payload(body)
+        self.assertEqual(added, added4[: extensions.PEX_MAX_PEERS])
+
+
+class TestPeerExchange(unittest.TestCase):
+
+    def setUp(self):
+        self.socket = Mock(spec=socket.socket)
+        self.swarm = Swarm([("10.0.0.1", 6881)])
+        self.conn = PeerConnection(
+            self.socket,
+            b"\x00" * 20,
+            b"-PC0001-123456789012",
+            MockStorageManager(),
+            swarm=self.swarm,
+            address=("10.0.0.1", 6881),
+        )
+
+    def test_learns_peers_from_pex(self):
+        body = bcoding.bencode(
+            extensions.build_pex_payload([("10.0.0.7", 7000), ("10.0.0.1", 6881)], [])
+        )
+        self.conn.process_message(extensions.MSG_EXTENDED, bytes([1]) + body)
+        self.assertEqual(list(self.swarm), [("10.0.0.1", 6881), ("10.0.0.7", 7000)])
+
+    def test_extended_handshake_enables_pex(self):
+        body = bcoding.bencode({"m": {"ut_pex": 9}})
+        self.conn.process_message(extensions.MSG_EXTENDED, bytes([0]) + body)
+        self.assertEqual(self.conn.peer_extensions, {"ut_pex": 9})
+
+    def test_sends_only_changes(self):
+        self.conn.peer_extensions = {"ut_pex": 9}
+        self.swarm.mark_connected(("10.0.0.1", 6881))
+        self.swarm.mark_connected(("10.0.0.5", 6885))
+
+        self.conn.send_pex()
+        message = sent_messages(self.socket)[-1]
+        self.assertEqual(message[5], 9)
+        added, dropped = extensions.parse_pex_payload(message[6:])
+        # The peer itself is never advertised back to it
+        self.assertEqual(added, [("10.0.0.5", 6885)])
+        self.assertEqual(dropped, [])
+
+        self.socket.reset_mock()
+        self.conn.send_pex()
+        self.socket.sendall.assert_not_called()
+
+        self.swarm.mark_disconnected(("10.0.0.5", 6885))
+        self.conn.send_pex()
+        added, dropped = extensions.parse_pex_payload(sent_messages(self.socket)[-1][6:])
+        self.assertEqual(added, [])
+        self.assertEqual(dropped, [("10.0.0.5", 6885)])
+
+
+class TestSwarm(unittest.TestCase):
+
+    def test_iteration_sees_peers_added_during_iteration(self):
+        swarm = Swarm([("10.0.0.1", 1)])
+        seen = []
+        for peer in swarm:
+            seen.append(peer)
+            if len(seen) == 1:
+                swarm.extend([("10.0.0.2", 2), ("10.0.0.1", 1)])
+        self.assertEqual(seen, [("10.0.0.1", 1), ("10.0.0.2", 2)])
+
+    def test_ranked_iteration(self):
+        scores = {"10.0.0.1": 1.0, "10.0.0.2": None, "10.0.0.3": 5.0, "10.0.0.4": 3.0}
+        swarm = Swarm([("10.0.0.1", 1), ("10.0.0.2", 2), ("10.0.0.3", 3)])
+        seen = []
+        for peer in swarm.ranked(lambda peer: scores[peer[0]]):
+            seen.append(peer[0])
+            if len(seen) == 1:
+                swarm.add(("10.0.0.4", 4))
+        self.assertEqual(seen, ["10.0.0.3", "10.0.0.4", "10.0.0.1"])
+
+    def test_lowest_ranked_peers_are_forgotten(self):
+        scores = {"10.0.0.1": 1.0, "10.0.0.2": None}
+        swarm = Swarm(max_peers=10, score=lambda peer: scores.get(peer[0], 0.0))
+        swarm.extend([(f"10.0.0.{i}", i) for i in range(1, 11)])
+        swarm.mark_connected(("10.0.0.3", 3))
+        swarm.add(("10.0.0.11", 11))
+        # Down to 90% of the cap: the banned peer, then the oldest of the
+        # lowest score that aren't connected
+        self.assertEqual([peer[1] for peer in swarm], [1, 3, 5, 6, 7, 8, 9, 10, 11])
+        # Room to grow again before the next trim
+        swarm.add(("10.0.0.12", 12))
+        self.assertEqual(len(swarm), 10)
+
+    def test_iteration_survives_forgetting_peers(self):
+        swarm = Swarm([(f"10.0.0.{i}", i) for i in range(1, 11)], max_peers=10)
+        seen = []
+        for peer in swarm:
+            seen.append(peer[1])
+            if len(seen) == 3:
+                # Forgets the oldest, already seen, peers
+                swarm.add(("10.0.0.11", 11))
+        self.assertEqual(seen, list(range(1, 12)))
+
+
+if __name__ == "__main__":
+    unittest.main()
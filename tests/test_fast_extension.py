@@ -0,0 +1,224 @@
+import unittest
+import socket
+import struct
+import threading
+import time
+from unittest.mock import Mock
+
+from src.peer import extensions
+from src.peer.connection import PeerConnection
+from src.peer.seeder import SeederServer
+from tests.test_peer_connection import MockStorageManager
+
+
+def sent_messages(mock_socket):
+    return [call.args[0] for call in mock_socket.sendall.call_args_list]
+
+
+def recv_message(sock):
+    length = struct.unpack(">I", sock.recv(4, socket.MSG_WAITALL))[0]
+    data = sock.recv(length, socket.MSG_WAITALL)
+    return data[0], data[1:]
+
+
+class TestFastHelpers(unittest.TestCase):
+
+    def test_allowed_fast_set_matches_bep6_vector(self):
+        self.assertEqual(
+            extensions.allowed_fast_set("80.4.4.200", b"\xaa" * 20, 1313, 7),
+            [1059, 431, 808, 1217, 287, 376, 1188],
+        )
+        self.assertEqual(
+            extensions.allowed_fast_set("::ffff:80.4.4.200", b"\xaa" * 20, 1313, 9),
+            [1059, 431, 808, 1217, 287, 376, 1188, 353, 508],
+        )
+
+    def test_allowed_fast_set_small_torrent(self):
+        pieces = extensions.allowed_fast_set("10.0.0.1", b"\x01" * 20, 3)
+        self.assertEqual(sorted(pieces), [0, 1, 2])
+
+    def test_availability_messages(self):
+        def bitfield():
+            raise AssertionError("bitfield should not be built")
+
+        self.assertEqual(
+            extensions.build_availability([True] * 4, True, bitfield),
+            struct.pack(">IB", 1, extensions.MSG_HAVE_ALL),
+        )
+        self.assertEqual(
+            extensions.build_availability([False] * 4, True, bitfield),
+            struct.pack(">IB", 1, extensions.MSG_HAVE_NONE),
+        )
+        self.assertEqual(
+            extensions.build_availability([True, False], False, lambda: b"\x80"),
+            struct.pack(">IBB", 2, 5, 0x80),
+        )
+
+
+class TestPeerConnectionFast(unittest.TestCase):
+
+    def setUp(self):
+        self.socket = Mock(spec=socket.socket)
+        self.storage = MockStorageManager(total_pieces=4)
+        self.conn = PeerConnection(
+            self.socket, b"\x00" * 20, b"-PC0001-123456789012", self.storage
+        )
+        self.conn.peer_supports_fast = True
+
+    def test_have_all(self):
+        self.conn.process_message(extensions.MSG_HAVE_ALL, b"")
+        self.assertTrue(all(self.conn.peer_pieces))
+
+    def test_allowed_fast_piece_downloads_while_choked(self):
+        self.conn.process_message(extensions.MSG_HAVE_ALL, b"")
+        self.conn.process_message(extensions.MSG_ALLOWED_FAST, struct.pack(">I", 2))
+        self.assertTrue(self.conn.peer_choking)
+
+        self.conn.request_blocks()
+        self.assertEqual(self.conn.current_piece_index, 2)
+        self.assertEqual(
+            sent_messages(self.socket)[-1], struct.pack(">IBIII", 13, 6, 2, 0, 16384)
+        )
+
+    def test_reject_while_choked_abandons_piece(self):
+        self.conn.peer_choking = False
+        self.conn.process_message(extensions.MSG_HAVE_ALL, b"")
+        self.conn.request_blocks()
+        self.assertEqual(self.conn.pending_request, (0, 0, 16384))
+
+        self.conn.process_message(0, b"")
+        # Fast peers reject explicitly, so the request stays in flight until then
+        self.assertEqual(self.conn.pending_request, (0, 0, 16384))
+
+        self.conn.process_message(
+            extensions.MSG_REJECT_REQUEST, struct.pack(">III", 0, 0, 16384)
+        )
+        self.assertNotIn((0, 0, 16384), self.conn.pending_requests)
+        # Back in the pool for other peers
+        self.assertEqual(self.conn.pool._pieces[0].owners, {})
+
+    def test_choke_without_fast_resumes_on_unchoke(self):
+        self.conn.peer_supports_fast = False
+        self.conn.peer_choking = False
+        self.conn.peer_pieces = [True] * 4
+        self.conn.request_blocks()
+        self.conn.process_message(0, b"")
+        self.assertIsNone(self.conn.pending_request)
+
+        self.socket.reset_mock()
+        self.conn.process_message(1, b"")
+        self.assertEqual(
+            sent_messages(self.socket),
+            [struct.pack(">IBIII", 13, 6, piece, 0, 16384) for piece in range(4)],
+        )
+
+    def test_choke_without_fast_re_requests_pipelined_blocks(self):
+        self.storage.piece_length = 4 * 16384
+        self.conn.peer_supports_fast = False
+        self.conn.peer_choking = False
+        self.conn.peer_pieces = [True] * 4
+        self.conn.request_blocks()
+        self.assertEqual(len(self.conn.pending_requests), 4)
+
+        self.conn.process_message(7, struct.pack(">II", 0, 0) + b"\x00" * 16384)
+        self.conn.process_message(0, b"")
+        self.assertEqual(len(self.conn.pending_requests), 0)
+
+        self.socket.reset_mock()
+        self.conn.process_message(1, b"")
+        self.assertEqual(
+            sent_messages(self.socket),
+            [struct.pack(">IBIII", 13, 6, 0, begin, 16384) for begin in (16384, 32768, 49152)]
+            + [struct.pack(">IBIII", 13, 6, 1, 0, 16384)],
+        )
+
+    def test_suggested_piece_is_requested_first(self):
+        self.conn.peer_choking = False
+        self.conn.process_message(extensions.MSG_HAVE_ALL, b"")
+        self.conn.process_message(extensions.MSG_SUGGEST_PIECE, struct.pack(">I", 3))
+        self.conn.request_blocks()
+        self.assertEqual(self.conn.current_piece_index, 3)
+
+    def test_request_for_missing_piece_is_rejected(self):
+        self.conn.process_message(6, struct.pack(">III", 1, 0, 16384))
+        self.assertEqual(
+            sent_messages(self.socket), [extensions.build_reject(1, 0, 16384)]
+        )
+
+
+class TestSeederFast(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MockStorageManager(total_pieces=4)
+        self.storage.pieces_status = [True, True, True, False]
+        self.seeder = SeederServer(
+            b"\x11" * 20, b"-PC0001-000000000000", self.storage, port=0
+        )
+        self.thread = threading.Thread(target=self.seeder.start, daemon=True)
+        self.thread.start()
+        self.assertTrue(self.seeder.listening.wait(2))
+        self.client = socket.create_connection(("127.0.0.1", self.seeder.port), timeout=2)
+
+    def tearDown(self):
+        self.client.close()
+        self.seeder.stop()
+        self.thread.join(timeout=2)
+
+    def _handshake(self, reserved):
+        self.client.sendall(
+            extensions.build_handshake(b"\x11" * 20, b"-XX0001-000000000000", reserved)
+        )
+        response = self.client.recv(68, socket.MSG_WAITALL)
+        return response[20:28]
+
+    def test_fast_peer_gets_reject_for_missing_piece(self):
+        reserved = self._handshake(extensions.reserved_bytes())
+        self.assertTrue(extensions.supports_fast(reserved))
+        self.assertFalse(extensions.supports_extensions(reserved))
+
+        msg_id, payload = recv_message(self.client)
+        self.assertEqual((msg_id, payload), (5, b"\xe0"))
+        # A 4-piece torrent's allowed_fast set is every piece; we lack piece 3
+        for _ in range(3):
+            self.assertEqual(recv_message(self.client)[0], extensions.MSG_ALLOWED_FAST)
+
+        self.client.sendall(struct.pack(">IB", 1, 2))
+        self.assertEqual(recv_message(self.client), (1, b""))
+
+        self.client.sendall(struct.pack(">IBIII", 13, 6, 3, 0, 16384))
+        self.assertEqual(
+            recv_message(self.client),
+            (extensions.MSG_REJECT_REQUEST, struct.pack(">III", 3, 0, 16384)),
+        )
+
+    def test_choked_peer_request_is_rejected(self):
+        self.storage.pieces_status = [True] * 4
+        self.seeder.choker.upload_slots = 0
+        self._handshake(extensions.reserved_bytes())
+        self.assertEqual(recv_message(self.client), (extensions.MSG_HAVE_ALL, b""))
+        allowed = {
+            struct.unpack(">I", recv_message(self.client)[1])[0] for _ in range(4)
+        }
+        self.assertEqual(allowed, {0, 1, 2, 3})
+
+        # Every piece is allowed fast here, so drop them to test choking
+        for _ in range(100):
+            if self.seeder.choker.peers:
+                break
+            time.sleep(0.01)
+        self.seeder.choker.peers[0].allowed_fast.clear()
+        self.client.sendall(struct.pack(">IB", 1, 2))
+        self.client.sendall(struct.pack(">IBIII", 13, 6, 0, 0, 16384))
+        self.assertEqual(
+            recv_message(self.client),
+            (extensions.MSG_REJECT_REQUEST, struct.pack(">III", 0, 0, 16384)),
+        )
+
+    def test_fast_seed_sends_have_all(self):
+        self.storage.pieces_status = [True] * 4
+        self._handshake(extensions.reserved_bytes())
+        self.assertEqual(recv_message(self.client), (extensions.MSG_HAVE_ALL, b""))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,8 +2,10 @@ import unittest
 import tempfile
 import shutil
 import hashlib
+import os
+import threading
 
-from src.storage.file_manager import StorageManager
+from src.storage.file_manager import CHECK_SKIP, StorageManager
 
 
 def get_piece_hashes(pieces):
@@ -87,6 +89,151 @@ class TestStorageManager(unittest.TestCase):
         sm.write_piece(2, piece2)
         self.assertEqual(sm.read_piece(2, 0, 8), b"abcd1234")
         self.assertTrue(sm.piece_hash_valid(2, piece2))
+        self.assertEqual([sm.piece_size(i) for i in range(3)], [16, 16, 8])
+
+    def test_block_location(self):
+        files = [{"length": 6, "path": ["f1"]}, {"length": 10, "path": ["f2"]}]
+        torrent_info = {
+            "files": files,
+            "name": "parent",
+            "piece length": 8,
+            "pieces": get_piece_hashes([b"a" * 8, b"b" * 8]),
+        }
+        sm = StorageManager(torrent_info, self.tmp_dir)
+        f1, f2 = (f["path"] for f in sm.file_map)
+        self.assertEqual(sm.block_location(0, 0, 6), (f1, 0))
+        self.assertIsNone(sm.block_location(0, 4, 4))
+        self.assertEqual(sm.block_location(0, 6, 2), (f2, 0))
+        self.assertEqual(sm.block_location(1, 2, 6), (f2, 4))
+        self.assertIsNone(sm.block_location(1, 4, 6))
+
+    def test_bytes_left(self):
+        files = [{"length": 6, "path": ["f1"]}, {"length": 6, "path": ["f2"]}]
+        torrent_info = {
+            "files": files,
+            "name": "parent",
+            "piece length": 8,
+            "pieces": get_piece_hashes([b"a" * 8, b"b" * 4]),
+        }
+        sm = StorageManager(torrent_info, self.tmp_dir)
+        self.assertEqual(sm.bytes_left(), 12)
+        sm.mark_piece_completed(0)
+        self.assertEqual(sm.bytes_left(), 4)
+        # Completing a piece twice counts it once
+        sm.mark_piece_completed(0)
+        self.assertEqual((sm.completed_pieces, sm.bytes_left()), (1, 4))
+        sm.mark_piece_completed(1)
+        self.assertEqual((sm.completed_pieces, sm.bytes_completed), (2, 12))
+
+    def test_disk_and_hash_timings(self):
+        torrent_info = {
+            "name": "timed.bin",
+            "length": 8,
+            "piece length": 8,
+            "pieces": get_piece_hashes([b"abcdefgh"]),
+        }
+        sm = StorageManager(torrent_info, self.tmp_dir)
+        # Checking existing data on startup isn't a hash failure
+        self.assertEqual(sm.verify_latency.count, 0)
+        reads = sm.read_latency.count
+
+        sm.write_piece(0, b"abcdefgh")
+        sm.read_piece(0, 0, 8)
+        sm.piece_hash_valid(0, b"abcdefgh")
+        sm.piece_hash_valid(0, b"12345678")
+        self.assertEqual(sm.write_latency.count, 1)
+        self.assertEqual(sm.read_latency.count, reads + 1)
+        verify = sm.verify_latency.snapshot()
+        self.assertEqual((verify["count"], verify["failures"]), (2, 1))
+
+    def _two_files(self):
+        files = [{"length": 6, "path": ["f1"]}, {"length": 10, "path": ["f2"]}]
+        return {
+            "files": files,
+            "name": "parent",
+            "piece length": 8,
+            "pieces": get_piece_hashes([b"abcdefgh", b"ijklmnop"]),
+        }
+
+    def test_files_are_created_on_first_write(self):
+        sm = StorageManager(self._two_files(), self.tmp_dir)
+        f1, f2 = (f["path"] for f in sm.file_map)
+        self.assertFalse(os.path.exists(os.path.dirname(f1)))
+
+        sm.write_piece(1, b"ijklmnop")
+        self.assertFalse(os.path.exists(f1))
+        self.assertEqual(os.path.getsize(f2), 10)
+        sm.write_piece(0, b"abcdefgh")
+        self.assertEqual(sm.read_piece(0, 0, 8), b"abcdefgh")
+
+    def test_empty_files_are_created_on_completion(self):
+        info = self._two_files()
+        info["files"].insert(1, {"length": 0, "path": ["empty"]})
+        sm = StorageManager(info, self.tmp_dir)
+        for index, piece in enumerate((b"abcdefgh", b"ijklmnop")):
+            sm.write_piece(index, piece)
+            sm.mark_piece_completed(index)
+        self.assertTrue(os.path.exists(sm.file_map[1]["path"]))
+
+    def test_only_pieces_with_files_on_disk_are_checked(self):
+        files = [{"length": 8, "path": ["f1"]}, {"length": 8, "path": ["f2"]}]
+        info = self._two_files()
+        info["files"] = files
+        fresh = StorageManager(info, self.tmp_dir)
+        self.assertEqual(fresh.read_latency.count, 0)
+        fresh.write_piece(0, b"abcdefgh")
+
+        sm = StorageManager(info, self.tmp_dir)
+        self.assertEqual(sm.pieces_status, [True, False])
+        # f2, which piece 1 lies in, was never written: nothing to read
+        self.assertEqual(sm.read_latency.count, 1)
+        self.assertFalse(sm.checking)
+
+    def test_skip_check_trusts_resume_data(self):
+        info = self._two_files()
+        first = StorageManager(info, self.tmp_dir)
+        first.write_piece(1, b"ijklmnop")
+        first.mark_piece_completed(1)
+        first.save_resume()
+
+        sm = StorageManager(info, self.tmp_dir, check=CHECK_SKIP)
+        self.assertEqual(sm.pieces_status, [False, True])
+        self.assertEqual(sm.read_latency.count, 0)
+
+    def test_skip_check_ignores_partly_written_files(self):
+        info = self._two_files()
+        # Writing piece 0 creates both files at full length, sparse, so
+        # piece 1 lies in files that exist without having been downloaded
+        StorageManager(info, self.tmp_dir).write_piece(0, b"abcdefgh")
+
+        # Without resume data the pieces are hashed after all
+        sm = StorageManager(info, self.tmp_dir, check=CHECK_SKIP)
+        self.assertEqual(sm.pieces_status, [True, False])
+        self.assertEqual(sm.bytes_left(), 8)
+
+        # Resume data of another torrent isn't trusted either
+        with open(sm.resume_path, "wb") as f:
+            f.write(b"\x00" * 20 + b"\xc0")
+        sm = StorageManager(info, self.tmp_dir, check=CHECK_SKIP)
+        self.assertEqual(sm.pieces_status, [True, False])
+
+    def test_background_check(self):
+        info = self._two_files()
+        first = StorageManager(info, self.tmp_dir)
+        first.write_piece(0, b"abcdefgh")
+        first.write_piece(1, b"ijklmnop")
+
+        sm = StorageManager(info, self.tmp_dir, check="background")
+        self.assertEqual(sm.completed_pieces, 0)
+        sm.check_in_background().join(5)
+        self.assertEqual(sm.pieces_status, [True, True])
+        self.assertFalse(sm.checking)
+
+        stopped = threading.Event()
+        stopped.set()
+        sm = StorageManager(info, self.tmp_dir, check="background")
+        sm.check_in_background(stopped.is_set).join(5)
+        self.assertEqual(sm.completed_pieces, 0)
 
 
 if __name__ == "__main__":
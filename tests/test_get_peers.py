@@ -0,0 +1,126 @@
+import unittest
+import socket
+import struct
+import subprocess
+import sys
+from unittest.mock import Mock, patch
+
+import bcoding
+
+from src.metrics import LatencyStat
+from src.tracker.get_peers import (
+    GetPeers,
+    decode_compact_peers,
+    decode_compact_peers6,
+)
+
+
+def compact6(ip, port):
+    return socket.inet_pton(socket.AF_INET6, ip) + struct.pack("!H", port)
+
+
+class TestCompactPeers(unittest.TestCase):
+
+    def test_decode_compact_peers(self):
+        data = socket.inet_aton("10.0.0.1") + struct.pack("!H", 6881)
+        data += socket.inet_aton("192.168.1.2") + struct.pack("!H", 51413)
+        self.assertEqual(
+            decode_compact_peers(data),
+            [("10.0.0.1", 6881), ("192.168.1.2", 51413)],
+        )
+
+    def test_decode_compact_peers6(self):
+        data = compact6("2001:db8::1", 6881) + compact6("fe80::2", 80)
+        self.assertEqual(
+            decode_compact_peers6(data),
+            [("2001:db8::1", 6881), ("fe80::2", 80)],
+        )
+
+    def test_truncated_entry_is_ignored(self):
+        data = socket.inet_aton("10.0.0.1") + struct.pack("!H", 6881) + b"\x01\x02"
+        self.assertEqual(decode_compact_peers(data), [("10.0.0.1", 6881)])
+        self.assertEqual(decode_compact_peers6(compact6("2001:db8::5", 6881)[:-1]), [])
+
+
+class TestHttpAnnounce(unittest.TestCase):
+
+    def setUp(self):
+        self.parse_result = [
+            ["http://tracker.example/announce"],
+            b"A" * 20,
+            b"-PC0001-123456789012",
+            1024,
+            {},
+        ]
+
+    def _announce(self, tracker_response, ipv6=None, port=6889):
+        response = Mock(status_code=200, content=bcoding.bencode(tracker_response))
+        with patch("src.tracker.get_peers.TorrentFileParser") as parser, \
+                patch("src.tracker.get_peers.local_ipv6_address", return_value=ipv6), \
+                patch("requests.get", return_value=response) as get:
+            parser.return_value.parse.return_value = self.parse_result
+            result = GetPeers("a.torrent", "dest", port=port).peers()
+        return result, get.call_args.kwargs["params"]
+
+    def test_peers_and_peers6_are_merged(self):
+        (peers, info_hash, _), _ = self._announce(
+            {
+                "interval": 1800,
+                "peers": socket.inet_aton("10.0.0.1") + struct.pack("!H", 6881),
+                "peers6": compact6("2001:db8::1", 6882),
+            }
+        )
+        self.assertEqual(peers, [("10.0.0.1", 6881), ("2001:db8::1", 6882)])
+        self.assertEqual(info_hash, b"A" * 20)
+
+    def test_ipv6_only_tracker_response(self):
+        (peers, _, _), _ = self._announce(
+            {"interval": 1800, "peers6": compact6("2001:db8::5", 6881)}
+        )
+        self.assertEqual(peers, [("2001:db8::5", 6881)])
+
+    def test_announced_port_comes_from_listener(self):
+        _, params = self._announce({"interval": 1800, "peers": b""}, port=51413)
+        self.assertEqual(params["port"], 51413)
+
+    def test_ipv6_announce_parameter(self):
+        _, params = self._announce(
+            {"peers": socket.inet_aton("10.0.0.1") + b"\x1a\xe1"}, ipv6="2001:db8::9"
+        )
+        self.assertEqual(params["ipv6"], "2001:db8::9")
+
+        _, params = self._announce({"peers": socket.inet_aton("10.0.0.1") + b"\x1a\xe1"})
+        self.assertNotIn("ipv6", params)
+
+    def test_tracker_response_times_are_recorded(self):
+        latency = LatencyStat()
+        self.parse_result[0] = ["http://down.example/announce", "http://up.example/a"]
+        body = bcoding.bencode({"peers6": compact6("2001:db8::5", 6881)})
+        ok = Mock(status_code=200, content=body)
+        with patch("src.tracker.get_peers.TorrentFileParser") as parser, \
+                patch("src.tracker.get_peers.local_ipv6_address", return_value=None), \
+                patch("requests.get",
+                      side_effect=[OSError("refused"), ok]):
+            parser.return_value.parse.return_value = self.parse_result
+            peers, _, _ = GetPeers("a.torrent", "dest", latency=latency).peers()
+        self.assertEqual(peers, [("2001:db8::5", 6881)])
+        self.assertEqual((latency.count, latency.failures), (2, 1))
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_startup_does_not_import_requests(self):
+        # Only what importing the client adds counts; site may load more
+        code = (
+            "import sys; before = set(sys.modules); import src.cli.main; "
+            "loaded = set(sys.modules) - before; "
+            "print(sorted({'requests', 'http.server', 'ctypes'} & loaded))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import json
+import threading
+import unittest
+import urllib.request
+from unittest.mock import Mock
+
+from src import metrics
+from src.metrics import LatencyStat, MetricsServer
+
+
+def sample_snapshot():
+    stat = {"count": 4, "failures": 1, "total": 0.5, "max": 0.25, "mean": 0.125}
+    return {
+        "process": {
+            "threads": 7,
+            "half_open": 2,
+            "incoming_connections": 3,
+            "piece_cache": {
+                "hits": 9,
+                "misses": 1,
+                "hit_rate": 0.9,
+                "pieces": 2,
+                "bytes": 1024,
+            },
+        },
+        "session": {},
+        "torrents": [
+            {
+                "id": 1,
+                "source": 'a "b".torrent',
+                "status": "active",
+                "download_rate": 2048.0,
+                "upload_rate": 0.0,
+                "bytes_left": 100,
+                "peers": 1,
+                "requests_in_flight": 5,
+                "verify": stat,
+                "tracker": stat,
+                "peer_list": [
+                    {
+                        "address": "10.0.0.1:6881",
+                        "direction": "out",
+                        "download_rate": 2048.0,
+                        "upload_rate": 0.0,
+                        "in_flight": 5,
+                    }
+                ],
+            },
+            # Still queued: nothing measured yet
+            {"id": 2, "source": "c.torrent", "status": "queued", "peer_list": []},
+        ],
+    }
+
+
+class TestLatencyStat(unittest.TestCase):
+
+    def test_observe_and_time(self):
+        stat = LatencyStat()
+        stat.observe(0.2)
+        stat.observe(0.4, failed=True)
+        with stat.time():
+            pass
+        snapshot = stat.snapshot()
+        self.assertEqual((snapshot["count"], snapshot["failures"]), (3, 1))
+        self.assertAlmostEqual(snapshot["max"], 0.4)
+        self.assertAlmostEqual(snapshot["mean"], snapshot["total"] / 3)
+
+
+class TestPrometheus(unittest.TestCase):
+
+    def setUp(self):
+        self.text = metrics.prometheus(sample_snapshot())
+        self.lines = self.text.splitlines()
+
+    def test_process_metrics(self):
+        self.assertIn("bittorrent_threads 7", self.lines)
+        self.assertIn("bittorrent_piece_cache_hit_ratio 0.9", self.lines)
+        self.assertIn("# TYPE bittorrent_piece_cache_hits_total counter", self.lines)
+
+    def test_torrent_and_peer_metrics(self):
+        self.assertIn('bittorrent_download_rate_bytes{torrent="1"} 2048.0', self.lines)
+        self.assertIn('bittorrent_piece_verify_seconds_count{torrent="1"} 4', self.lines)
+        self.assertIn('bittorrent_piece_verify_seconds_sum{torrent="1"} 0.5', self.lines)
+        self.assertIn('bittorrent_hash_failures_total{torrent="1"} 1', self.lines)
+        self.assertIn(
+            'bittorrent_peer_requests_in_flight'
+            '{torrent="1",peer="10.0.0.1:6881",direction="out"} 5',
+            self.lines,
+        )
+        # Figures a queued torrent doesn't have yet are left out
+        self.assertNotIn('bittorrent_download_rate_bytes{torrent="2"}', self.text)
+
+    def test_labels_are_escaped(self):
+        self.assertIn('source="a \\"b\\".torrent"', self.text)
+
+    def test_stage_histograms(self):
+        snapshot = sample_snapshot()
+        buckets = [0] * 22
+        buckets[0], buckets[3], buckets[-1] = 2, 1, 1
+        snapshot["profile"] = {
+            "hash": {"count": 4, "total": 2.5, "max": 2.0, "buckets": buckets}
+        }
+        lines = metrics.prometheus(snapshot).splitlines()
+        self.assertIn("# TYPE bittorrent_stage_seconds histogram", lines)
+        self.assertIn('bittorrent_stage_seconds_bucket{stage="hash",le="1e-06"} 2', lines)
+        self.assertIn('bittorrent_stage_seconds_bucket{stage="hash",le="8e-06"} 3', lines)
+        self.assertIn('bittorrent_stage_seconds_bucket{stage="hash",le="+Inf"} 4', lines)
+        self.assertIn('bittorrent_stage_seconds_count{stage="hash"} 4', lines)
+
+    def test_each_metric_is_declared_once(self):
+        types = [line for line in self.lines if line.startswith("# TYPE")]
+        self.assertEqual(len(types), len(set(types)))
+
+
+class TestMetricsServer(unittest.TestCase):
+
+    def test_serves_both_formats(self):
+        session = Mock(torrents=[], connector=Mock(half_open=0))
+        session.stats.return_value = {"torrents": 0}
+        server = MetricsServer(session, port=0)
+        thread = threading.Thread(target=server.start, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 2)
+        self.addCleanup(server.stop)
+        while server.server is None and thread.is_alive():
+            thread.join(0.01)
+        base = f"http://127.0.0.1:{server.port}"
+
+        with urllib.request.urlopen(f"{base}/metrics", timeout=5) as response:
+            self.assertIn(b"bittorrent_threads", response.read())
+        with urllib.request.urlopen(f"{base}/metrics.json", timeout=5) as response:
+            self.assertEqual(json.load(response)["session"], {"torrents": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import json
+import shutil
+import tempfile
+import time
+
+from src.peer.peer_cache import MAX_FAILURES, PeerCache
+
+
+class TestPeerCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.info_hash = b"\xab" * 20
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _cache(self):
+        return PeerCache(self.info_hash, cache_dir=self.tmp_dir)
+
+    def test_empty_cache(self):
+        self.assertEqual(self._cache().best_peers(), [])
+
+    def test_fastest_peers_first(self):
+        cache = self._cache()
+        cache.record_success(("10.0.0.1", 1), 1_000, 1.0)
+        cache.record_success(("10.0.0.2", 2), 50_000, 1.0)
+        cache.record_success(("10.0.0.3", 3), 0, 1.0)
+        self.assertEqual(
+            cache.best_peers(),
+            [("10.0.0.2", 2), ("10.0.0.1", 1), ("10.0.0.3", 3)],
+        )
+
+    def test_persists_across_instances(self):
+        cache = self._cache()
+        cache.record_success(("10.0.0.1", 6881), 10_000, 2.0)
+        cache.save()
+
+        reloaded = self._cache()
+        self.assertEqual(reloaded.best_peers(), [("10.0.0.1", 6881)])
+        self.assertAlmostEqual(reloaded.entries[("10.0.0.1", 6881)]["rate"], 5_000)
+
+    def test_rate_is_smoothed(self):
+        cache = self._cache()
+        cache.record_success(("10.0.0.1", 1), 1_000, 1.0)
+        cache.record_success(("10.0.0.1", 1), 3_000, 1.0)
+        self.assertAlmostEqual(cache.entries[("10.0.0.1", 1)]["rate"], 2_000)
+
+    def test_failing_peers_are_skipped_until_they_succeed(self):
+        cache = self._cache()
+        peer = ("10.0.0.1", 1)
+        cache.record_success(peer, 1_000, 1.0)
+        for _ in range(MAX_FAILURES):
+            cache.record_failure(peer)
+        self.assertEqual(cache.best_peers(), [])
+
+        cache.record_success(peer, 1_000, 1.0)
+        self.assertEqual(cache.best_peers(), [peer])
+
+    def test_stale_entries_are_dropped_on_load(self):
+        cache = self._cache()
+        with open(cache.path, "w") as fh:
+            json.dump(
+                {
+                    "peers": [
+                        {"ip": "10.0.0.1", "port": 1, "last_seen": 0, "rate": 1, "failures": 0},
+                        {"ip": "10.0.0.2", "port": 2, "last_seen": time.time(), "rate": 1, "failures": 0},
+                    ]
+                },
+                fh,
+            )
+        self.assertEqual(self._cache().best_peers(), [("10.0.0.2", 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
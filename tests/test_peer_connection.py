@@ -3,9 +3,17 @@ import struct
 import socket
 import threading
 import hashlib
+import os
+import tempfile
+from collections import deque
 from unittest.mock import Mock, MagicMock, patch
 
+from src import state
+from src.peer import connection as connection_module
 from src.peer.connection import PeerConnection
+from src.peer.piece_picker import BlockPool
+from src.peer.rate import RateMeter
+from src.peer.ratelimit import RateLimits
 
 
 class MockStorageManager:
@@ -31,6 +39,12 @@ class MockStorageManager:
                 bitfield[byte_index] |= 1 << (7 - bit_index)
         return bytes(bitfield)
 
+    def piece_size(self, piece_index):
+        return self.piece_length
+
+    def block_location(self, piece_index, begin, length):
+        return None
+
     def read_piece(self, piece_index, offset, length):
         return b"\x00" * length
 
@@ -62,11 +76,21 @@ class TestPeerConnectionMessages(unittest.TestCase):
             self.conn.am_interested = False
             self.conn.peer_choking = True
             self.conn.peer_pieces = [False] * self.storage.total_pieces
-            self.conn.current_piece_index = -1
-            self.conn.current_piece_buffer = bytearray()
-            self.conn.current_piece_downloaded = 0
             self.conn.block_size = 16384
             self.conn._lock = threading.Lock()
+            self.conn.peer_supports_fast = False
+            self.conn.allowed_fast = set()
+            self.conn.suggested_pieces = []
+            self.conn.pending_requests = deque()
+            self.conn.pool = BlockPool(self.storage)
+            self.conn.limits = None
+            self.conn._request_times = {}
+            self.conn._deadlines = {}
+            self.conn._refused = set()
+            self.conn._waiting_since = None
+            self.conn.latency = None
+            self.conn.download_meter = RateMeter()
+            self.conn._send_lock = threading.Lock()
 
     def test_process_choke_message(self):
         self.conn.peer_choking = False
@@ -162,5 +186,180 @@ class TestBitfieldEncoding(unittest.TestCase):
         self.assertEqual(bitfield, bytes([0xA1]))
 
 
+class TestRequestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.socket = Mock(spec=socket.socket)
+        self.storage = MockStorageManager(total_pieces=2, piece_length=16 * 16384)
+        self.conn = PeerConnection(
+            self.socket, b"\x00" * 20, b"-PC0001-123456789012", self.storage
+        )
+        self.conn.peer_choking = False
+        self.conn.peer_pieces = [True, True]
+
+    def _requests(self):
+        return [
+            call.args[0] for call in self.socket.sendall.call_args_list
+            if call.args[0][4] == 6
+        ]
+
+    def test_initial_pipeline(self):
+        self.conn.request_blocks()
+        self.assertEqual(len(self._requests()), 4)
+        self.assertEqual(
+            list(self.conn.pending_requests),
+            [(0, begin, 16384) for begin in range(0, 4 * 16384, 16384)],
+        )
+
+    def test_pipeline_grows_with_rate_and_piece_completes(self):
+        self.conn.download_meter.update(10 * 1024 * 1024)
+        self.assertEqual(self.conn.pipeline_depth, 64)
+        self.conn.request_blocks()
+        # The pipeline runs on into the next piece
+        self.assertEqual(len(self.conn.pending_requests), 32)
+
+        for begin in range(0, 16 * 16384, 16384):
+            self.conn.process_piece(struct.pack(">II", 0, begin) + b"\x00" * 16384)
+        self.assertTrue(self.storage.pieces_status[0])
+        self.assertEqual(self.conn.current_piece_index, 1)
+
+    def test_throttled_peer_gets_short_pipeline(self):
+        self.conn.limits = RateLimits(download=16384)
+        self.conn.download_meter.update(10 * 1024 * 1024)
+        self.assertEqual(self.conn.pipeline_depth, 2)
+
+    def test_download_is_throttled(self):
+        self.conn.limits = RateLimits(download=16384)
+        self.conn.request_blocks()
+        with patch.object(self.conn, "_throttle") as throttle:
+            for begin in (0, 16384, 32768):
+                self.conn.process_piece(struct.pack(">II", 0, begin) + b"\x00" * 16384)
+        delays = [call.args[0] for call in throttle.call_args_list]
+        self.assertEqual(delays[:2], [0.0, 0.0])
+        self.assertAlmostEqual(delays[2], 1.0, places=1)
+
+
+class TestBlockTimeouts(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MockStorageManager(total_pieces=1, piece_length=4 * 16384)
+        self.pool = BlockPool(self.storage)
+        self.slow_socket = Mock(spec=socket.socket)
+        self.fast_socket = Mock(spec=socket.socket)
+        self.slow = self._connection(self.slow_socket, ("10.0.0.1", 6881))
+        self.fast = self._connection(self.fast_socket, ("10.0.0.2", 6881))
+
+    def _connection(self, sock, address):
+        conn = PeerConnection(
+            sock, b"\x00" * 20, b"-PC0001-123456789012", self.storage,
+            address=address, pool=self.pool,
+        )
+        conn.peer_choking = False
+        conn.peer_pieces = [True]
+        return conn
+
+    def test_block_timeout_follows_latency_and_rate(self):
+        self.assertEqual(self.slow.block_timeout, connection_module.INITIAL_BLOCK_TIMEOUT)
+        self.slow.latency = 0.1
+        self.assertEqual(self.slow.block_timeout, connection_module.MIN_BLOCK_TIMEOUT)
+        self.slow.latency = 4.0
+        self.assertEqual(self.slow.block_timeout, 12.0)
+        self.slow.latency = 0.1
+        # 4 blocks in flight at 4 KiB/s take 16 s to arrive
+        self.slow.download_meter.update(4096 * 20)
+        self.assertAlmostEqual(self.slow.block_timeout, 48, places=0)
+
+    def test_stalled_blocks_move_to_another_peer(self):
+        self.slow.request_blocks()
+        self.assertEqual(len(self.slow.pending_requests), 4)
+        self.fast.request_blocks()
+        self.assertEqual(len(self.fast.pending_requests), 0)
+
+        for request in self.slow.pending_requests:
+            self.slow._deadlines[request] = 0
+        self.slow_socket.reset_mock()
+        self.slow.request_blocks()
+        sent = [call.args[0] for call in self.slow_socket.sendall.call_args_list]
+        self.assertEqual(
+            [msg for msg in sent if msg[4] == 8],
+            [struct.pack(">IBIII", 13, 8, 0, begin, 16384) for begin in range(0, 65536, 16384)],
+        )
+
+        self.fast.request_blocks()
+        self.assertEqual(len(self.fast.pending_requests), 4)
+        for begin in range(0, 65536, 16384):
+            self.fast.process_piece(struct.pack(">II", 0, begin) + b"\x00" * 16384)
+        self.assertTrue(self.storage.pieces_status[0])
+
+    def test_late_block_still_counts(self):
+        self.slow.request_blocks()
+        request = self.slow.pending_requests[0]
+        self.slow._deadlines[request] = 0
+        self.slow._expire_requests()
+        self.slow.process_piece(struct.pack(">II", 0, 0) + b"\x00" * 16384)
+        self.assertEqual(self.slow.downloaded, 16384)
+
+    def test_disconnect_releases_blocks(self):
+        self.slow.request_blocks()
+        self.slow._release_requests()
+        self.fast.request_blocks()
+        self.assertEqual(len(self.fast.pending_requests), 4)
+
+
+class TestStopControl(unittest.TestCase):
+
+    def test_stop_interrupts_a_blocked_receive(self):
+        local, remote = socket.socketpair()
+        self.addCleanup(remote.close)
+        control = state.Control()
+        conn = PeerConnection(
+            local, b"\x00" * 20, b"-PC0001-123456789012", MockStorageManager(),
+            control=control,
+        )
+        conn.start()
+        # The connection waits for the peer's handshake, which never comes
+        remote.recv(68)
+        control.stop()
+        conn.join(2)
+        self.assertFalse(conn.is_alive())
+
+
+class TestSendPiece(unittest.TestCase):
+
+    def setUp(self):
+        self.local, self.remote = socket.socketpair()
+        self.addCleanup(self.local.close)
+        self.addCleanup(self.remote.close)
+        self.storage = MockStorageManager(total_pieces=2, piece_length=32)
+        self.conn = PeerConnection(
+            self.local, b"\x00" * 20, b"-PC0001-123456789012", self.storage
+        )
+
+    @unittest.skipUnless(hasattr(os, "sendfile"), "os.sendfile not available")
+    def test_block_within_a_file_is_sent_with_sendfile(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        os.write(fd, bytes(range(64)))
+        os.close(fd)
+        self.storage.block_location = lambda index, begin, length: (
+            path, index * 32 + begin
+        )
+
+        with patch("os.sendfile", wraps=os.sendfile) as sendfile:
+            self.conn.send_piece(1, 8, 16)
+        sendfile.assert_called()
+        self.assertEqual(
+            self.remote.recv(13 + 16),
+            struct.pack(">IBII", 25, 7, 1, 8) + bytes(range(40, 56)),
+        )
+        self.assertEqual(self.conn.upload_meter.total, 16)
+
+    def test_block_spanning_files_is_buffered(self):
+        self.conn.send_piece(0, 0, 16)
+        self.assertEqual(
+            self.remote.recv(13 + 16), struct.pack(">IBII", 25, 7, 0, 0) + b"\x00" * 16
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+from src.storage.piece_cache import PieceCache
+from tests.test_peer_connection import MockStorageManager
+
+
+class CountingStorageManager(MockStorageManager):
+
+    def __init__(self, total_pieces=4, piece_length=64):
+        super().__init__(total_pieces, piece_length)
+        self.reads = []
+
+    def read_piece(self, piece_index, offset, length):
+        self.reads.append((piece_index, offset, length))
+        return bytes((piece_index + i) % 256 for i in range(offset, offset + length))
+
+
+class TestPieceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = CountingStorageManager()
+
+    def test_first_block_reads_whole_piece(self):
+        cache = PieceCache()
+        block = cache.read_block(self.storage, 1, 16, 16)
+        self.assertEqual(block, bytes(range(17, 33)))
+        self.assertEqual(self.storage.reads, [(1, 0, 64)])
+
+        for begin in (0, 32, 48):
+            cache.read_block(self.storage, 1, begin, 16)
+        self.assertEqual(len(self.storage.reads), 1)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        self.assertEqual(cache.hit_rate, 0.75)
+
+    def test_least_recently_used_piece_is_evicted(self):
+        cache = PieceCache(max_bytes=128)
+        cache.read_block(self.storage, 0, 0, 16)
+        cache.read_block(self.storage, 1, 0, 16)
+        cache.read_block(self.storage, 0, 16, 16)
+        cache.read_block(self.storage, 2, 0, 16)
+        self.assertEqual(cache.size, 128)
+
+        self.storage.reads.clear()
+        cache.read_block(self.storage, 0, 0, 16)
+        self.assertEqual(self.storage.reads, [])
+        cache.read_block(self.storage, 1, 0, 16)
+        self.assertEqual(self.storage.reads, [(1, 0, 64)])
+
+    def test_short_read_is_not_cached(self):
+        cache = PieceCache()
+        self.storage.read_piece = lambda index, offset, length: b"\x01" * 10
+        self.assertEqual(cache.read_block(self.storage, 0, 0, 16), b"\x01" * 10)
+        self.assertEqual(cache.stats()["pieces"], 0)
+
+    def test_torrents_share_the_budget_and_discard_separately(self):
+        other = CountingStorageManager()
+        cache = PieceCache()
+        cache.read_block(self.storage, 0, 0, 16)
+        cache.read_block(other, 0, 0, 16)
+        self.assertEqual(cache.stats()["pieces"], 2)
+
+        cache.discard(self.storage)
+        self.assertEqual(cache.stats()["pieces"], 1)
+        self.assertEqual(cache.size, 64)
+        cache.read_block(other, 0, 0, 16)
+        self.assertEqual(len(other.reads), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
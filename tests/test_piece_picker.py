@@ -0,0 +1,120 @@
+import time
+import unittest
+
+from src.peer.piece_picker import RETAKE_AFTER, BlockPool
+from tests.test_peer_connection import MockStorageManager
+
+
+class Conn:
+
+    def __init__(self, address):
+        self.address = address
+
+
+def everything(piece_index):
+    return True
+
+
+class TestBlockPool(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MockStorageManager(total_pieces=3, piece_length=4 * 16384)
+        self.pool = BlockPool(self.storage)
+        self.a = Conn(("10.0.0.1", 6881))
+        self.b = Conn(("10.0.0.2", 6881))
+        self.later = time.monotonic() + 60
+
+    def test_blocks_are_handed_out_once(self):
+        first = self.pool.pick(self.a, everything, 6, self.later)
+        second = self.pool.pick(self.b, everything, 6, self.later)
+        self.assertEqual(
+            first,
+            [(0, begin, 16384) for begin in range(0, 4 * 16384, 16384)]
+            + [(1, 0, 16384), (1, 16384, 16384)],
+        )
+        self.assertEqual(second[0], (1, 32768, 16384))
+        self.assertTrue(set(first).isdisjoint(second))
+
+    def test_only_pieces_the_peer_has(self):
+        requests = self.pool.pick(self.a, lambda i: i == 2, 10, self.later)
+        self.assertEqual({r[0] for r in requests}, {2})
+
+    def test_preferred_and_allowed(self):
+        requests = self.pool.pick(self.a, everything, 1, self.later, preferred=[2])
+        self.assertEqual(requests, [(2, 0, 16384)])
+        requests = self.pool.pick(self.b, everything, 10, self.later, allowed=[1])
+        self.assertEqual({r[0] for r in requests}, {1})
+
+    def test_timed_out_block_goes_to_another_peer(self):
+        self.pool.pick(self.a, everything, 1, time.monotonic() - 1)
+        requests = self.pool.pick(self.b, everything, 1, self.later)
+        self.assertEqual(requests, [(0, 0, 16384)])
+
+    def test_own_timed_out_block_is_retried_last(self):
+        self.storage.total_pieces = 1
+        self.pool.pick(self.a, everything, 1, time.monotonic() - 1)
+        # Other peers get the first chance at it
+        self.assertEqual(
+            self.pool.pick(self.a, everything, 4, self.later),
+            [(0, 16384, 16384), (0, 32768, 16384), (0, 49152, 16384)],
+        )
+        self.pool.finish(0)
+
+        self.pool.pick(self.a, everything, 1, time.monotonic() - RETAKE_AFTER - 1)
+        requests = self.pool.pick(self.a, everything, 4, self.later)
+        self.assertEqual(
+            requests,
+            [(0, 16384, 16384), (0, 32768, 16384), (0, 49152, 16384), (0, 0, 16384)],
+        )
+
+    def test_released_blocks_are_available(self):
+        requests = self.pool.pick(self.a, everything, 2, self.later)
+        self.pool.release(self.b, requests)
+        self.assertNotIn((0, 0, 16384), self.pool.pick(self.b, everything, 2, self.later))
+        self.pool.release(self.a, requests)
+        self.assertEqual(self.pool.pick(self.b, everything, 2, self.later), requests)
+
+    def test_piece_completes_across_peers(self):
+        self.storage.total_pieces = 1
+        self.pool.pick(self.a, everything, 2, self.later)
+        self.pool.pick(self.b, everything, 2, self.later)
+        for begin, conn in ((0, self.a), (16384, self.a), (32768, self.b)):
+            accepted, data = self.pool.received(conn, 0, begin, b"\x01" * 16384)
+            self.assertTrue(accepted)
+            self.assertIsNone(data)
+        # Duplicates and blocks of pieces not in progress are ignored
+        self.assertEqual(self.pool.received(self.b, 0, 0, b"\x02" * 16384), (False, None))
+        self.assertEqual(self.pool.received(self.b, 2, 0, b"\x02" * 16384), (False, None))
+
+        accepted, data = self.pool.received(self.b, 0, 49152, b"\x01" * 16384)
+        self.assertTrue(accepted)
+        self.assertEqual(data, b"\x01" * 4 * 16384)
+        self.assertEqual(self.pool.sources(0), {self.a.address, self.b.address})
+        self.assertEqual(self.pool.pick(self.a, everything, 4, self.later), [])
+
+        # A failed piece starts over
+        self.pool.finish(0)
+        self.assertEqual(len(self.pool.pick(self.a, everything, 4, self.later)), 4)
+
+    def test_completed_pieces_are_skipped(self):
+        self.storage.pieces_status[0] = True
+        requests = self.pool.pick(self.a, everything, 1, self.later)
+        self.assertEqual(requests, [(1, 0, 16384)])
+
+    def test_missing_pieces_are_tracked(self):
+        self.storage.pieces_status[0] = True
+        self.pool.pick(self.a, lambda i: i < 2, 4, self.later)
+        # Piece 0 was done elsewhere and piece 1 is in progress
+        self.assertEqual(self.pool._missing, [2])
+
+        self.storage.pieces_status[1] = True
+        self.pool.finish(1)
+        self.assertEqual(self.pool._missing, [2])
+        self.pool.pick(self.a, everything, 4, self.later)
+        self.pool.finish(2)
+        # Failed its hash check
+        self.assertEqual(self.pool._missing, [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
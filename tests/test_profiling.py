@@ -0,0 +1,47 @@
+import unittest
+
+from src import profiling
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        profiling.disable()
+        profiling.reset()
+        self.addCleanup(profiling.disable)
+        self.addCleanup(profiling.reset)
+
+    def test_disabled_hooks_record_nothing(self):
+        started = profiling.start()
+        self.assertIsNone(started)
+        profiling.record(profiling.HASH, started)
+        self.assertEqual(profiling.snapshot(), {})
+
+    def test_enabled_hooks_fill_histograms(self):
+        profiling.enable()
+        for _ in range(3):
+            profiling.record(profiling.DISK_WRITE, profiling.start())
+        stats = profiling.snapshot()[profiling.DISK_WRITE]
+        self.assertEqual(stats["count"], 3)
+        self.assertEqual(sum(stats["buckets"]), 3)
+        self.assertLessEqual(stats["max"], stats["total"])
+
+    def test_bucket_bounds(self):
+        histogram = profiling.Histogram()
+        histogram.add(0.5e-6)
+        histogram.add(1e-6)
+        histogram.add(3e-6)
+        histogram.add(10.0)
+        self.assertEqual(histogram.counts[0], 2)
+        self.assertEqual(histogram.counts[2], 1)
+        self.assertEqual(histogram.counts[-1], 1)
+
+    def test_dump(self):
+        self.assertEqual(profiling.dump(), "No profiling samples")
+        profiling.enable()
+        profiling.record(profiling.SEND, profiling.start())
+        self.assertTrue(profiling.dump().startswith("send: 1 samples"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import io
+import unittest
+from unittest.mock import Mock
+
+from src.progress import display
+from src.progress.display import ProgressDisplay
+
+
+def downloading():
+    return {
+        "id": 1,
+        "source": "/tmp/ubuntu.torrent",
+        "status": "active",
+        "state": "downloading",
+        "paused": False,
+        "name": "ubuntu.iso",
+        "size": 4 << 20,
+        "pieces": 2,
+        "total_pieces": 4,
+        "bytes_left": 2 << 20,
+        "download_rate": 1 << 20,
+        "upload_rate": 512.0,
+        "peers": 3,
+        "uploaded": 1 << 20,
+        "downloaded": 2 << 20,
+    }
+
+
+class TTY(io.StringIO):
+    def isatty(self):
+        return True
+
+
+class TestFormatting(unittest.TestCase):
+
+    def test_torrent_line(self):
+        line = display.format_torrent(downloading())
+        self.assertTrue(line.startswith("ubuntu.iso"))
+        for part in ("50.00%", "1.0 MiB/s", "512 B/s", "ETA     2s", "peers   3"):
+            self.assertIn(part, line)
+        self.assertIn("ratio 0.50  downloading", line)
+
+    def test_queued_torrent(self):
+        stats = {"source": "/tmp/debian.torrent", "status": "queued"}
+        self.assertEqual(display.format_torrent(stats).split(), ["debian", "queued"])
+
+    def test_eta_and_ratio(self):
+        self.assertIsNone(display.eta({"bytes_left": 10, "download_rate": 0}))
+        self.assertIsNone(display.eta({"bytes_left": None}))
+        self.assertEqual(display.eta({"bytes_left": 0}), 0.0)
+        self.assertEqual(display.format_eta(3725), "1h02m")
+        self.assertEqual(display.format_eta(125), "2m05s")
+        # Seeding data already on disk: measured against what is held
+        seeding = {"uploaded": 200, "downloaded": 0, "size": 100, "bytes_left": 0}
+        self.assertEqual(display.ratio(seeding), 2.0)
+        self.assertEqual(display.ratio({}), 0.0)
+
+
+class TestProgressDisplay(unittest.TestCase):
+
+    def setUp(self):
+        self.entries = [Mock(), Mock()]
+        self.entries[0].stats.return_value = downloading()
+        self.entries[1].stats.return_value = {"source": "b.torrent", "status": "queued"}
+        self.session = Mock(torrents=self.entries)
+
+    def test_terminal_redraws_in_place(self):
+        stream = TTY()
+        progress = ProgressDisplay(self.session, stream)
+        self.assertEqual(progress.interval, display.REFRESH_INTERVAL)
+        progress.render()
+        progress.render()
+        output = stream.getvalue()
+        # The second frame moves back over the two lines of the first
+        self.assertEqual(output.count("\x1b[2F"), 1)
+        self.assertEqual(output.count("ubuntu.iso"), 2)
+
+    def test_messages_go_above_the_torrents(self):
+        stream = TTY()
+        progress = ProgressDisplay(self.session, stream)
+        progress.render()
+        progress.message("⏸ Paused")
+        progress.render()
+        frame = stream.getvalue().split("\x1b[2F")[1]
+        # Written once, above the redrawn lines, and not gone back over
+        self.assertTrue(frame.startswith("\x1b[J⏸ Paused\nubuntu.iso"))
+        progress.render()
+        self.assertEqual(stream.getvalue().count("Paused"), 1)
+        self.assertEqual(stream.getvalue().count("\x1b[2F"), 2)
+
+    def test_without_a_terminal_lines_are_logged(self):
+        stream = io.StringIO()
+        progress = ProgressDisplay(self.session, stream, log_interval=10)
+        self.assertEqual(progress.interval, 10)
+        progress.render()
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertNotIn("\x1b", stream.getvalue())
+
+    def test_stop_renders_a_last_time(self):
+        stream = io.StringIO()
+        progress = ProgressDisplay(self.session, stream, log_interval=60)
+        progress.stop()
+        progress.start()
+        self.assertIn("ubuntu.iso", stream.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
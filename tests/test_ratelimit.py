@@ -0,0 +1,105 @@
+import unittest
+from unittest.mock import patch
+
+from src.peer.ratelimit import MIN_BURST, RateLimits, TokenBucket
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = patch("src.peer.ratelimit.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unlimited_never_waits(self):
+        bucket = TokenBucket()
+        self.assertEqual(bucket.reserve(10**9), 0.0)
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=100_000)
+        self.assertEqual(bucket.reserve(100_000), 0.0)
+        self.assertAlmostEqual(bucket.reserve(50_000), 0.5)
+        # The debt is paid off by refilling at the configured rate
+        self.clock.now += 0.5
+        self.assertEqual(bucket.reserve(0), 0.0)
+        self.clock.now += 0.25
+        self.assertAlmostEqual(bucket.reserve(50_000), 0.25)
+
+    def test_small_rates_still_pass_a_block(self):
+        bucket = TokenBucket(rate=1000)
+        self.assertEqual(bucket.burst, MIN_BURST)
+        self.assertEqual(bucket.reserve(16384), 0.0)
+
+    def test_rate_change_at_runtime(self):
+        bucket = TokenBucket(rate=100_000)
+        bucket.reserve(150_000)
+        bucket.set_rate(200_000)
+        self.assertAlmostEqual(bucket.reserve(0), 0.25)
+        bucket.set_rate(0)
+        self.assertEqual(bucket.reserve(10**6), 0.0)
+
+
+class TestRateLimits(unittest.TestCase):
+
+    def setUp(self):
+        clock = FakeClock()
+        patcher = patch("src.peer.ratelimit.time.monotonic", clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tightest_level_sets_the_wait(self):
+        process = RateLimits(upload=1_000_000)
+        torrent = process.child(upload=100_000)
+        peer = torrent.peer()
+        peer.reserve_upload(100_000)
+        self.assertAlmostEqual(peer.reserve_upload(50_000), 0.5)
+        self.assertEqual(peer.upload_limit(), 100_000)
+        self.assertEqual(peer.download_limit(), 0)
+
+    def test_peers_share_their_torrent_bucket(self):
+        torrent = RateLimits(download=100_000)
+        first, second = torrent.peer(), torrent.peer()
+        first.reserve_download(100_000)
+        self.assertAlmostEqual(second.reserve_download(100_000), 1.0)
+
+    def test_every_level_counts_the_bytes(self):
+        process = RateLimits()
+        torrent = process.child(download=100_000)
+        torrent.peer().reserve_download(1000)
+        torrent.peer().reserve_download(500)
+        self.assertEqual((process.download.total, torrent.download.total), (1500, 1500))
+        self.assertEqual(torrent.upload.total, 0)
+
+    def test_peer_defaults_are_inherited(self):
+        process = RateLimits()
+        process.peer_upload = 50_000
+        peer = process.child().peer()
+        self.assertEqual(peer.upload.rate, 50_000)
+        process.set_limits(upload=10_000)
+        self.assertEqual(peer.upload_limit(), 10_000)
+
+    def test_peer_limits_change_at_runtime(self):
+        process = RateLimits()
+        torrent = process.child()
+        peer = torrent.peer()
+        process.set_peer_limits(upload=20_000, download=30_000)
+        self.assertEqual((peer.upload.rate, peer.download.rate), (20_000, 30_000))
+        self.assertEqual(torrent.peer().upload.rate, 20_000)
+        # A torrent's own change leaves the download limit alone
+        torrent.set_peer_limits(upload=5_000)
+        self.assertEqual((peer.upload.rate, peer.download.rate), (5_000, 30_000))
+        self.assertEqual(process.peer_upload, 20_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
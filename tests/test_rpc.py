@@ -0,0 +1,192 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from src import profiling, rpc
+from src import session as session_module
+from src import state
+from src.peer.swarm import Swarm
+from src.rpc import RPCServer
+from src.session import Session
+
+
+class FakeLoader:
+    def __init__(self, source, destination, **kwargs):
+        self.kwargs = kwargs
+        self.status = "downloading"
+        self.swarm = Swarm()
+        self.max_peers = 0
+        self.done = threading.Event()
+
+    def handshake(self):
+        self.done.wait(5)
+
+    def stop(self):
+        self.done.set()
+
+    def bytes_left(self):
+        return 1000
+
+    def stats(self):
+        return {"status": self.status, "download_rate": 10.0, "upload_rate": 0.0, "peers": 1}
+
+    def peer_stats(self):
+        return [{"address": "10.0.0.1:6881", "direction": "out"}]
+
+
+class TestRPCServer(unittest.TestCase):
+
+    def setUp(self):
+        state.reset()
+        patcher = patch.object(session_module, "HandShakeTCP", FakeLoader)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.torrent = os.path.join(self.tmp.name, "a.torrent")
+        open(self.torrent, "wb").close()
+        self.session = Session()
+        self.addCleanup(self._finish)
+        self.server = RPCServer(self.session, os.path.join(self.tmp.name, "rpc.sock"))
+
+    def _finish(self):
+        for entry in self.session.torrents:
+            if entry.loader is not None:
+                entry.loader.stop()
+                entry.thread.join(5)
+
+    def call(self, method, **params):
+        return self.server.handle(
+            {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+        )
+
+    def test_add_pause_and_list(self):
+        result = self.call("add", source=self.torrent, priority=1)["result"]
+        self.assertEqual((result["id"], result["status"]), (1, "queued"))
+        self.session.schedule()
+
+        self.call("pause", id=1)
+        self.assertTrue(self.session.get(1).control.is_paused())
+        self.call("resume", id=1)
+        self.assertFalse(self.session.get(1).control.is_paused())
+
+        [listed] = self.call("list")["result"]
+        self.assertEqual(listed["priority"], 1)
+        self.assertEqual(listed["state"], "downloading")
+        self.assertEqual(listed["download_rate"], 10.0)
+        self.assertEqual(self.call("peers", id=1)["result"][0]["direction"], "out")
+
+    def test_set_limits_per_torrent_and_global(self):
+        self.call("add", source=self.torrent)
+        result = self.call("set_limits", id=1, download=50000)["result"]
+        self.assertEqual(result["download"], 50000)
+        self.assertEqual(self.session.get(1).limits.download.rate, 50000)
+
+        self.call("set_limits", upload=1000)
+        self.assertEqual(self.session.limits.upload.rate, 1000)
+        result = self.call("set_limits", peer_download=2000)["result"]
+        self.assertEqual(result["peer_download"], 2000)
+        self.assertEqual(self.session.get(1).limits.peer().download.rate, 2000)
+        # Per-torrent limits survive a restart of the torrent
+        self.session.schedule()
+        self.assertIs(
+            self.session.get(1).loader.kwargs["limits"], self.session.get(1).limits
+        )
+
+    def test_remove_and_unknown_torrent(self):
+        self.call("add", source=self.torrent)
+        self.assertTrue(self.call("remove", id=1)["result"])
+        error = self.call("pause", id=1)["error"]
+        self.assertEqual(error["code"], rpc.UNKNOWN_TORRENT)
+
+    def test_errors(self):
+        self.assertEqual(self.call("nope")["error"]["code"], rpc.METHOD_NOT_FOUND)
+        self.assertEqual(
+            self.call("pause", bogus=1)["error"]["code"], rpc.INVALID_PARAMS
+        )
+        self.assertEqual(
+            self.call("add", source="missing.torrent")["error"]["code"],
+            rpc.INVALID_PARAMS,
+        )
+        self.assertEqual(
+            self.server.handle_line(b"{not json")["error"]["code"], rpc.PARSE_ERROR
+        )
+        self.assertEqual(self.server.handle([1])["error"]["code"], rpc.INVALID_REQUEST)
+        self.assertEqual(self.call("remove")["error"]["code"], rpc.INVALID_PARAMS)
+        # A TypeError raised inside a handler is an internal error, and logged
+        with patch.object(self.session, "stats", side_effect=TypeError("bug")):
+            with self.assertLogs("src.rpc", "ERROR"):
+                error = self.call("stats")["error"]
+        self.assertEqual(error["code"], rpc.INTERNAL_ERROR)
+        # Notifications get no response
+        self.assertIsNone(self.server.handle({"method": "list"}))
+
+    def test_profile_switches_stage_timing(self):
+        self.addCleanup(profiling.reset)
+        self.addCleanup(profiling.disable)
+        self.assertTrue(self.call("profile", enable=True)["result"]["enabled"])
+        profiling.record(profiling.HASH, profiling.start())
+        result = self.call("profile", enable=False)["result"]
+        self.assertFalse(result["enabled"])
+        self.assertEqual(result["stages"]["hash"]["count"], 1)
+        self.assertEqual(self.call("profile", reset=True)["result"]["stages"], {})
+
+    def test_shutdown_stops_the_session(self):
+        self.call("shutdown")
+        self.assertTrue(self.session.control.is_stopped())
+
+    def test_requests_over_the_socket(self):
+        thread = threading.Thread(target=self.server.start, daemon=True)
+        thread.start()
+        self.assertTrue(self.server.listening.wait(2))
+        self.assertEqual(os.stat(self.server.path).st_mode & 0o777, 0o600)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(self.server.path)
+            reader = client.makefile("rb")
+            for request_id, method in enumerate(("stats", "list")):
+                request = {"jsonrpc": "2.0", "id": request_id, "method": method}
+                client.sendall(json.dumps(request).encode() + b"\n")
+                response = json.loads(reader.readline())
+                self.assertEqual(response["id"], request_id)
+            self.assertEqual(response["result"], [])
+            reader.close()
+
+        self.server.stop()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.server.path))
+
+    def test_only_stale_sockets_are_replaced(self):
+        path = self.server.path
+        # Left behind by a run that died: nothing listens on it
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        thread = threading.Thread(target=self.server.start, daemon=True)
+        thread.start()
+        self.assertTrue(self.server.listening.wait(2))
+
+        # Still served: a second server must leave it alone
+        other = RPCServer(self.session, path)
+        other.start()
+        self.assertFalse(other.listening.is_set())
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(path)
+        self.server.stop()
+        thread.join(2)
+
+        # Nor is anything that isn't a socket
+        open(path, "w").close()
+        other.start()
+        self.assertFalse(other.listening.is_set())
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["a.torrent", "rpc.sock"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import socket
+import struct
+from unittest.mock import Mock, patch
+
+from src.peer import connection as connection_module
+from src.peer.connection import PeerConnection
+from src.peer.scoreboard import PeerScoreboard
+from tests.test_peer_connection import MockStorageManager
+
+PEER = ("10.0.0.1", 6881)
+
+
+class TestPeerScoreboard(unittest.TestCase):
+
+    def setUp(self):
+        self.scoreboard = PeerScoreboard()
+
+    def test_unknown_peer_is_neutral(self):
+        self.assertEqual(self.scoreboard.score(PEER), 0.0)
+
+    def test_fast_peers_score_higher_and_snubbers_lowest(self):
+        self.scoreboard.record_session(("10.0.0.2", 1), 100_000, 1.0)
+        self.scoreboard.record_session(("10.0.0.3", 1), 10_000, 1.0)
+        self.scoreboard.record_session(("10.0.0.4", 1), 0, 60.0, snubbed=True)
+        scores = [
+            self.scoreboard.score(peer)
+            for peer in (("10.0.0.2", 1), ("10.0.0.3", 1), PEER, ("10.0.0.4", 1))
+        ]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertLess(scores[-1], 0)
+
+    def test_ban_after_repeated_hash_failures(self):
+        self.assertEqual(self.scoreboard.record_hash_failure([PEER]), [])
+        self.assertFalse(self.scoreboard.is_banned(PEER))
+        self.assertEqual(self.scoreboard.record_hash_failure([PEER]), [PEER])
+        # Banned by IP, whatever the port or address form
+        self.assertTrue(self.scoreboard.is_banned(("10.0.0.1", 1)))
+        self.assertTrue(self.scoreboard.is_banned("::ffff:10.0.0.1"))
+        self.assertIsNone(self.scoreboard.score(PEER))
+
+    def test_latency_is_averaged(self):
+        self.scoreboard.record_latency(PEER, 1.0)
+        self.scoreboard.record_latency(PEER, 2.0)
+        self.assertAlmostEqual(self.scoreboard.records[PEER].latency, 1.3)
+
+
+class TestConnectionQuality(unittest.TestCase):
+
+    def setUp(self):
+        self.socket = Mock(spec=socket.socket)
+        self.storage = MockStorageManager(total_pieces=4)
+        self.scoreboard = PeerScoreboard()
+        self.conn = PeerConnection(
+            self.socket,
+            b"\x00" * 20,
+            b"-PC0001-123456789012",
+            self.storage,
+            address=PEER,
+            scoreboard=self.scoreboard,
+        )
+        self.conn.peer_choking = False
+        self.conn.peer_pieces = [True] * 4
+
+    def _fail_piece(self):
+        self.conn.request_blocks()
+        piece_index = self.conn.current_piece_index
+        with patch.object(self.storage, "piece_hash_valid", return_value=False):
+            self.conn.process_piece(struct.pack(">II", piece_index, 0) + b"\x01" * 16384)
+
+    def test_corrupt_pieces_get_the_sender_banned(self):
+        self._fail_piece()
+        self.assertTrue(self.conn.running)
+        self.assertEqual(self.scoreboard.records[PEER].hash_failures, 1)
+        self._fail_piece()
+        self.assertTrue(self.scoreboard.is_banned(PEER))
+        self.assertFalse(self.conn.running)
+
+    def test_block_latency_is_recorded(self):
+        self.conn.request_blocks()
+        self.conn.process_piece(struct.pack(">II", 0, 0) + b"\x00" * 16384)
+        self.assertIsNotNone(self.scoreboard.records[PEER].latency)
+
+    def test_unanswered_request_means_snubbed(self):
+        self.conn.request_blocks()
+        self.assertFalse(self.conn._is_snubbing())
+        self.conn._waiting_since -= connection_module.SNUB_TIMEOUT + 1
+        self.assertTrue(self.conn._is_snubbing())
+
+    def test_snubbing_peer_is_disconnected(self):
+        self.conn.request_blocks()
+        self.conn._waiting_since -= connection_module.SNUB_TIMEOUT + 1
+        self.conn.handle_peer_session()
+        self.assertTrue(self.conn.snubbed)
+        self.socket.recv.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
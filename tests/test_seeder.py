@@ -0,0 +1,360 @@
+import unittest
+import hashlib
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from src.peer import extensions, seeder as seeder_module
+from src.peer.ratelimit import RateLimits
+from src.peer.scoreboard import PeerScoreboard
+from src.peer.seeder import PeerListener, SeederServer
+from src.storage.file_manager import StorageManager
+from tests.test_peer_connection import MockStorageManager
+
+INFO_HASH = b"\x22" * 20
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def is_closed(sock):
+    """Drain whatever the server still sent and report whether it hung up"""
+    try:
+        while sock.recv(4096):
+            pass
+        return True
+    except ConnectionResetError:
+        return True
+    except socket.timeout:
+        return False
+
+
+class TestSeederServer(unittest.TestCase):
+
+    def _start(self, **kwargs):
+        self.storage = MockStorageManager(total_pieces=4)
+        self.storage.pieces_status = [True] * 4
+        server = SeederServer(
+            INFO_HASH, b"-PC0001-000000000000", self.storage, port=0, **kwargs
+        )
+        thread = threading.Thread(target=server.start, daemon=True)
+        thread.start()
+        self.assertTrue(server.listening.wait(2))
+        self.addCleanup(thread.join, 2)
+        self.addCleanup(server.stop)
+        return server
+
+    def _connect(self, server, handshake=True):
+        client = socket.create_connection(("127.0.0.1", server.port), timeout=2)
+        self.addCleanup(client.close)
+        if handshake:
+            client.sendall(
+                extensions.build_handshake(
+                    INFO_HASH, b"-XX0001-000000000000", b"\x00" * 8
+                )
+            )
+            self.assertEqual(len(recv_exact(client, 68)), 68)
+        return client
+
+    def test_serves_block_after_unchoke(self):
+        server = self._start()
+        client = self._connect(server)
+        bitfield = recv_exact(client, 6)
+        self.assertEqual(bitfield, struct.pack(">IBB", 2, 5, 0xF0))
+
+        client.sendall(struct.pack(">IB", 1, 2))
+        self.assertEqual(recv_exact(client, 5), struct.pack(">IB", 1, 1))
+        client.sendall(struct.pack(">IBIII", 13, 6, 1, 0, 1024))
+        header = recv_exact(client, 13)
+        self.assertEqual(header, struct.pack(">IBII", 9 + 1024, 7, 1, 0))
+        self.assertEqual(len(recv_exact(client, 1024)), 1024)
+
+    def test_upload_is_rate_limited_per_peer(self):
+        limits = RateLimits()
+        limits.peer_upload = 32 * 1024
+        server = self._start(limits=limits)
+        client = self._connect(server)
+        recv_exact(client, 6)
+        client.sendall(struct.pack(">IB", 1, 2))
+        recv_exact(client, 5)
+
+        # The 32 KiB burst covers two blocks, the third goes into debt and
+        # the fourth waits half a second for it to be paid off
+        started = time.monotonic()
+        for begin in range(0, 4 * 16384, 16384):
+            client.sendall(struct.pack(">IBIII", 13, 6, 0, begin % 16384, 16384))
+        for _ in range(4):
+            recv_exact(client, 13 + 16384)
+        self.assertGreater(time.monotonic() - started, 0.4)
+
+    def test_cancelled_request_is_not_served(self):
+        limits = RateLimits(upload=32 * 1024)
+        server = self._start(limits=limits)
+        client = self._connect(server)
+        recv_exact(client, 6)
+        client.sendall(struct.pack(">IB", 1, 2))
+        recv_exact(client, 5)
+
+        # Three blocks go out at once, the rest wait for tokens
+        for piece_index in range(4):
+            client.sendall(struct.pack(">IBIII", 13, 6, piece_index, 0, 16384))
+        client.sendall(struct.pack(">IBIII", 13, 8, 3, 0, 16384))
+        client.sendall(struct.pack(">IBIII", 13, 6, 1, 1024, 1024))
+
+        served = []
+        for _ in range(4):
+            length, _, piece_index, begin = struct.unpack(">IBII", recv_exact(client, 13))
+            recv_exact(client, length - 9)
+            served.append((piece_index, begin))
+        self.assertEqual(served, [(0, 0), (1, 0), (2, 0), (1, 1024)])
+
+    def test_per_ip_limit(self):
+        server = self._start(max_per_ip=2)
+        clients = [self._connect(server, handshake=False) for _ in range(3)]
+        self.assertTrue(is_closed(clients[2]))
+        self.assertTrue(wait_for(lambda: len(server.listener.connections) == 2))
+
+    def test_global_limit(self):
+        server = self._start(max_connections=1, max_per_ip=10)
+        first = self._connect(server)
+        second = self._connect(server, handshake=False)
+        self.assertTrue(is_closed(second))
+        self.assertEqual(len(server.listener.connections), 1)
+        first.close()
+        self.assertTrue(wait_for(lambda: not server.listener.connections))
+        self._connect(server)
+
+    def test_closed_connections_are_pruned(self):
+        server = self._start()
+        clients = [self._connect(server) for _ in range(4)]
+        self.assertTrue(wait_for(lambda: len(server.choker.peers) == 4))
+        for client in clients:
+            client.close()
+        self.assertTrue(wait_for(lambda: not server.listener.connections))
+        self.assertEqual(server.choker.peers, [])
+        self.assertEqual(server.listener._ip_counts, {})
+
+    def test_connections_do_not_spawn_threads(self):
+        server = self._start(max_per_ip=50)
+        before = threading.active_count()
+        for _ in range(20):
+            self._connect(server)
+        self.assertTrue(wait_for(lambda: len(server.listener.connections) == 20))
+        self.assertEqual(threading.active_count(), before)
+
+    def test_stalled_handshake_is_dropped(self):
+        with patch.object(seeder_module, "HANDSHAKE_TIMEOUT", 0.1):
+            server = self._start()
+            client = self._connect(server, handshake=False)
+            self.assertTrue(wait_for(lambda: server.listener.connections))
+            self.assertTrue(wait_for(lambda: not server.listener.connections))
+        self.assertTrue(is_closed(client))
+
+    def test_banned_peer_is_refused(self):
+        scoreboard = PeerScoreboard(max_hash_failures=1)
+        scoreboard.record_hash_failure([("127.0.0.1", 6881)])
+        server = self._start(scoreboard=scoreboard)
+        client = socket.create_connection(("127.0.0.1", server.port), timeout=2)
+        self.addCleanup(client.close)
+        client.sendall(extensions.build_handshake(INFO_HASH, b"-XX0001-000000000000"))
+        self.assertTrue(is_closed(client))
+
+    def test_wrong_info_hash_is_dropped(self):
+        server = self._start()
+        client = socket.create_connection(("127.0.0.1", server.port), timeout=2)
+        self.addCleanup(client.close)
+        client.sendall(extensions.build_handshake(b"\x33" * 20, b"-XX0001-000000000000"))
+        self.assertTrue(is_closed(client))
+
+    def test_super_seed_reveals_one_piece(self):
+        server = self._start(super_seed=True)
+        client = self._connect(server)
+        self.assertEqual(recv_exact(client, 6), struct.pack(">IBB", 2, 5, 0))
+        length, msg_id, offered = struct.unpack(">IBI", recv_exact(client, 9))
+        self.assertEqual((length, msg_id), (5, 4))
+
+        client.sendall(struct.pack(">IB", 1, 2))
+        self.assertEqual(recv_exact(client, 5), struct.pack(">IB", 1, 1))
+        other = (offered + 1) % 4
+        client.sendall(struct.pack(">IBIII", 13, 6, other, 0, 1024))
+        client.sendall(struct.pack(">IBIII", 13, 6, offered, 0, 1024))
+        # Only the offered piece is served
+        self.assertEqual(
+            recv_exact(client, 13), struct.pack(">IBII", 9 + 1024, 7, offered, 0)
+        )
+
+
+class TestSharedListener(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = PeerListener(port=0)
+        thread = threading.Thread(target=self.listener.start, daemon=True)
+        thread.start()
+        self.assertTrue(self.listener.listening.wait(2))
+        self.addCleanup(thread.join, 2)
+        self.addCleanup(self.listener.stop)
+
+    def _seed(self, info_hash, pieces_status):
+        storage = MockStorageManager(total_pieces=len(pieces_status))
+        storage.pieces_status = pieces_status
+        server = SeederServer(
+            info_hash, b"-PC0001-000000000000", storage, listener=self.listener
+        )
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def _handshake(self, info_hash):
+        client = socket.create_connection(("127.0.0.1", self.listener.port), timeout=2)
+        self.addCleanup(client.close)
+        client.sendall(
+            extensions.build_handshake(info_hash, b"-XX0001-000000000000", b"\x00" * 8)
+        )
+        return client
+
+    def test_handshakes_are_dispatched_by_info_hash(self):
+        first = self._seed(b"\x01" * 20, [True] * 8)
+        second = self._seed(b"\x02" * 20, [True, False, False, False])
+        self.assertEqual(first.port, second.port)
+
+        for info_hash, bitfield in ((b"\x02" * 20, 0x80), (b"\x01" * 20, 0xFF)):
+            client = self._handshake(info_hash)
+            response = recv_exact(client, 68)
+            self.assertEqual(response[28:48], info_hash)
+            self.assertEqual(
+                recv_exact(client, 6), struct.pack(">IBB", 2, 5, bitfield)
+            )
+
+    def test_unknown_info_hash_is_dropped(self):
+        self._seed(b"\x01" * 20, [True] * 8)
+        self.assertTrue(is_closed(self._handshake(b"\x09" * 20)))
+
+    def test_stopping_a_torrent_closes_its_peers(self):
+        first = self._seed(b"\x01" * 20, [True] * 8)
+        self._seed(b"\x02" * 20, [True] * 8)
+        clients = [self._handshake(b"\x01" * 20), self._handshake(b"\x02" * 20)]
+        for client in clients:
+            recv_exact(client, 68 + 6)
+
+        first.stop()
+        self.assertTrue(wait_for(lambda: len(self.listener.connections) == 1))
+        self.assertTrue(is_closed(clients[0]))
+        self.assertNotIn(b"\x01" * 20, self.listener.torrents)
+
+
+class TestSeederFileUploads(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        # Two files of 40 and 24 bytes: piece 2 spans both
+        self.content = bytes(range(64))
+        pieces = [self.content[i: i + 16] for i in range(0, 64, 16)]
+        torrent_info = {
+            "name": "upload",
+            "piece length": 16,
+            "pieces": b"".join(hashlib.sha1(p).digest() for p in pieces),
+            "files": [
+                {"length": 40, "path": ["a.bin"]},
+                {"length": 24, "path": ["b.bin"]},
+            ],
+        }
+        os.makedirs(os.path.join(self.tmp_dir, "upload"))
+        with open(os.path.join(self.tmp_dir, "upload", "a.bin"), "wb") as fh:
+            fh.write(self.content[:40])
+        with open(os.path.join(self.tmp_dir, "upload", "b.bin"), "wb") as fh:
+            fh.write(self.content[40:])
+        self.storage = StorageManager(torrent_info, self.tmp_dir)
+        self.assertTrue(all(self.storage.pieces_status))
+
+        self.server = SeederServer(
+            INFO_HASH, b"-PC0001-000000000000", self.storage, port=0
+        )
+        thread = threading.Thread(target=self.server.start, daemon=True)
+        thread.start()
+        self.assertTrue(self.server.listening.wait(2))
+        self.addCleanup(thread.join, 2)
+        self.addCleanup(self.server.stop)
+
+        self.client = self._connect()
+
+    def _connect(self):
+        """An interested, unchoked client"""
+        client = socket.create_connection(("127.0.0.1", self.server.port), timeout=2)
+        self.addCleanup(client.close)
+        client.sendall(
+            extensions.build_handshake(INFO_HASH, b"-XX0001-000000000000", b"\x00" * 8)
+        )
+        recv_exact(client, 68 + 5 + 1)
+        client.sendall(struct.pack(">IB", 1, 2))
+        self.assertEqual(recv_exact(client, 5), struct.pack(">IB", 1, 1))
+        return client
+
+    def _request(self, piece_index, begin, length):
+        self.client.sendall(struct.pack(">IBIII", 13, 6, piece_index, begin, length))
+        header = recv_exact(self.client, 13)
+        self.assertEqual(header, struct.pack(">IBII", 9 + length, 7, piece_index, begin))
+        return recv_exact(self.client, length)
+
+    def test_blocks_within_one_file_use_sendfile(self):
+        with patch.object(seeder_module, "USE_SENDFILE", True):
+            self.assertEqual(self._request(1, 4, 12), self.content[20:32])
+            self.assertEqual(self._request(3, 0, 16), self.content[48:64])
+        self.assertEqual(self.server.listener.piece_cache.stats()["misses"], 0)
+
+    def test_piece_shared_by_peers_is_cached(self):
+        with patch.object(seeder_module, "USE_SENDFILE", True):
+            self.assertEqual(self._request(1, 0, 8), self.content[16:24])
+            self.assertEqual(self.server.listener.piece_cache.stats()["pieces"], 0)
+            self.client = self._connect()
+            self.assertEqual(self._request(1, 8, 8), self.content[24:32])
+        self.assertEqual(self.server.listener.piece_cache.stats()["pieces"], 1)
+
+    def test_block_spanning_files_is_read_through_cache(self):
+        self.assertEqual(self._request(2, 0, 16), self.content[32:48])
+        self.assertEqual(self._request(2, 4, 8), self.content[36:44])
+        self.assertEqual(self.server.listener.piece_cache.stats()["pieces"], 1)
+
+    def test_buffered_fallback_without_sendfile(self):
+        with patch.object(seeder_module, "USE_SENDFILE", False):
+            self.assertEqual(self._request(0, 0, 16), self.content[:16])
+
+    def test_open_files_are_bounded(self):
+        a, b = (os.path.join(self.tmp_dir, "upload", n) for n in ("a.bin", "b.bin"))
+        with patch.object(seeder_module, "MAX_OPEN_FILES", 1):
+            first = self.server._open_file(a)
+            self.assertIs(self.server._open_file(a), first)
+            second = self.server._open_file(b)
+        self.assertEqual(list(self.server._files), [b])
+        self.server.stop()
+        self.assertTrue(second.closed)
+        self.assertEqual(self.server._files, {})
+
+    def test_request_past_piece_end_is_ignored(self):
+        self.client.sendall(struct.pack(">IBIII", 13, 6, 3, 8, 16))
+        self.assertEqual(self._request(0, 0, 4), self.content[:4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from src import session as session_module
+from src import state
+from src.peer.swarm import Swarm
+from src.session import Session
+
+
+class FakeLoader:
+    """Stands in for HandShakeTCP: runs until told to finish or stop"""
+
+    instances = []
+
+    def __init__(self, source, destination, **kwargs):
+        self.source = source
+        self.kwargs = kwargs
+        self.status = "downloading"
+        self.swarm = Swarm([("10.0.0.1", port) for port in range(1, 101)])
+        self.left = 1000
+        self.max_peers = 0
+        self.done = threading.Event()
+        FakeLoader.instances.append(self)
+
+    def handshake(self):
+        self.done.wait(5)
+        self.status = "stopped"
+
+    def stop(self):
+        self.done.set()
+
+    def bytes_left(self):
+        return self.left
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        state.reset()
+        FakeLoader.instances = []
+        patcher = patch.object(session_module, "HandShakeTCP", FakeLoader)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _session(self, **kwargs):
+        session = Session(**kwargs)
+        self.addCleanup(self._finish, session)
+        return session
+
+    def _finish(self, session):
+        for entry in session.torrents:
+            if entry.loader is not None:
+                entry.loader.stop()
+                entry.thread.join(5)
+
+    def _loader(self, source):
+        return next(l for l in FakeLoader.instances if l.source == source)
+
+    def test_downloads_beyond_the_limit_are_queued(self):
+        session = self._session(max_active_downloads=2)
+        entries = [session.add(f"{i}.torrent") for i in range(3)]
+        session.schedule()
+        self.assertEqual([e.status for e in entries], ["active", "active", "queued"])
+
+        loader = self._loader("0.torrent")
+        loader.stop()
+        entries[0].thread.join(5)
+        session.schedule()
+        self.assertEqual([e.status for e in entries], ["finished", "active", "active"])
+
+    def test_finished_download_frees_a_slot_for_seeding(self):
+        session = self._session(max_active_downloads=1)
+        first, second = session.add("a.torrent"), session.add("b.torrent")
+        session.schedule()
+        self._loader("a.torrent").status = "seeding"
+        session.schedule()
+        self.assertTrue(first.seeding)
+        self.assertEqual(second.status, "active")
+
+    def test_seeds_beyond_the_limit_wait_for_a_slot(self):
+        session = self._session(max_active_seeds=1)
+        first, second = session.add("a.torrent"), session.add("b.torrent")
+        session.schedule()
+        self._loader("a.torrent").status = "seeding"
+        first.seed_time = 100
+        self._loader("b.torrent").status = "seeding"
+        session.schedule()
+        # The torrent that seeded longest gives up its slot
+        self.assertEqual(first.status, "seed_queued")
+        self.assertTrue(second.seeding)
+
+        # It gets a slot back once one frees up
+        self._loader("b.torrent").stop()
+        second.thread.join(5)
+        first.thread.join(5)
+        session.schedule()
+        self.assertEqual(second.status, "finished")
+        session.schedule()
+        self.assertEqual(first.status, "active")
+
+    def test_paused_torrent_gives_up_its_slot(self):
+        session = self._session(max_active_downloads=1)
+        first, second = session.add("a.torrent"), session.add("b.torrent")
+        session.schedule()
+        session.pause(first)
+        session.schedule()
+        self.assertEqual(second.status, "active")
+        self.assertFalse(first.loader.kwargs["control"].is_stopped())
+
+    def test_higher_priority_leaves_the_queue_first(self):
+        session = self._session(max_active_downloads=1)
+        low = session.add("low.torrent")
+        high = session.add("high.torrent")
+        session.set_priority(high, 1)
+        session.schedule()
+        self.assertEqual((low.status, high.status), ("queued", "active"))
+
+    def test_remove_stops_only_that_torrent(self):
+        session = self._session()
+        first, second = session.add("a.torrent"), session.add("b.torrent")
+        session.schedule()
+        session.remove(first)
+        self.assertTrue(first.loader.kwargs["control"].is_stopped())
+        self.assertFalse(second.loader.kwargs["control"].is_stopped())
+        self.assertEqual(session.torrents, [second])
+
+    def test_peers_are_allocated_by_need(self):
+        session = self._session(max_peers=40)
+        session.add("big.torrent"), session.add("small.torrent")
+        session.schedule()
+        big, small = self._loader("big.torrent"), self._loader("small.torrent")
+        big.left, small.left = 3000, 1000
+        session.schedule()
+        self.assertEqual((big.max_peers, small.max_peers), (30, 10))
+
+        # Slots a small swarm can't use go to the other torrent
+        big.swarm = Swarm([("10.0.0.1", 1), ("10.0.0.2", 1), ("10.0.0.3", 1)])
+        session.schedule()
+        self.assertEqual((big.max_peers, small.max_peers), (3, 37))
+
+    def test_extreme_priorities_are_clamped(self):
+        session = self._session(max_peers=40)
+        low, high = session.add("low.torrent"), session.add("high.torrent")
+        session.set_priority(low, -(10**6))
+        session.set_priority(high, 10**6)
+        self.assertEqual(
+            (low.control.priority, high.control.priority),
+            (session_module.MIN_PRIORITY, session_module.MAX_PRIORITY),
+        )
+        session.schedule()
+        session.schedule()
+        low, high = self._loader("low.torrent"), self._loader("high.torrent")
+        self.assertGreaterEqual(low.max_peers, session_module.MIN_PEERS_PER_TORRENT)
+        self.assertGreater(high.max_peers, low.max_peers)
+
+    def test_negative_priority_gets_whole_slots(self):
+        session = self._session(max_peers=40)
+        low, normal = session.add("low.torrent"), session.add("normal.torrent")
+        session.set_priority(low, -1)
+        session.schedule()
+        session.schedule()
+        low, normal = self._loader("low.torrent"), self._loader("normal.torrent")
+        self.assertIsInstance(low.max_peers, int)
+        self.assertIsInstance(normal.max_peers, int)
+        self.assertEqual((low.max_peers, normal.max_peers), (13, 26))
+
+    def test_run_returns_when_all_torrents_finish(self):
+        session = self._session()
+        entry = session.add("a.torrent")
+        with patch.object(session_module, "SCHEDULE_INTERVAL", 0.01):
+            runner = threading.Thread(target=session.run)
+            runner.start()
+            while entry.loader is None:
+                time.sleep(0.01)
+            entry.loader.stop()
+            runner.join(5)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(entry.status, "finished")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -122,5 +122,94 @@ class TestStateThreadSafety(unittest.TestCase):
         self.assertGreater(check_count["after_stop"], 0)
 
 
+class TestControl(unittest.TestCase):
+
+    def setUp(self):
+        state.reset()
+        self.session = state.Control(state.root())
+        self.torrent = state.Control(self.session)
+        self.other = state.Control(self.session)
+
+    def tearDown(self):
+        state.reset()
+
+    def test_stop_reaches_children_only(self):
+        self.torrent.stop()
+        self.assertTrue(self.torrent.is_stopped())
+        self.assertFalse(self.other.is_stopped())
+        self.assertFalse(self.session.is_stopped())
+
+        self.session.stop()
+        self.assertTrue(self.other.is_stopped())
+        self.assertFalse(self.torrent.wait_if_paused())
+
+    def test_process_stop_reaches_every_torrent(self):
+        with patch('sys.stdout', new=StringIO()):
+            state.stop()
+        self.assertTrue(self.torrent.is_stopped())
+        self.assertTrue(self.other.is_stopped())
+        # Controls created afterwards start out stopped
+        self.assertTrue(state.Control(self.session).is_stopped())
+
+    def test_pause_is_per_torrent(self):
+        self.torrent.pause()
+        self.assertTrue(self.torrent.is_paused())
+        self.assertTrue(self.other.wait_if_paused())
+
+        resumed = threading.Event()
+
+        def waiter():
+            self.torrent.wait_if_paused()
+            resumed.set()
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        self.assertFalse(resumed.wait(0.1))
+        self.torrent.resume()
+        self.assertTrue(resumed.wait(1))
+        thread.join()
+
+    def test_parent_pause_blocks_children(self):
+        self.session.pause()
+        thread = threading.Thread(target=self.torrent.wait_if_paused)
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        self.session.resume()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+
+    def test_stop_wakes_a_child_of_a_paused_parent(self):
+        self.session.pause()
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(self.torrent.wait_if_paused())
+        )
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        # Removed while the whole session is paused
+        self.torrent.stop()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [False])
+        self.assertTrue(self.session.is_paused())
+
+    def test_stop_callbacks(self):
+        calls = []
+        self.torrent.on_stop(lambda: calls.append("a"))
+        unregister = self.torrent.on_stop(lambda: calls.append("b"))
+        unregister()
+        self.session.stop()
+        self.assertEqual(calls, ["a"])
+        # Registering after the stop runs the callback at once
+        self.torrent.on_stop(lambda: calls.append("c"))
+        self.assertEqual(calls, ["a", "c"])
+
+    def test_wait_stopped_wakes_on_stop(self):
+        threading.Timer(0.05, self.torrent.stop).start()
+        self.assertTrue(self.torrent.wait_stopped(2))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from src.peer.superseed import SuperSeeder
+
+
+class TestSuperSeeder(unittest.TestCase):
+
+    def setUp(self):
+        self.seeder = SuperSeeder(num_pieces=4)
+
+    def test_each_leecher_is_offered_a_different_piece(self):
+        offers = [self.seeder.peer_joined(peer) for peer in ("a", "b", "c", "d")]
+        self.assertEqual(sorted(offers), [0, 1, 2, 3])
+        self.assertTrue(self.seeder.may_serve("a", offers[0]))
+        self.assertFalse(self.seeder.may_serve("a", offers[1]))
+
+    def test_next_piece_waits_until_offer_is_seen_elsewhere(self):
+        first = self.seeder.peer_joined("a")
+        self.seeder.peer_joined("b")
+
+        # a downloading its own piece doesn't earn it another one
+        self.assertEqual(self.seeder.peer_has("a", first), [])
+
+        offers = self.seeder.peer_has("b", first)
+        self.assertEqual(len(offers), 1)
+        peer, piece = offers[0]
+        self.assertEqual(peer, "a")
+        self.assertNotEqual(piece, first)
+        self.assertTrue(self.seeder.may_serve("a", piece))
+
+    def test_rarest_piece_is_revealed_first(self):
+        self.seeder.peer_joined("seed")
+        self.seeder.peer_bitfield("seed", [0, 1, 2])
+        self.seeder.peer_joined("x")
+        self.seeder.peer_bitfield("x", [0, 1])
+        self.assertEqual(self.seeder.peer_joined("c"), 3)
+
+    def test_bitfield_replaces_unneeded_offer(self):
+        first = self.seeder.peer_joined("a")
+        self.seeder.peer_joined("b")
+        offers = self.seeder.peer_bitfield("a", [first])
+        self.assertEqual(len(offers), 1)
+        self.assertNotEqual(offers[0][1], first)
+        # An initial bitfield is not evidence that b's piece spread
+        self.assertEqual(len(self.seeder.offered["b"]), 1)
+
+    def test_lone_leecher_is_not_stalled(self):
+        first = self.seeder.peer_joined("a")
+        offers = self.seeder.peer_has("a", first)
+        self.assertEqual(len(offers), 1)
+        self.assertNotEqual(offers[0][1], first)
+
+    def test_peer_left_forgets_its_pieces(self):
+        first = self.seeder.peer_joined("a")
+        self.seeder.peer_bitfield("a", [3] if first != 3 else [2])
+        self.seeder.peer_left("a")
+        self.assertEqual(self.seeder.seen, [0] * 4)
+        self.assertEqual(self.seeder.offer_counts, [0] * 4)
+        self.assertTrue(self.seeder.may_serve("a", 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
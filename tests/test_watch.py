@@ -0,0 +1,147 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import bcoding
+
+from src import state
+from src.session import Session
+from src.watch import DirectoryWatcher, Inotify
+
+
+class TestDirectoryWatcher(unittest.TestCase):
+
+    def setUp(self):
+        state.reset()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = self.tmp.name
+        self.session = Session()
+
+    def _write(self, name, length=1024, data=None):
+        if data is None:
+            info = {
+                "name": f"{length}.bin",
+                "length": length,
+                "piece length": 256,
+                "pieces": b"\x00" * 80,
+            }
+            data = bcoding.bencode({"announce": "http://example.com", "info": info})
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def _watcher(self, **kwargs):
+        watcher = DirectoryWatcher(self.session, self.dir, **kwargs)
+        self.addCleanup(watcher._executor.shutdown)
+        return watcher
+
+    def _drain(self, watcher):
+        deadline = time.monotonic() + 5
+        while watcher._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _listing(self, folder):
+        return sorted(os.listdir(os.path.join(self.dir, folder)))
+
+    def test_adds_new_torrents_and_moves_them_aside(self):
+        self._write("a.torrent")
+        self._write("notes.txt", data=b"hello")
+        watcher = self._watcher()
+        watcher.scan(settle=False)
+        self._drain(watcher)
+
+        [entry] = self.session.torrents
+        self.assertEqual(entry.source, os.path.join(self.dir, "added", "a.torrent"))
+        self.assertEqual(len(entry.info_hash), 20)
+        self.assertEqual(self._listing("added"), ["a.torrent"])
+        self.assertIn("notes.txt", os.listdir(self.dir))
+
+    def test_duplicates_and_broken_files(self):
+        self._write("a.torrent")
+        self._write("copy.torrent")
+        self._write("broken.torrent", data=b"not bencoded")
+        watcher = self._watcher()
+        watcher.scan(settle=False)
+        self._drain(watcher)
+
+        self.assertEqual(len(self.session.torrents), 1)
+        self.assertEqual(len(self._listing("duplicate")), 1)
+        self.assertEqual(self._listing("failed"), ["broken.torrent"])
+
+    def test_torrents_added_elsewhere_are_duplicates(self):
+        # Queued from the command line or RPC, before its loader has run
+        other = tempfile.TemporaryDirectory()
+        self.addCleanup(other.cleanup)
+        source = os.path.join(other.name, "cli.torrent")
+        os.rename(self._write("cli.torrent"), source)
+        entry = self.session.add(source)
+        self.assertIsNone(entry.loader)
+        self.assertEqual(len(entry.info_hash), 20)
+
+        self._write("a.torrent")
+        watcher = self._watcher()
+        watcher.scan(settle=False)
+        self._drain(watcher)
+        self.assertEqual(self.session.torrents, [entry])
+        self.assertEqual(self._listing("duplicate"), ["a.torrent"])
+
+    def test_polling_waits_for_files_to_settle(self):
+        watcher = self._watcher()
+        path = self._write("a.torrent")
+        watcher.scan()
+        self.assertEqual(self.session.torrents, [])
+        self.assertTrue(os.path.exists(path))
+
+        # Unchanged since the last poll: picked up
+        watcher.scan()
+        self._drain(watcher)
+        self.assertEqual(len(self.session.torrents), 1)
+
+    def test_name_clashes_keep_both_files(self):
+        self._write("a.torrent", length=1)
+        watcher = self._watcher()
+        watcher.scan(settle=False)
+        self._drain(watcher)
+        self._write("a.torrent", length=2)
+        watcher.scan(settle=False)
+        self._drain(watcher)
+        self.assertEqual(self._listing("added"), ["a-1.torrent", "a.torrent"])
+
+    def test_watch_loop_picks_up_new_files(self):
+        watcher = self._watcher(poll_interval=0.05)
+        thread = threading.Thread(target=watcher.start, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 2)
+        self.addCleanup(watcher.stop)
+
+        # Written elsewhere and moved in, as spooling tools do
+        staging = self._write("b.tmp")
+        os.replace(staging, os.path.join(self.dir, "b.torrent"))
+        deadline = time.monotonic() + 3
+        while not self.session.torrents and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(len(self.session.torrents), 1)
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class TestInotify(unittest.TestCase):
+
+    def test_reports_finished_files(self):
+        with tempfile.TemporaryDirectory() as path:
+            inotify = Inotify(path)
+            try:
+                self.assertEqual(inotify.read(0), [])
+                with open(os.path.join(path, "a.torrent"), "wb") as f:
+                    f.write(b"x")
+                self.assertEqual(inotify.read(1), ["a.torrent"])
+            finally:
+                inotify.close()
+
+
+if __name__ == "__main__":
+    unittest.main()